@@ -1,6 +1,13 @@
 #!/usr/bin/python3
-import sys, argparse
+import sys, os, argparse, json, shlex
 import read_fasta as rf, dna_orfs as orf, dna_nrepeats as nreps
+import fasta_index as fidx, dna_motifs as motifs
+import dna_parallel as parallel, dna_chunks as chunks
+import result_cache as rcache, stage_profile as prof, summary_db as sdb
+import fasta_client as client
+
+FRAME_ERROR = "Reading frame parameter must be 1, 2, 3, -1, -2, -3, 0 or {}!".\
+              format(orf.ALL_FRAMES)
 
 def main() :
     """
@@ -17,39 +24,55 @@ def main() :
     """
     file_fasta = sys.argv[1]     # FASTA file, required regardless of option
     
-    parser = argparse.ArgumentParser()
-    parser.add_argument('filename', nargs=1)
-    parser.add_argument("--record_count", action='store_true',
-    help="Return the number of records in the input FASTA file")
-    parser.add_argument("--longest_seq", action='store_true',
-    help="Return the length of the longest sequence in the input FASTA file")
-    parser.add_argument("--shortest_seq", action='store_true',
-    help="Return the length of the longest sequence in the input FASTA file")
-    parser.add_argument("--longest_orf", type=int, nargs=1,
-    help="Return the longest open reading frame (ORF) for reading frames \
-    1, 2, 3, or all (0)")
-    parser.add_argument("--lorf_in_seq", nargs=2,
-    help="Return the length of the longest open reading frame (ORF) for a \
-    given sequence for reading frames 1, 2, 3, or all (0)")
-    parser.add_argument("--mfrepeat_occurs", type=int, nargs=1,
-    help="Return the most frequently occuring repeat of size n")
-    parser.add_argument("--get_max_nrepeats", type=int, nargs=1,
-    help="Return all repeats of size n that have the highest frequency of \
-    occurance")
-    parser.add_argument("--seq_occurs", nargs=1,
-    help="Return the the number of occurances of a nucleotide sequence")
-    
+    parser = getArgParser()
     args = parser.parse_args()
+    batch = args.batch or args.query_file
+    if args.server :
+        # Answered by a running fasta_server.py, printed as in batch mode.
+        try :
+            reply = client.queryServer(args.server, file_fasta, sys.argv[2:])
+        except (IOError, client.http.client.HTTPException) as e :
+            print("Can't reach the server at {}: {}".format(args.server, e))
+            sys.exit(1)
+        sys.exit(client.printReply(reply))
+    if args.profile : prof.enable()
     if args.filename :
-        data_fasta = rf.readFasta(file_fasta)  # Always read the FASTA file.
+        try :
+            open(file_fasta).close()
+            if not batch : print("FASTA file read successfully.")
+        except IOError :
+            print("File doesn't exist!  Exiting.")
+            sys.exit(0)
     else :
         print("FASTA data file needs to be specified")
         sys.exit(1)
+    cache = None
+    if args.cache :
+        cache_dir = args.cache_dir[0] if args.cache_dir else \
+                    rcache.DEFAULT_CACHE_DIR
+        max_bytes = args.cache_size[0] * 2**20 if args.cache_size else \
+                    rcache.DEFAULT_MAX_BYTES
+        cache = rcache.ResultCache(cache_dir, max_bytes)
+    summaries = None
+    if args.summary_db is not None :
+        summaries = sdb.SummaryDB(args.summary_db or \
+                                  sdb.getSummaryDbPath(file_fasta))
+    data_fasta = FastaAnalysis(file_fasta, cache, args.jobs, args.orf_backend,
+                               keep_products=batch, verbose=not batch,
+                               chunk_size=args.chunk_size,
+                               summary_db=summaries,
+                               suffix_index=openSuffixIndex(file_fasta,
+                                                            args.suffix_index))
     
-    if args.record_count :
-        print("Record count = {}".format(getRecordCount(data_fasta)))
+    if batch :
+        queries = getQueries(args)
+        if args.query_file :
+            queries += readQueryFile(args.query_file[0], parser, file_fasta)
+        print(json.dumps(runQueries(data_fasta, queries), indent=2))
+    elif args.record_count :
+        print("Record count = {}".format(data_fasta.getRecordCount()))
     elif args.longest_seq :
-        long_seq = getShortLongSeqs(data_fasta, shortest=False)
+        long_seq = data_fasta.getShortLongSeqs(shortest=False)
         print("                 Length of longest sequence = {}".\
         format(long_seq[0]))
         print("Count of sequences that have longest length = {}".\
@@ -58,7 +81,7 @@ def main() :
         for seq in long_seq[2] :
             print(seq)
     elif args.shortest_seq :
-        short_seq = getShortLongSeqs(data_fasta, shortest=True)
+        short_seq = data_fasta.getShortLongSeqs(shortest=True)
         print("                 Length of shortest sequence = {}".\
         format(short_seq[0]))
         print("Count of sequences that have shortest length = {}".\
@@ -68,17 +91,28 @@ def main() :
             print(seq)
     elif args.longest_orf :
         rframe = args.longest_orf[0]
-        lorf = orf.getShortLongestORFsInAll(data_fasta, False, rframe)
-        if rframe in (1, 2, 3) :
-            print("longest ORF in reading frame {} = {}".format(rframe, lorf[0]))
-            print("start index of this ORF is {}".format(lorf[1]))
-            print("seq_id of this ORF is {}".format(lorf[2]))
-        elif rframe == 0 :
-            print("longest ORF in all reading frames = {}".format(lorf[0]))
+        lorf = data_fasta.getShortLongestORFsInAll(False, rframe)
+        if lorf != -1 :
+            print("longest ORF in {} = {}".format(getFramesName(rframe),
+                                                  lorf[0]))
             print("start index of this ORF is {}".format(lorf[1]))
             print("seq_id of this ORF is {}".format(lorf[2]))
         else :
-            print("Reading frame parameter must be 1, 2, 3, or 0!")
+            print(FRAME_ERROR)
+    elif args.longest_orfs or args.shortest_orfs :
+        want_shortest = not args.longest_orfs
+        k, rframe = args.shortest_orfs if want_shortest else args.longest_orfs
+        top_orfs = data_fasta.getTopORFs(k, rframe, want_shortest)
+        if top_orfs == -1 :
+            print(FRAME_ERROR)
+        else :
+            print("{} {} ORFs in {}:".format(k,
+                  "shortest" if want_shortest else "longest",
+                  getFramesName(rframe)))
+            print("\t".join(("length", "start", "reading_frame", "seq_id")))
+            for length, start, seq_id, orf_frame in top_orfs :
+                print("{}\t{}\t{}\t{}".format(length, start, orf_frame,
+                                               seq_id))
     elif args.lorf_in_seq :
         sid = args.lorf_in_seq[0]
         try :
@@ -86,19 +120,19 @@ def main() :
         except:
             print("Reading frame could not be interpretted as a digit.")
             sys.exit(0)
-        lorf_seq = orf.getLengthLongestORF(data_fasta, sid, rframe)
+        lorf_seq = data_fasta.getLengthLongestORF(sid, rframe)
         print("sid: {}".format(sid))
         print("rframe: {}".format(rframe))
-        if (rframe == 0) or (rframe in (1, 2, 3)) :
+        if orf.getReadingFrames(rframe) is not None :
             print("For sequence: {}, ".format(sid))
-            if rframe == 0 :
+            if rframe in (0, orf.ALL_FRAMES) :
                 print("longest ORF is in reading frame {} with length = {}".\
                 format(lorf_seq[1], lorf_seq[0]))
             else :
                 print("longest ORF in reading frame {} is {}".\
                 format(lorf_seq[1], lorf_seq[0]))
         else :
-            print("getLengthLongestORF expecting reading_frame to be 0-3.")
+            print(FRAME_ERROR)
             sys.exit(0)
     elif args.mfrepeat_occurs :
         try :
@@ -106,10 +140,10 @@ def main() :
         except:
             print("Size of repeat could not be interpretted as a digit.")
             sys.exit(0)
-        mf_repeat = nreps.getFirstMostFrequentRepeatN(data_fasta, n)
+        mf_repeat = data_fasta.getFirstMostFrequentRepeatN(n)
         print("First instance of most frequently occuring repeat of size \
 {} is {}".format(n, mf_repeat))
-        mf_repeat_count = nreps.getAllOccsOfRepeat(data_fasta, mf_repeat)
+        mf_repeat_count = data_fasta.getAllOccsOfRepeat(mf_repeat)
         print("Repeat {} occurs a total of {} times in the input FASTA file.".\
         format(mf_repeat, mf_repeat_count))
     elif args.get_max_nrepeats :
@@ -118,25 +152,689 @@ def main() :
         except:
             print("Size of repeat could not be interpretted as a digit.")
             sys.exit(0)
-        mf_repeats = nreps.getAllMostFrequentRepeatN(data_fasta, n)
+        mf_repeats = data_fasta.getAllMostFrequentRepeatN(n)
         print("Size {} repeats that occur with the highest frequency".\
         format(n))
         print("occur {} times.  These sequences are:".format(len(mf_repeats[0])))
         for repeat in mf_repeats[0] :
             print(repeat)
         print("Each of these repeats occur {} times.".format(mf_repeats[1]))
-    elif args.seq_occurs :
-        seq = args.seq_occurs[0]
-        seq_count = nreps.getAllOccsOfRepeat(data_fasta, seq)
-        print("The sequence {} occurs a total of {} in the data file".format(seq, seq_count))
+    elif args.top_repeats :
+        n, k = args.top_repeats
+        print("{} most frequent repeats of size {} in a single sequence:".\
+        format(k, n))
+        print("\t".join(("count", "repeat", "first_index", "seq_id")))
+        for count, repeat, seq_id, index in data_fasta.getTopRepeats(n, k) :
+            print("{}\t{}\t{}\t{}".format(count, repeat, index, seq_id))
+    elif args.seq_occurs or args.motif_file :
+        seqs = args.seq_occurs if args.seq_occurs else []
+        if args.motif_file :
+            seqs = seqs + motifs.readMotifFile(args.motif_file[0])
+        if len(seqs) == 1 :
+            seq = seqs[0]
+            seq_count = data_fasta.getAllOccsOfRepeat(seq)
+            print("The sequence {} occurs a total of {} in the data file".format(seq, seq_count))
+        else :
+            seq_counts = data_fasta.getOccsOfRepeatInAllSeqs(seqs)
+            printMotifCounts(seq_counts, seqs)
     else :
         print("This option is not implemented.")
 
+    if args.profile == '-' :
+        prof.printReport()
+    elif args.profile :
+        prof.writeReport(args.profile)
+
+def positiveInt(value) :
+    """ argparse type of the counts given on the command line: an integer
+    of at least 1.
+    """
+    number = int(value)
+    if number < 1 :
+        raise argparse.ArgumentTypeError("{} is not a positive integer".\
+                                         format(value))
+    return number
+
+class _TopORFsAction(argparse.Action) :
+    """ Stores the k and n of --longest_orfs and --shortest_orfs, rejecting
+    a k that isn't a positive integer (n is a reading frame).
+    """
+    def __call__(self, parser, namespace, values, option_string=None) :
+        if values[0] < 1 :
+            raise argparse.ArgumentError(self, "k must be a positive \
+integer, not {}".format(values[0]))
+        setattr(namespace, self.dest, values)
+
+def getArgParser() :
+    """ Returns the argparse.ArgumentParser of the command line options. """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', nargs=1)
+    parser.add_argument("--record_count", action='store_true',
+    help="Return the number of records in the input FASTA file")
+    parser.add_argument("--longest_seq", action='store_true',
+    help="Return the length of the longest sequence in the input FASTA file")
+    parser.add_argument("--shortest_seq", action='store_true',
+    help="Return the length of the longest sequence in the input FASTA file")
+    parser.add_argument("--longest_orf", type=int, nargs=1,
+    help="Return the longest open reading frame (ORF) for reading frames \
+    1, 2, 3, -1, -2, -3 (reverse strand), all forward frames (0) or all six \
+    frames (6)")
+    parser.add_argument("--lorf_in_seq", nargs=2,
+    help="Return the length of the longest open reading frame (ORF) for a \
+    given sequence for reading frames 1, 2, 3, -1, -2, -3, all forward \
+    frames (0) or all six frames (6)")
+    parser.add_argument("--longest_orfs", type=int, nargs=2,
+    action=_TopORFsAction, metavar=('k', 'n'), help="Return the k longest ORFs over all sequences \
+    for reading frame n, as for --longest_orf")
+    parser.add_argument("--shortest_orfs", type=int, nargs=2,
+    action=_TopORFsAction, metavar=('k', 'n'), help="Return the k shortest ORFs over all sequences \
+    for reading frame n, as for --longest_orf")
+    parser.add_argument("--orf_backend", choices=['python', 'numpy'],
+    default='python', help="Engine used by the ORF options: python \
+    (default) or numpy (requires NumPy)")
+    parser.add_argument("--jobs", type=int, default=1,
+    help="Number of worker processes used to analyze the records (default \
+    1, 0 = one per CPU)")
+    parser.add_argument("--chunk_size", type=int,
+    help="Analyze records longer than this many bases in windows of this \
+    size, read through the FASTA index, so that they are never held in \
+    memory whole.  The results are the same")
+    parser.add_argument("--cache", action='store_true',
+    help="Save the intermediate results (the length, longest ORFs, most \
+    frequent repeats and repeat counts of every sequence) in the result \
+    cache and reuse them on later runs.  Off by default: they are held in \
+    memory for every sequence")
+    parser.add_argument("--cache_dir", "--cache-dir", nargs=1,
+    help="Directory of the result cache (default {})".format(\
+    rcache.DEFAULT_CACHE_DIR))
+    parser.add_argument("--cache_size", "--cache-size", type=int, nargs=1,
+    help="Maximum size of the result cache in MB (default {})".format(\
+    rcache.DEFAULT_MAX_BYTES // 2**20))
+    parser.add_argument("--summary_db", "--summary-db", nargs='?', const='',
+    metavar='FILE', help="Keep the length, shortest and longest ORFs and most \
+    frequent repeats of every record in the SQLite database FILE (default \
+    <fastafile>.sdb) and only analyze new or changed records on later runs")
+    parser.add_argument("--suffix_index", "--suffix-index",
+    action='store_true', help="Build the suffix index of the file \
+    (<fastafile>.sfx, requires NumPy) if it's missing or out of date.  \
+    --mfrepeat_occurs, --get_max_nrepeats and --seq_occurs are answered \
+    from the index whenever it's up to date, for repeats of any length")
+    parser.add_argument("--mfrepeat_occurs", type=int, nargs=1,
+    help="Return the most frequently occuring repeat of size n")
+    parser.add_argument("--get_max_nrepeats", type=int, nargs=1,
+    help="Return all repeats of size n that have the highest frequency of \
+    occurance")
+    parser.add_argument("--top_repeats", type=positiveInt, nargs=2,
+    metavar=('n', 'k'), help="Return the k repeats of size n that occur \
+    most often in a single sequence, with that sequence")
+    parser.add_argument("--seq_occurs", nargs='+',
+    help="Return the the number of occurances of a nucleotide sequence. \
+    If several sequences are given, return the number of occurances of each \
+    one in each record")
+    parser.add_argument("--motif_file", nargs=1,
+    help="Same as --seq_occurs for the nucleotide sequences listed (one per \
+    line) in the given file")
+    parser.add_argument("--batch", action='store_true',
+    help="Answer every option given in one pass over the file and print \
+    the results as JSON")
+    parser.add_argument("--query_file", nargs=1,
+    help="Batch mode (see --batch) for the options listed in the given \
+    file, one query per line, e.g. --longest_orf 0")
+    parser.add_argument("--server", nargs='?', const=client.DEFAULT_ADDRESS,
+    metavar='ADDRESS', help="Send the query to a running fasta_server.py at \
+    ADDRESS, host:port or the path of a Unix socket (default {}), and print \
+    the results as JSON as with --batch".format(client.DEFAULT_ADDRESS))
+    parser.add_argument("--profile", nargs='?', const='-', metavar='FILE',
+    help="Time each stage of the analysis and count the records, bases, \
+    codons, ORFs and k-mers processed.  The breakdown is printed to stderr, \
+    or written as JSON to FILE if one is given")
+
+    return parser
+
+class FastaAnalysis(object) :
+    """ Answers the questions of main() about the FASTA file file_fasta.
+
+    By default each answer streams the file through the functions of
+    dna_orfs and dna_nrepeats.  With a result_cache.ResultCache, or with
+    keep_products = True, answers are derived from intermediate products
+    instead: the length of each sequence, the longest ORF of each sequence
+    per reading frame, the most frequent repeats of each sequence per repeat
+    size and the number of occurances of each repeat in each sequence.  Only
+    these per sequence reductions are kept, never the full ORF lists or
+    k-mer tables, so their size grows with the number of records and not
+    with the length of the sequences.  Products are kept
+    in memory for the life of the object and saved in the cache, if any,
+    under a digest of the file content so later runs can reuse them.
+
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
+    orf_backend - 'python' or 'numpy' (see dna_orfs.getFramesORFs)
+    verbose - if True, print the same progress messages as the functions
+              of dna_orfs
+    chunk_size - if given, records are read through dna_chunks.ChunkedFasta
+                 and those longer than chunk_size bases are analyzed in
+                 windows of chunk_size bases
+    summary_db - if given, a summary_db.SummaryDB from which the sequence
+                 lengths, longest and shortest ORFs and most frequent
+                 repeats are answered, analyzing only the records it
+                 doesn't have yet
+    preload - if True, the records are read once into memory and every
+              answer reads them from there instead of the file
+    suffix_index - if given, a suffix_index.SuffixIndexedFasta of the file
+                   from which the most frequent repeats and the number of
+                   occurances of repeats are answered
+    """
+    def __init__(self, file_fasta, cache=None, jobs=1, orf_backend='python',
+                 keep_products=False, verbose=True, chunk_size=None,
+                 summary_db=None, preload=False, suffix_index=None) :
+        self.file_fasta = file_fasta
+        self._records = None
+        if preload :
+            self._records = list(rf.iterFasta(file_fasta, verbose=False))
+            self._seqs = {rec[0] : rec[-1] for rec in self._records}
+        self.chunk_size = chunk_size
+        self.summary_db = summary_db
+        self.suffix_index = suffix_index
+        self._summaries = (set(), set(), None)   # frames, sizes, summaries
+        self.cache = cache
+        self.jobs = jobs
+        self.orf_backend = orf_backend
+        self.verbose = verbose
+        self.use_products = keep_products or cache is not None
+        self._products = {}
+        self._digest = None
+
+    def getRecords(self) :
+        """ Returns a new iterator over the records of the file, or a
+        dna_chunks.ChunkedFasta if chunk_size was given.
+        """
+        if self._records is not None :
+            return iter(self._records)
+        if self.chunk_size :
+            return chunks.ChunkedFasta(self.file_fasta, self.chunk_size,
+                                       self.jobs)
+        return rf.iterFasta(self.file_fasta, verbose=False)
+
+    def _getCacheKey(self, analysis, params) :
+        if self._digest is None :
+            self._digest = self.cache.getDigest(self.file_fasta)
+        return self.cache.getKey(self._digest, analysis, params)
+
+    def _hasProduct(self, analysis, params) :
+        """ Returns True if a product is available.  A cached one is loaded
+        into memory now, so entries evicted by later puts aren't lost.
+        """
+        try :
+            self._getProduct(analysis, params)
+            return True
+        except KeyError :
+            return False
+
+    def _getProduct(self, analysis, params) :
+        """ Returns a product or raises KeyError if it isn't available. """
+        key = (analysis, tuple(params.items()))
+        if key not in self._products :
+            if self.cache is None : raise KeyError(key)
+            self._products[key] = self.cache.get(self._getCacheKey(analysis,
+                                                                   params))
+        return self._products[key]
+
+    def _putProduct(self, analysis, params, value) :
+        self._products[(analysis, tuple(params.items()))] = value
+        if self.cache is not None :
+            self.cache.put(self._getCacheKey(analysis, params), value)
+
+    def computeProducts(self, lengths=False, reading_frames=(), kmer_sizes=(),
+                        repeats=()) :
+        """ Makes sure the requested products are available, computing the
+        missing ones together in a single pass over the file.
+
+        lengths - if True, the length of each sequence
+        reading_frames - reading frames whose longest ORFs are needed
+        kmer_sizes - repeat sizes whose most frequent repeats are needed
+        repeats - repeats whose number of occurances are needed
+        """
+        lengths = lengths and not self._hasProduct('seq_lengths', {})
+        frames = [rframe for rframe in dict.fromkeys(reading_frames) \
+                  if not self._hasProduct('longest_orf', {'frame' : rframe})]
+        sizes = [n for n in dict.fromkeys(kmer_sizes) \
+                 if not self._hasProduct('most_frequent', {'n' : n})]
+        reps = [rep for rep in dict.fromkeys(r.lower() for r in repeats) \
+                if not self._hasProduct('repeat_occurs', {'repeat' : rep})]
+        if not (lengths or frames or sizes or reps) : return
+        automaton = motifs.buildMotifAutomaton(reps) if reps else None
+        seq_lengths = {}
+        frames_orf = {rframe : {} for rframe in frames}
+        most_frequent = {n : {} for n in sizes}
+        occurs = {rep : {} for rep in reps}
+        for sid, (length, seq_orf, seq_repeats, counts) in parallel.mapSeqs(\
+            getRecordProducts, self.getRecords(),
+            (frames, sizes, automaton, self.orf_backend), self.jobs) :
+            seq_lengths[sid] = length
+            for rframe in frames : frames_orf[rframe][sid] = seq_orf[rframe]
+            for n in sizes : most_frequent[n][sid] = seq_repeats[n]
+            for rep, count in zip(reps, counts) : occurs[rep][sid] = count
+        if lengths : self._putProduct('seq_lengths', {}, seq_lengths)
+        for rframe in frames :
+            self._putProduct('longest_orf', {'frame' : rframe},
+                             frames_orf[rframe])
+        for n in sizes :
+            self._putProduct('most_frequent', {'n' : n}, most_frequent[n])
+        for rep in reps :
+            self._putProduct('repeat_occurs', {'repeat' : rep}, occurs[rep])
+
+    def getSeqLengths(self) :
+        """ Returns a dictionary with the length of each sequence. """
+        self.computeProducts(lengths=True)
+        return self._getProduct('seq_lengths', {})
+
+    def getFramesLongestORF(self, reading_frames) :
+        """ Returns a dictionary where keys are the reading frames in
+        reading_frames and values are dictionaries with the longest ORF of
+        each sequence in that frame, or None if it has no ORF there (see
+        dna_orfs.getFramesShortLongestORF).
+        """
+        self.computeProducts(reading_frames=reading_frames)
+        return {rframe : self._getProduct('longest_orf', {'frame' : rframe}) \
+                for rframe in reading_frames}
+
+    def getMostFrequentRepeats(self, n) :
+        """ Returns a dictionary with the most frequent repeats of size n of
+        each sequence (see dna_nrepeats.getMostFrequentRepeatsInSeq).
+        """
+        self.computeProducts(kmer_sizes=(n, ))
+        return self._getProduct('most_frequent', {'n' : n})
+
+    def _getOrComputeProduct(self, analysis, params, compute) :
+        """ Returns the product analysis with params, calling compute() to
+        make it (and keeping it if products are used) when it isn't
+        available.
+        """
+        if not self.use_products : return compute()
+        try :
+            return self._getProduct(analysis, params)
+        except KeyError :
+            value = compute()
+            self._putProduct(analysis, params, value)
+            return value
+
+    def getSummaries(self, reading_frames=(), kmer_sizes=()) :
+        """ Returns the per record summaries of summary_db with at least
+        reading_frames and kmer_sizes, in record order (see
+        summary_db.SummaryDB.updateSummaries).  The last summaries are
+        kept, so several answers only update the database once.
+        """
+        frames, sizes, summaries = self._summaries
+        if summaries is None or not frames.issuperset(reading_frames) or \
+           not sizes.issuperset(kmer_sizes) :
+            frames = frames.union(reading_frames)
+            sizes = sizes.union(kmer_sizes)
+            summaries = self.summary_db.updateSummaries(self.getRecords(),
+                        sorted(frames), sorted(sizes), self.orf_backend,
+                        self.jobs)
+            self._summaries = (frames, sizes, summaries)
+        return summaries
+
+    def getRecordCount(self) :
+        if self.summary_db is not None :
+            return len(self.getSummaries())
+        if not self.use_products :
+            return getRecordCount(self.getRecords())
+        return len(self.getSeqLengths())
+
+    def getShortLongSeqs(self, shortest=True) :
+        if self.summary_db is not None :
+            return getShortLongLengths(((sid, summary[0]) for sid, summary \
+                                        in self.getSummaries()), shortest)
+        if not self.use_products :
+            return getShortLongSeqs(self.getRecords(), shortest)
+        return getShortLongLengths(self.getSeqLengths().items(), shortest)
+
+    def getShortLongestORFsInAll(self, want_shortest=True, reading_frame=1) :
+        if not (self.use_products or self.summary_db is not None) :
+            return orf.getShortLongestORFsInAll(self.getRecords(),
+                   want_shortest, reading_frame, self.orf_backend, self.jobs)
+        rframes = orf.getReadingFrames(reading_frame)
+        if rframes is None : return -1
+        if len(rframes) == 1 : rframes = list(rframes)
+        if self.verbose : print("rframes = {}".format(rframes))
+        if self.summary_db is not None :
+            return sdb.getShortLongestORFsInAll(self.getSummaries(rframes),
+                                                want_shortest, reading_frame)
+        if want_shortest :
+            # Only the longest ORFs are kept as products.
+            seqs_frames_orf = parallel.mapSeqs(orf.getFramesShortLongestORF,
+                              self.getRecords(),
+                              (rframes, True, self.orf_backend), self.jobs)
+        else :
+            frames_orf = self.getFramesLongestORF(rframes)
+            seqs_frames_orf = ((sid, {rframe : frames_orf[rframe][sid] \
+                                      for rframe in rframes}) \
+                               for sid in frames_orf[rframes[0]])
+        return orf.mergeShortLongestORFs(seqs_frames_orf, rframes,
+                                         want_shortest)
+
+    def getLengthLongestORF(self, seq_id, reading_frame=1) :
+        rframes = orf.getReadingFrames(reading_frame)
+        if self.use_products and rframes is not None and \
+           all(self._hasProduct('longest_orf', {'frame' : rframe}) \
+               for rframe in rframes) :
+            frames_orf = self.getFramesLongestORF(rframes)
+            lorfs = {rframe : frames_orf[rframe][seq_id] for rframe in rframes}
+            return orf.getLengthLongestORFInFrames({rframe : [lorf, ] \
+                   if lorf else [] for rframe, lorf in lorfs.items()},
+                   reading_frame)
+        # Only one record is needed, so look it up through the on-disk
+        # index instead of reading the whole file.
+        if self._records is not None :
+            return orf.getLengthLongestORF(self._seqs, seq_id, reading_frame,
+                                           self.orf_backend)
+        if self.chunk_size :
+            return orf.getLengthLongestORF(self.getRecords(), seq_id,
+                                           reading_frame, self.orf_backend)
+        with fidx.IndexedFasta(self.file_fasta) as data_fasta :
+            return orf.getLengthLongestORF(data_fasta, seq_id, reading_frame,
+                                           self.orf_backend)
+
+    def getTopORFs(self, k, reading_frame=0, want_shortest=False) :
+        # Always streamed so that memory stays bounded by k: only the
+        # answer is kept as a product, never the full ORF lists.
+        return self._getOrComputeProduct('top_orfs', {'k' : k,
+               'frame' : reading_frame, 'shortest' : want_shortest},
+               lambda : orf.getTopORFs(self.getRecords(), k, reading_frame,
+                        want_shortest, self.orf_backend, self.jobs))
+
+    def getTopRepeats(self, n, k) :
+        return self._getOrComputeProduct('top_repeats', {'n' : n, 'k' : k},
+               lambda : nreps.getTopRepeats(self.getRecords(), n, k,
+                                            self.jobs))
+
+    def getFirstMostFrequentRepeatN(self, n) :
+        if self.suffix_index is not None :
+            return nreps.getFirstMostFrequentRepeatN(self.suffix_index, n)
+        if self.summary_db is not None :
+            return sdb.getFirstMostFrequentRepeatN(self.getSummaries(\
+                                                   kmer_sizes=(n, )), n)
+        if not self.use_products :
+            return nreps.getFirstMostFrequentRepeatN(self.getRecords(), n,
+                                                     self.jobs)
+        return nreps.mergeFirstMostFrequentRepeat(self._iterMostFrequent(n))
+
+    def getAllMostFrequentRepeatN(self, n) :
+        if self.suffix_index is not None :
+            return nreps.getAllMostFrequentRepeatN(self.suffix_index, n)
+        if self.summary_db is not None :
+            return sdb.getAllMostFrequentRepeatN(self.getSummaries(\
+                                                 kmer_sizes=(n, )), n)
+        if not self.use_products :
+            return nreps.getAllMostFrequentRepeatN(self.getRecords(), n,
+                                                   self.jobs)
+        return nreps.mergeMostFrequentRepeats(self._iterMostFrequent(n))
+
+    def _iterMostFrequent(self, n) :
+        return iter(self.getMostFrequentRepeats(n).items())
+
+    def _getRepeatOccurs(self, repeat) :
+        """ Returns a dictionary with the number of occurances of repeat in
+        each sequence.
+        """
+        return self._getProduct('repeat_occurs', {'repeat' : repeat.lower()})
+
+    def getOccsOfRepeatInAllSeqs(self, repeat) :
+        if self.suffix_index is not None :
+            return nreps.getOccsOfRepeatInAllSeqs(self.suffix_index, repeat)
+        if not self.use_products :
+            return nreps.getOccsOfRepeatInAllSeqs(self.getRecords(), repeat,
+                                                  self.jobs)
+        repeats = [repeat, ] if isinstance(repeat, str) else repeat
+        self.computeProducts(repeats=repeats)
+        if isinstance(repeat, str) :
+            return self._getRepeatOccurs(repeat)
+        occurs = {rep : self._getRepeatOccurs(rep) for rep in repeats}
+        return {sid : {rep : occurs[rep][sid] for rep in repeats} \
+                for sid in occurs[repeats[0]]} if repeats else {}
+
+    def getAllOccsOfRepeat(self, repeat) :
+        if self.suffix_index is not None :
+            return nreps.getAllOccsOfRepeat(self.suffix_index, repeat)
+        if not self.use_products :
+            return nreps.getAllOccsOfRepeat(self.getRecords(), repeat,
+                                            self.jobs)
+        if isinstance(repeat, str) :
+            return sum(self.getOccsOfRepeatInAllSeqs(repeat).values())
+        self.computeProducts(repeats=repeat)
+        return {rep : sum(self._getRepeatOccurs(rep).values()) \
+                for rep in repeat}
+
+def getRecordProducts(dna, reading_frames, kmer_sizes, automaton,
+                      orf_backend='python') :
+    """ Returns a 4-tuple with the products of one sequence needed by
+    FastaAnalysis.computeProducts:
+    tuple[0] - length of dna
+    tuple[1] - longest ORF of dna for reading_frames (see
+               dna_orfs.getFramesShortLongestORF)
+    tuple[2] - dictionary with the most frequent repeats of dna for each
+               size in kmer_sizes (see
+               dna_nrepeats.getMostFrequentRepeatsInSeq)
+    tuple[3] - list with the number of occurances of each motif of automaton
+               (see dna_motifs.countMotifs), empty if automaton is None
+    """
+    frames_orf = orf.getFramesShortLongestORF(dna, reading_frames, False,
+                 orf_backend) if reading_frames else {}
+    most_frequent = {n : nreps.getMostFrequentRepeatsInSeq(dna, n) \
+                     for n in kmer_sizes}
+    counts = motifs.countMotifs(dna, automaton) if automaton else []
+
+    return (len(dna), frames_orf, most_frequent, counts)
+
+def getQueries(args) :
+    """ Returns the list of queries given by the options in args, the
+    namespace returned by the parser of getArgParser.  Each query is a
+    2-tuple (option name, tuple of the option's parameters).
+    """
+    queries = []
+    if args.record_count : queries.append(('record_count', ()))
+    if args.longest_seq : queries.append(('longest_seq', ()))
+    if args.shortest_seq : queries.append(('shortest_seq', ()))
+    if args.longest_orf :
+        queries.append(('longest_orf', (args.longest_orf[0], )))
+    if args.lorf_in_seq :
+        sid, rframe = args.lorf_in_seq
+        # A frame that isn't a number is kept and answered with FRAME_ERROR.
+        rframe = int(rframe) if rframe.lstrip('-').isdigit() else rframe
+        queries.append(('lorf_in_seq', (sid, rframe)))
+    if args.longest_orfs :
+        queries.append(('longest_orfs', tuple(args.longest_orfs)))
+    if args.shortest_orfs :
+        queries.append(('shortest_orfs', tuple(args.shortest_orfs)))
+    if args.top_repeats :
+        queries.append(('top_repeats', tuple(args.top_repeats)))
+    if args.mfrepeat_occurs :
+        queries.append(('mfrepeat_occurs', (args.mfrepeat_occurs[0], )))
+    if args.get_max_nrepeats :
+        queries.append(('get_max_nrepeats', (args.get_max_nrepeats[0], )))
+    if args.seq_occurs :
+        queries.append(('seq_occurs', tuple(args.seq_occurs)))
+    if args.motif_file :
+        queries.append(('seq_occurs',
+                        tuple(motifs.readMotifFile(args.motif_file[0]))))
+
+    return queries
+
+def readQueryFile(inFilePath, parser, file_fasta) :
+    """ Returns the list of queries (see getQueries) in the text file
+    inFilePath, which has the options of one or more queries per line.
+    Blank lines and lines that start with # are skipped.
+    """
+    queries = []
+    with open(inFilePath) as f :
+        for line in f :
+            line = line.strip()
+            if line and not line.startswith('#') :
+                args = parser.parse_args([file_fasta, ] + shlex.split(line))
+                queries += getQueries(args)
+
+    return queries
+
+def planQueries(queries) :
+    """ Returns a dictionary with the keyword arguments of
+    FastaAnalysis.computeProducts for the products needed to answer all the
+    queries (see getQueries): the sequence lengths, the longest ORFs of
+    every reading frame asked for, the most frequent repeats of every
+    repeat size asked for and the counts of the repeats.  The top-K queries
+    are not planned: they stream the file on their own to keep their memory
+    bounded.
+    """
+    plan = {'lengths' : False, 'reading_frames' : [], 'kmer_sizes' : [],
+            'repeats' : []}
+    for name, params in queries :
+        if name in ('record_count', 'longest_seq', 'shortest_seq') :
+            plan['lengths'] = True
+        elif name == 'longest_orf' and orf.getReadingFrames(params[0]) :
+            plan['reading_frames'] += orf.getReadingFrames(params[0])
+        elif name in ('mfrepeat_occurs', 'get_max_nrepeats') :
+            plan['kmer_sizes'].append(params[0])
+        elif name == 'seq_occurs' :
+            plan['repeats'] += params
+    # A single sequence is looked up through the index, unless its frames
+    # are in the ORF pass anyway.
+    for name, params in queries :
+        if name == 'lorf_in_seq' and plan['reading_frames'] and \
+           orf.getReadingFrames(params[1]) :
+            plan['reading_frames'] += orf.getReadingFrames(params[1])
+    plan['reading_frames'] = sorted(set(plan['reading_frames']))
+
+    return plan
+
+def answerQuery(data_fasta, query) :
+    """ Returns a dictionary with the answer to query (see getQueries)
+    computed by data_fasta, a FastaAnalysis.
+    """
+    name, params = query
+    if name == 'record_count' :
+        return {'record_count' : data_fasta.getRecordCount()}
+    elif name in ('longest_seq', 'shortest_seq') :
+        length, count, seq_ids = data_fasta.getShortLongSeqs(\
+                                 shortest=(name == 'shortest_seq'))
+        return {'length' : length, 'count' : count, 'seq_ids' : seq_ids}
+    elif name == 'longest_orf' :
+        lorf = data_fasta.getShortLongestORFsInAll(False, params[0])
+        if lorf == -1 :
+            return {'error' : FRAME_ERROR}
+        return {'reading_frame' : params[0], 'length' : lorf[0],
+                'start' : lorf[1], 'seq_id' : lorf[2]}
+    elif name == 'lorf_in_seq' :
+        sid, rframe = params
+        if orf.getReadingFrames(rframe) is None :
+            return {'error' : FRAME_ERROR}
+        try :
+            lorf_seq = data_fasta.getLengthLongestORF(sid, rframe)
+        except KeyError :
+            return {'error' : "Unknown sequence id {}".format(sid)}
+        return {'seq_id' : sid, 'reading_frame' : lorf_seq[1],
+                'length' : lorf_seq[0]}
+    elif name in ('longest_orfs', 'shortest_orfs') :
+        top_orfs = data_fasta.getTopORFs(params[0], params[1],
+                                         name == 'shortest_orfs')
+        if top_orfs == -1 :
+            return {'error' : FRAME_ERROR}
+        return {'k' : params[0], 'reading_frame' : params[1],
+                'orfs' : [{'length' : length, 'start' : start,
+                           'reading_frame' : orf_frame, 'seq_id' : seq_id} \
+                          for length, start, seq_id, orf_frame in top_orfs]}
+    elif name == 'top_repeats' :
+        return {'n' : params[0], 'k' : params[1],
+                'repeats' : [{'count' : count, 'repeat' : repeat,
+                              'seq_id' : seq_id, 'first_index' : index} \
+                             for count, repeat, seq_id, index in \
+                             data_fasta.getTopRepeats(params[0], params[1])]}
+    elif name == 'mfrepeat_occurs' :
+        mf_repeat = data_fasta.getFirstMostFrequentRepeatN(params[0])
+        return {'n' : params[0], 'repeat' : mf_repeat,
+                'count' : data_fasta.getAllOccsOfRepeat(mf_repeat)}
+    elif name == 'get_max_nrepeats' :
+        mf_repeats = data_fasta.getAllMostFrequentRepeatN(params[0])
+        return {'n' : params[0], 'repeats' : mf_repeats[0],
+                'count' : mf_repeats[1]}
+    elif name == 'seq_occurs' :
+        seqs = list(params)
+        return {'totals' : data_fasta.getAllOccsOfRepeat(seqs),
+                'per_seq' : data_fasta.getOccsOfRepeatInAllSeqs(seqs)}
+    return {'error' : "This option is not implemented."}
+
+def runQueries(data_fasta, queries) :
+    """ Returns a list with a dictionary {'query' : ..., 'result' : ...} for
+    each query in queries (see getQueries).  The products needed by all the
+    queries are computed first, in a single pass over the file, and every
+    query is answered from them.
+
+    data_fasta - FastaAnalysis of the file, with keep_products = True
+    """
+    plan = planQueries(queries)
+    if data_fasta.suffix_index is not None :
+        # Repeats are looked up in the suffix index, nothing to count.
+        plan.update(kmer_sizes=[], repeats=[])
+    if data_fasta.summary_db is not None :
+        # Lengths, whole file ORFs and most frequent repeats come from the
+        # summaries, updated in one pass for all the queries.
+        data_fasta.getSummaries(plan['reading_frames'], plan['kmer_sizes'])
+        plan.update(lengths=False, reading_frames=[], kmer_sizes=[])
+    data_fasta.computeProducts(**plan)
+    results = []
+    for name, params in queries :
+        results.append({'query' : {'option' : name, 'params' : list(params)},
+                        'result' : answerQuery(data_fasta, (name, params))})
+
+    return results
+
+def openSuffixIndex(file_fasta, build=False) :
+    """ Returns a suffix_index.SuffixIndexedFasta of file_fasta if its
+    suffix index is up to date, building it first if build is True.
+    Returns None if there is no up to date index and build is False.
+    """
+    if not build and not os.path.exists(file_fasta + ".sfx") : return None
+    import suffix_index as sfx  # Optional: needs NumPy installed
+    try :
+        return sfx.SuffixIndexedFasta(file_fasta, build)
+    except rf.DuplicateSeqIdError :
+        raise
+    except ValueError :
+        return None
+
+def getFramesName(reading_frame) :
+    """ Returns the name of the reading frames meant by reading_frame (see
+    dna_orfs.getReadingFrames) used in the printed results.
+    """
+    if reading_frame == 0 :
+        return "all reading frames"
+    elif reading_frame == orf.ALL_FRAMES :
+        return "all six reading frames"
+    return "reading frame {}".format(reading_frame)
+
+def printMotifCounts(seq_counts, seqs) :
+    """ Prints a tab separated table with a row for each sequence id and a
+    column for each nucleotide sequence in seqs, followed by a row with the
+    total over all records.
+
+    seq_counts - dictionary as returned by
+                 dna_nrepeats.getOccsOfRepeatInAllSeqs for a list of seqs
+    """
+    seqs = list(dict.fromkeys(seqs))   # Drop repeated sequences
+    totals = [0] * len(seqs)
+    print("\t".join(["seq_id", ] + seqs))
+    for sid, counts in seq_counts.items() :
+        row = [counts[seq] for seq in seqs]
+        totals = [t + c for t, c in zip(totals, row)]
+        print("\t".join([sid, ] + [str(c) for c in row]))
+    print("\t".join(["total", ] + [str(t) for t in totals]))
+
 def getRecordCount(fasta_dat) :
     """ fasta_dat - dictionary with keys = sequence ids and
-    values = string that represents a DNA sequence of A's T's, G's and C's
+    values = string that represents a DNA sequence of A's T's, G's and C's,
+    or an iterable of records as yielded by read_fasta.iterFasta
     """
-    return len(fasta_dat.keys())        
+    if hasattr(fasta_dat, 'keys') :
+        return len(fasta_dat.keys())
+    return sum(1 for rec in fasta_dat)
     
 def getShortLongSeqs(fasta_data, shortest=True) :
     """ Find the length of longest or shortest sequence.
@@ -147,16 +845,25 @@ def getShortLongSeqs(fasta_data, shortest=True) :
                longest length.
     
     fasta_data - a dictionary with keys that are sequence ids and values that
-                 are sequences
+                 are sequences, or an iterable of records as yielded by
+                 read_fasta.iterFasta
     shortest - boolean: If True, all outputs are with respect to the shortest
                length sequence(s). If False, outputs are wrt to longest
                length sequence(s).
     """
+    seq_lengths = ((seq_id, len(dna_seq)) \
+                   for seq_id, dna_seq in rf.getSeqItems(fasta_data))
+
+    return getShortLongLengths(seq_lengths, shortest)
+
+def getShortLongLengths(seq_lengths, shortest=True) :
+    """ Returns the 3-tuple described in getShortLongSeqs from seq_lengths,
+    an iterable of 2-tuples (sequence id, length of that sequence).
+    """
     id_seqs = []      # Store the ids of the shortest or longest seq's
     # Init length of shortest or longest sequence
     length_seq = sys.maxsize if shortest else -1
-    for seq_id, dna_seq in sorted(fasta_data.items()) :
-        seq_len = len(fasta_data[seq_id])  # Get length of seq for this id
+    for seq_id, seq_len in seq_lengths :
         # print("seq_id:", seq_id, "\nhas length=", seq_len)
         # If this sequence is the shortest or longest we've seen so far,
         # update length_seq and reinit id_seqs
@@ -176,7 +883,13 @@ def getShortLongSeqs(fasta_data, shortest=True) :
             elif(seq_len == length_seq) :
                 id_seqs.append(seq_id)
                 # print('adding new seq to longest list:\n', seq_id)
+    id_seqs.sort()  # Report ids in sorted order regardless of input order
             
     return((length_seq, len(id_seqs), id_seqs))
     
-if __name__ == "__main__": main()  # Load all function in module, then run main()
\ No newline at end of file
+if __name__ == "__main__":
+    try :
+        main()
+    except rf.DuplicateSeqIdError as e :
+        print("{}  Exiting.".format(e))
+        sys.exit(1)
\ No newline at end of file
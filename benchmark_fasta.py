@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+import sys, os, argparse, json, time, io, subprocess, tempfile
+from contextlib import redirect_stdout
+import fasta_generator as fgen
+
+# Benchmark harness.  Synthetic FASTA files are generated with
+# fasta_generator (same seed, same file) and every benchmark runs in its own
+# child process, so its peak RSS can be read from the child's resource usage.
+# Library benchmarks time one function of the analysis modules on the parsed
+# records; CLI benchmarks time analyze_fasta.py end to end.  Results can be
+# saved as a baseline, and a later run compared against it fails when
+# throughput drops or peak RSS grows by more than the tolerance.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Datasets: keyword arguments of fasta_generator.generateFasta.  The number
+# of records is multiplied by the scale factor of --scale.
+DATASETS = {
+    'short_reads' : {'record_count' : 400, 'min_length' : 100,
+                     'max_length' : 1000, 'length_dist' : 'uniform',
+                     'gc_content' : 0.5, 'orf_density' : 0.2,
+                     'line_width' : 60},
+    'scaffolds' : {'record_count' : 10, 'min_length' : 2000,
+                   'max_length' : 200000, 'length_dist' : 'lognormal',
+                   'gc_content' : 0.62, 'orf_density' : 1.0,
+                   'line_width' : 80},
+    }
+SCALES = {'small' : 1, 'medium' : 25, 'large' : 500, 'huge' : 5000}
+# Runs faster than this are too noisy to compare throughput.
+MIN_COMPARE_SECONDS = 0.05
+
+def _runReadFasta(inFilePath) :
+    import read_fasta
+    start = time.perf_counter()
+    read_fasta.readFasta(inFilePath)
+    return time.perf_counter() - start
+
+def _timeOnRecords(inFilePath, func) :
+    """ Returns the seconds taken by func(dna_seqs) where dna_seqs are the
+    records of inFilePath read by read_fasta.readFasta (not timed).
+    """
+    import read_fasta
+    dna_seqs = read_fasta.readFasta(inFilePath)
+    start = time.perf_counter()
+    func(dna_seqs)
+    return time.perf_counter() - start
+
+def _runGetOpenReadingFrames(inFilePath) :
+    import dna_orfs
+    def func(dna_seqs) :
+        for dna in dna_seqs.values() :
+            for rframe in (1, 2, 3) :
+                dna_orfs.getOpenReadingFrames(dna, rframe)
+    return _timeOnRecords(inFilePath, func)
+
+def _runGetShortLongestORFsInAll(inFilePath) :
+    import dna_orfs
+    return _timeOnRecords(inFilePath, lambda dna_seqs :
+                          dna_orfs.getShortLongestORFsInAll(dna_seqs, False, 0))
+
+def _runGetNRepeats(inFilePath) :
+    import dna_nrepeats
+    def func(dna_seqs) :
+        for dna in dna_seqs.values() :
+            dna_nrepeats.getNRepeats(dna, 6)
+    return _timeOnRecords(inFilePath, func)
+
+def _runGetAllMostFrequentRepeatN(inFilePath) :
+    import dna_nrepeats
+    return _timeOnRecords(inFilePath, lambda dna_seqs :
+                          dna_nrepeats.getAllMostFrequentRepeatN(dna_seqs, 12))
+
+# Library benchmarks: name -> function(inFilePath) that returns the seconds
+# taken by the timed part.  They run in a child process (see runBenchmark).
+LIBRARY_BENCHMARKS = {
+    'readFasta' : _runReadFasta,
+    'getOpenReadingFrames' : _runGetOpenReadingFrames,
+    'getShortLongestORFsInAll' : _runGetShortLongestORFsInAll,
+    'getNRepeats' : _runGetNRepeats,
+    'getAllMostFrequentRepeatN' : _runGetAllMostFrequentRepeatN,
+    }
+
+# CLI benchmarks: name -> options of analyze_fasta.py.  {seq_id} is replaced
+# by the first sequence identifier of the dataset.
+CLI_BENCHMARKS = {
+    'cli_record_count' : ['--record_count'],
+    'cli_longest_seq' : ['--longest_seq'],
+    'cli_longest_orf' : ['--longest_orf', '0'],
+    'cli_lorf_in_seq' : ['--lorf_in_seq', '{seq_id}', '0'],
+    'cli_mfrepeat_occurs' : ['--mfrepeat_occurs', '7'],
+    'cli_get_max_nrepeats' : ['--get_max_nrepeats', '12'],
+    'cli_seq_occurs' : ['--seq_occurs', 'ACGTAC', 'GGCCGG', 'TATAAA'],
+    'cli_batch' : ['--batch', '--longest_orf', '0', '--get_max_nrepeats',
+                   '12', '--seq_occurs', 'ACGTAC'],
+    }
+
+def getDatasetPath(data_dir, name, scale, seed) :
+    """ Returns the path of the FASTA file of dataset name at scale. """
+    return os.path.join(data_dir, '{}_{}_seed{}.fasta'.format(name, scale,
+                                                               seed))
+
+def makeDataset(data_dir, name, scale, seed=0) :
+    """ Writes the FASTA file of dataset name at scale (see DATASETS and
+    SCALES) unless it already exists and returns a 3-tuple:
+    tuple[0] - path of the file
+    tuple[1] - number of bases in the file
+    tuple[2] - first sequence identifier
+    """
+    path = getDatasetPath(data_dir, name, scale, seed)
+    info_path = path + '.json'
+    if not (os.path.exists(path) and os.path.exists(info_path)) :
+        os.makedirs(data_dir, exist_ok=True)
+        params = dict(DATASETS[name])
+        params['record_count'] *= SCALES[scale]
+        records, bases = fgen.generateFasta(path, seed, **params)
+        with open(info_path, 'w') as f :
+            json.dump({'records' : records, 'bases' : bases,
+                       'first_id' : 'synthetic|{}|1'.format(seed)}, f)
+    with open(info_path) as f :
+        info = json.load(f)
+
+    return (path, info['bases'], info['first_id'])
+
+def _waitChild(proc) :
+    """ Returns a 3-tuple (stdout, exit status, peak RSS in KB) of the
+    child process proc once it ends.
+    """
+    out = proc.stdout.read()
+    pid, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status) \
+                      if hasattr(os, 'waitstatus_to_exitcode') else status
+    proc.stdout.close()
+    return (out, proc.returncode, rusage.ru_maxrss)
+
+def runBenchmark(name, inFilePath, seq_id) :
+    """ Runs the benchmark name on inFilePath in a child process and returns
+    a 2-tuple (seconds, peak RSS in KB).  For CLI benchmarks the time is the
+    wall time of the whole run.
+    """
+    if name in LIBRARY_BENCHMARKS :
+        cmd = [sys.executable, os.path.abspath(__file__), '--run_one', name,
+               inFilePath]
+    else :
+        options = [o.format(seq_id=seq_id) for o in CLI_BENCHMARKS[name]]
+        cmd = [sys.executable, os.path.join(SCRIPT_DIR, 'analyze_fasta.py'),
+               inFilePath] + options
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, cwd=SCRIPT_DIR)
+    out, status, max_rss = _waitChild(proc)
+    seconds = time.perf_counter() - start
+    if status != 0 :
+        raise RuntimeError("Benchmark {} failed on {}".format(name,
+                                                              inFilePath))
+    if name in LIBRARY_BENCHMARKS :
+        seconds = float(out.decode().split()[-1])
+
+    return (seconds, max_rss)
+
+def runBenchmarks(names, datasets, scale, data_dir, seed=0, repeat=1) :
+    """ Returns a dictionary where keys = 'dataset/benchmark' and values =
+    dictionaries with the best time of repeat runs ('seconds'), the
+    throughput ('bases_per_s') and the largest peak RSS ('max_rss_kb').
+    """
+    results = {}
+    for dataset in datasets :
+        path, bases, seq_id = makeDataset(data_dir, dataset, scale, seed)
+        for name in names :
+            key = '{}/{}'.format(dataset, name)
+            times, rss = [], []
+            for i in range(repeat) :
+                seconds, max_rss = runBenchmark(name, path, seq_id)
+                times.append(seconds)
+                rss.append(max_rss)
+            seconds = min(times)
+            results[key] = {
+                'seconds' : round(seconds, 4),
+                'bases_per_s' : round(bases / seconds if seconds else 0.0),
+                'max_rss_kb' : max(rss)}
+            printResult(key, results[key])
+
+    return results
+
+def printResult(key, result) :
+    """ Prints one line of the results table. """
+    line = "{:<45} {:>9.3f} s {:>12.3e} bases/s {:>9} KB".format(key,
+           result['seconds'], result['bases_per_s'], result['max_rss_kb'])
+    print(line)
+    sys.stdout.flush()
+
+def compareResults(results, baseline, tolerance=0.2) :
+    """ Returns a list of strings, one for each result that regressed
+    against baseline: throughput below (1 - tolerance) times the baseline
+    or peak RSS above (1 + tolerance) times the baseline.  Results missing
+    from baseline are not compared, and neither is the throughput of runs
+    shorter than MIN_COMPARE_SECONDS.
+    """
+    regressions = []
+    for key, result in sorted(results.items()) :
+        if key not in baseline : continue
+        base = baseline[key]
+        if base['seconds'] >= MIN_COMPARE_SECONDS and \
+           result['bases_per_s'] < (1 - tolerance) * base['bases_per_s'] :
+            regressions.append("{}: {:.3e} bases/s, baseline {:.3e}".format(\
+                               key, result['bases_per_s'], base['bases_per_s']))
+        if result['max_rss_kb'] > (1 + tolerance) * base['max_rss_kb'] :
+            regressions.append("{}: peak RSS {} KB, baseline {} KB".format(\
+                               key, result['max_rss_kb'], base['max_rss_kb']))
+
+    return regressions
+
+def main() :
+    parser = argparse.ArgumentParser(description="Benchmark the FASTA \
+    analyses on synthetic files.  Exits with status 1 if a result regressed \
+    against the baseline given with --baseline.")
+    parser.add_argument("--scale", default='small', choices=sorted(SCALES),
+    help="size of the datasets: small (~1 MB), medium, large or huge (~GB)")
+    parser.add_argument("--datasets", nargs='+', default=sorted(DATASETS),
+                        choices=sorted(DATASETS))
+    parser.add_argument("--benchmarks", nargs='+',
+                        default=list(LIBRARY_BENCHMARKS) + list(CLI_BENCHMARKS),
+                        choices=list(LIBRARY_BENCHMARKS) + list(CLI_BENCHMARKS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3,
+    help="runs per benchmark, the fastest is kept (default 3)")
+    parser.add_argument("--data_dir",
+    default=os.path.join(tempfile.gettempdir(), 'analyze_fasta_bench'),
+    help="directory of the generated FASTA files")
+    parser.add_argument("--save_baseline", metavar='FILE',
+    help="write the results as a JSON baseline to FILE")
+    parser.add_argument("--baseline", metavar='FILE',
+    help="compare the results with the JSON baseline in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+    help="allowed slowdown or RSS growth before a result regresses \
+    (default 0.2 = 20%%)")
+    parser.add_argument("--run_one", nargs=2, metavar=('BENCHMARK', 'FILE'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one :
+        # Child process of runBenchmark: print only the timed seconds.
+        with redirect_stdout(io.StringIO()) :
+            seconds = LIBRARY_BENCHMARKS[args.run_one[0]](args.run_one[1])
+        print(seconds)
+        return 0
+
+    results = runBenchmarks(args.benchmarks, args.datasets, args.scale,
+                            args.data_dir, args.seed, args.repeat)
+    if args.save_baseline :
+        with open(args.save_baseline, 'w') as f :
+            json.dump({'scale' : args.scale, 'seed' : args.seed,
+                       'results' : results}, f, indent=2, sort_keys=True)
+        print("Baseline saved to", args.save_baseline)
+    if args.baseline :
+        with open(args.baseline) as f :
+            baseline = json.load(f)
+        if (baseline['scale'], baseline['seed']) != (args.scale, args.seed) :
+            print("Baseline was run with --scale {} --seed {}, not \
+comparable.".format(baseline['scale'], baseline['seed']))
+            return 1
+        regressions = compareResults(results, baseline['results'],
+                                     args.tolerance)
+        for regression in regressions :
+            print("REGRESSION", regression)
+        if regressions : return 1
+        print("No regression against", args.baseline)
+
+    return 0
+
+if __name__ == "__main__" :
+    sys.exit(main())
@@ -0,0 +1,344 @@
+#!/usr/bin/python3
+import os, io, zlib, struct, bisect
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Transparent reading of compressed FASTA files.  Compression is detected
+# from the magic bytes, not the file name.  gzip files are inflated as a
+# stream in large reads.  BGZF files (bgzip, as used by samtools) are a
+# series of independent gzip blocks of at most 64 KB, so their blocks are
+# inflated in parallel on a pool of threads (zlib releases the GIL), and a
+# .gzi index of the block offsets gives random access to any byte of the
+# uncompressed data by inflating only the blocks that hold it.
+
+GZIP_MAGIC = b'\x1f\x8b'
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000'
+                         '000000')
+BGZF_BLOCK_DATA = 0xff00     # Uncompressed bytes per block written
+BGZF_MAX_BLOCK = 1 << 16     # Largest compressed block, header included
+BUFFER_SIZE = 1 << 20        # Bytes per read from the compressed file
+DEFAULT_THREADS = min(os.cpu_count() or 1, 8)
+
+def getCompression(inFilePath) :
+    """ Returns 'bgzf', 'gzip' or None (not compressed) for the file
+    inFilePath, from its first bytes.
+    """
+    with open(inFilePath, 'rb') as f :
+        if f.read(2) != GZIP_MAGIC : return None
+        f.seek(0)
+        try :
+            _readBlockHeader(f)
+            return 'bgzf'
+        except ValueError :
+            return 'gzip'
+
+def _readBlockHeader(f) :
+    """ Reads the header of the BGZF block at the current position of the
+    binary file f and returns a 2-tuple (size of the whole block in bytes,
+    size of the header in bytes), or None at the end of the file.  Raises
+    ValueError if it is not a BGZF block.
+    """
+    header = f.read(12)
+    if not header : return None
+    if len(header) < 12 or header[:2] != GZIP_MAGIC or not header[3] & 4 :
+        raise ValueError("Not a BGZF block")
+    xlen = struct.unpack('<H', header[10:12])[0]
+    extra = f.read(xlen)
+    i = 0
+    while i + 4 <= len(extra) :   # Look for the BC subfield with BSIZE
+        slen = struct.unpack('<H', extra[i + 2:i + 4])[0]
+        if extra[i:i + 2] == b'BC' and slen == 2 :
+            return (struct.unpack('<H', extra[i + 4:i + 6])[0] + 1, 12 + xlen)
+        i += 4 + slen
+    raise ValueError("Not a BGZF block")
+
+def iterBgzfBlocks(f) :
+    """ Generator that yields a 4-tuple (compressed offset, raw deflate
+    data, CRC32, uncompressed size) for each block of the BGZF file f, an
+    open binary file positioned at the start of a block.  Nothing is
+    inflated.
+    """
+    offset = f.tell()
+    while True :
+        header = _readBlockHeader(f)
+        if header is None : return
+        block_size, header_size = header
+        data = f.read(block_size - header_size)
+        if len(data) < 8 : raise EOFError("BGZF file is truncated")
+        crc, isize = struct.unpack('<II', data[-8:])
+        yield (offset, data[:-8], crc, isize)
+        offset += block_size
+
+def _inflate(cdata, crc) :
+    """ Returns the inflated raw deflate data cdata, checking its CRC32. """
+    data = zlib.decompress(cdata, -15)
+    if zlib.crc32(data) != crc : raise ValueError("BGZF block is corrupt")
+    return data
+
+def iterBgzfData(f, threads=DEFAULT_THREADS) :
+    """ Generator that yields the uncompressed bytes of each block of the
+    BGZF file f (see iterBgzfBlocks), in order.  Blocks are inflated on a
+    pool of threads, with a few blocks per thread in flight.
+    """
+    blocks = ((cdata, crc) for offset, cdata, crc, isize in iterBgzfBlocks(f) \
+              if isize > 0)
+    if threads <= 1 :
+        for cdata, crc in blocks :
+            yield _inflate(cdata, crc)
+        return
+    with ThreadPoolExecutor(max_workers=threads) as pool :
+        pending = deque()
+        for cdata, crc in blocks :
+            pending.append(pool.submit(_inflate, cdata, crc))
+            if len(pending) >= 4 * threads :
+                yield pending.popleft().result()
+        while pending :
+            yield pending.popleft().result()
+
+def iterGzipData(f, buffer_size=BUFFER_SIZE) :
+    """ Generator that yields the uncompressed bytes of the gzip file f, an
+    open binary file, reading buffer_size compressed bytes at a time.  Files
+    made of several gzip members are read through to the last one.
+    """
+    inflater = zlib.decompressobj(31)
+    started = False
+    chunk = f.read(buffer_size)
+    while chunk :
+        started = True
+        data = inflater.decompress(chunk)
+        if data : yield data
+        if inflater.eof :
+            # Next member, if any, starts in the unused data.
+            chunk = inflater.unused_data
+            inflater = zlib.decompressobj(31)
+            started = False
+            if chunk.strip(b'\0') : continue   # Skip zero padding
+        chunk = f.read(buffer_size)
+    if started and not inflater.eof :
+        raise EOFError("Compressed file ended before the end-of-stream marker")
+
+class ChunkReader(io.RawIOBase) :
+    """ Raw binary stream over an iterator of bytes objects, so it can be
+    wrapped in io.BufferedReader and io.TextIOWrapper.  f, the underlying
+    file, is closed with the stream.
+    """
+    def __init__(self, f, chunks) :
+        self._f = f
+        self._chunks = chunks
+        self._chunk = memoryview(b'')
+
+    def readable(self) :
+        return True
+
+    def readinto(self, b) :
+        while not self._chunk :
+            try :
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration :
+                return 0
+        n = min(len(b), len(self._chunk))
+        b[:n] = self._chunk[:n]
+        self._chunk = self._chunk[n:]
+        return n
+
+    def close(self) :
+        if not self.closed :
+            if hasattr(self._chunks, 'close') : self._chunks.close()
+            self._f.close()
+        super().close()
+
+def openFasta(inFilePath, binary=False, threads=DEFAULT_THREADS) :
+    """ Opens inFilePath for reading, inflating it on the fly if it is gzip
+    or BGZF compressed (see getCompression), and returns a buffered file
+    object: text (default) or binary if binary = True.  Raises IOError if
+    the file can't be opened.
+
+    threads - number of threads that inflate the blocks of a BGZF file
+    """
+    compression = getCompression(inFilePath)
+    if compression is None :
+        return open(inFilePath, 'rb' if binary else 'r')
+    f = open(inFilePath, 'rb', buffering=BUFFER_SIZE)
+    chunks = iterBgzfData(f, threads) if compression == 'bgzf' else \
+             iterGzipData(f)
+    stream = io.BufferedReader(ChunkReader(f, chunks), BUFFER_SIZE)
+
+    return stream if binary else io.TextIOWrapper(stream)
+
+def getGziPath(inFilePath) :
+    """ Returns the path of the .gzi index kept next to inFilePath. """
+    return inFilePath + ".gzi"
+
+def buildGziIndex(inFilePath) :
+    """ Returns a 3-tuple for the BGZF file inFilePath, read without
+    inflating anything:
+    tuple[0] - list of the compressed offset of each block
+    tuple[1] - list of the uncompressed offset of each block
+    tuple[2] - total uncompressed size
+    """
+    coffsets, uoffsets = [], []
+    size = 0
+    with open(inFilePath, 'rb', buffering=BUFFER_SIZE) as f :
+        for offset, cdata, crc, isize in iterBgzfBlocks(f) :
+            coffsets.append(offset)
+            uoffsets.append(size)
+            size += isize
+
+    return (coffsets, uoffsets, size)
+
+def writeGziIndex(index, gziPath) :
+    """ Writes index (see buildGziIndex) to gziPath in the samtools .gzi
+    format: the number of entries, then a (compressed, uncompressed) offset
+    pair for each block after the first, all as little endian uint64.
+    """
+    coffsets, uoffsets, size = index
+    with open(gziPath, 'wb') as f :
+        f.write(struct.pack('<Q', len(coffsets) - 1))
+        for coffset, uoffset in zip(coffsets[1:], uoffsets[1:]) :
+            f.write(struct.pack('<QQ', coffset, uoffset))
+
+def readGziIndex(gziPath, inFilePath) :
+    """ Returns the index (see buildGziIndex) saved in gziPath for the BGZF
+    file inFilePath.  Only the last block is read to find the total size.
+    """
+    with open(gziPath, 'rb') as f :
+        count = struct.unpack('<Q', f.read(8))[0]
+        pairs = struct.unpack('<{}Q'.format(2 * count), f.read(16 * count))
+    coffsets = [0, ] + list(pairs[0::2])
+    uoffsets = [0, ] + list(pairs[1::2])
+    with open(inFilePath, 'rb') as f :
+        f.seek(coffsets[-1])
+        block_size, header_size = _readBlockHeader(f)
+        f.seek(coffsets[-1] + block_size - 4)
+        size = uoffsets[-1] + struct.unpack('<I', f.read(4))[0]
+
+    return (coffsets, uoffsets, size)
+
+def loadGziIndex(inFilePath) :
+    """ Returns the index (see buildGziIndex) of the BGZF file inFilePath
+    from the .gzi file next to it if that is newer than inFilePath,
+    otherwise builds it and tries to save it.
+    """
+    gziPath = getGziPath(inFilePath)
+    try :
+        if os.stat(gziPath).st_mtime_ns >= os.stat(inFilePath).st_mtime_ns :
+            return readGziIndex(gziPath, inFilePath)
+    except (IOError, ValueError, struct.error, TypeError) :
+        pass   # Missing, stale or unreadable index: rebuild it
+    index = buildGziIndex(inFilePath)
+    try :
+        writeGziIndex(index, gziPath)
+    except IOError :
+        pass
+
+    return index
+
+class BgzfFile(object) :
+    """ Random access to the uncompressed bytes of the BGZF file inFilePath.
+    len(), slicing with step 1 and find() behave as for the bytes of the
+    uncompressed file (or an mmap of it), but only the blocks that hold the
+    requested bytes are read and inflated.  The most recently used blocks
+    are kept inflated.
+    """
+    def __init__(self, inFilePath, cache_blocks=16) :
+        self._file = open(inFilePath, 'rb')
+        self.coffsets, self.uoffsets, self.size = loadGziIndex(inFilePath)
+        self.cache_blocks = cache_blocks
+        self._cache = OrderedDict()
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.close()
+
+    def close(self) :
+        self._file.close()
+
+    def __len__(self) :
+        return self.size
+
+    def _getBlock(self, i) :
+        """ Returns the uncompressed bytes of block i. """
+        data = self._cache.get(i)
+        if data is not None :
+            self._cache.move_to_end(i)
+            return data
+        # pread doesn't move the file offset, so processes forked with this
+        # file open (or threads) don't race on it.
+        block = os.pread(self._file.fileno(), BGZF_MAX_BLOCK, self.coffsets[i])
+        offset, cdata, crc, isize = next(iterBgzfBlocks(io.BytesIO(block)))
+        data = _inflate(cdata, crc)
+        self._cache[i] = data
+        if len(self._cache) > self.cache_blocks :
+            self._cache.popitem(last=False)
+        return data
+
+    def _getBlockIndex(self, pos) :
+        """ Returns the index of the last non-empty block that starts at or
+        before the uncompressed offset pos.
+        """
+        return bisect.bisect_right(self.uoffsets, pos) - 1
+
+    def __getitem__(self, key) :
+        if isinstance(key, int) :
+            return self[key:key + 1][0] if key >= 0 else self[self.size + key]
+        start, end, step = key.indices(self.size)
+        if step != 1 : raise ValueError("BgzfFile slices must have step 1")
+        parts = []
+        pos = start
+        while pos < end :
+            i = self._getBlockIndex(pos)
+            data = self._getBlock(i)
+            skip = pos - self.uoffsets[i]
+            if skip >= len(data) : break   # Past the last block
+            part = data[skip:skip + end - pos]
+            parts.append(part)
+            pos += len(part)
+
+        return b''.join(parts)
+
+    def find(self, sub, start=0) :
+        """ Returns the lowest uncompressed offset at or after start where
+        the bytes sub are found, or -1.
+        """
+        if start >= self.size : return -1
+        i = self._getBlockIndex(start)
+        tail = b''   # End of the previous block, for matches across blocks
+        tail_start = start
+        while i < len(self.uoffsets) :
+            data = self._getBlock(i)
+            base = max(self.uoffsets[i], start)
+            data = data[base - self.uoffsets[i]:]
+            found = (tail + data).find(sub)
+            if found >= 0 : return tail_start + found
+            keep = max(len(sub) - 1, 0)
+            tail = (tail + data)[-keep:] if keep else b''
+            tail_start = base + len(data) - len(tail)
+            i += 1
+
+        return -1
+
+def writeBgzf(inFilePath, outFilePath, level=6) :
+    """ Compresses inFilePath into the BGZF file outFilePath, in blocks of
+    BGZF_BLOCK_DATA uncompressed bytes, and writes its .gzi index.
+    """
+    coffsets, uoffsets = [], []
+    size = 0
+    with open(inFilePath, 'rb') as fin, open(outFilePath, 'wb') as fout :
+        data = fin.read(BGZF_BLOCK_DATA)
+        while data :
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+            cdata = compressor.compress(data) + compressor.flush()
+            coffsets.append(fout.tell())
+            uoffsets.append(size)
+            fout.write(GZIP_MAGIC + b'\x08\x04\0\0\0\0\0\xff\x06\0BC\x02\0')
+            fout.write(struct.pack('<H', len(cdata) + 25))
+            fout.write(cdata)
+            fout.write(struct.pack('<II', zlib.crc32(data), len(data)))
+            size += len(data)
+            data = fin.read(BGZF_BLOCK_DATA)
+        coffsets.append(fout.tell())
+        uoffsets.append(size)
+        fout.write(BGZF_EOF)
+    writeGziIndex((coffsets, uoffsets, size), getGziPath(outFilePath))
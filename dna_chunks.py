@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+import os
+import fasta_index as fidx, dna_kmers as kmers, dna_orfs as orf
+import dna_motifs as motifs, dna_parallel as parallel
+import stage_profile as prof
+
+# Windowed processing of records too long to hold as one string.  A record
+# is read through the FASTA index (see fasta_index.IndexedFasta) in windows
+# of chunk_size bases, each with just enough of its neighbours to give the
+# same answer as the whole record:
+# - k-mers: the n - 1 bases before the window, so every k-mer is counted in
+#   the window that holds its last base.
+# - motifs: the m - 1 bases before the window (m = longest motif) prime the
+#   automaton, only matches ending in the window are counted.
+# - ORFs: the 2 bases after the window complete its last codon.  Start
+#   codons still open at the end of a window are carried into the next one
+#   and closed by its first stop codon.  Reverse frames are scanned in
+#   windows of the reverse complement strand.
+# Windows are analyzed independently, on worker processes if jobs > 1, and
+# merged in order, so per record memory is bounded by a few windows (plus
+# the results themselves, e.g. a k-mer table).
+#
+# A ChunkedSeq can be passed wherever a DNA string is expected by
+# dna_kmers.countKmers, countKmer and iterKmerCodes, dna_motifs.countMotifs
+# and the ORF functions of dna_orfs, which hand the work over to it.
+
+DEFAULT_CHUNK_SIZE = 1 << 22   # 4 Mbp
+
+_indexed_files = {}   # (pid, path, size, mtime) -> IndexedFasta
+
+def _getIndexedFasta(inFilePath) :
+    """ Returns an IndexedFasta of inFilePath that stays open for the life
+    of the process, so workers only open each file once.  Keyed by process
+    id: a forked worker opens its own rather than sharing the file of its
+    parent.
+    """
+    st = os.stat(inFilePath)
+    key = (os.getpid(), inFilePath, st.st_size, st.st_mtime_ns)
+    data = _indexed_files.get(key)
+    if data is None :
+        data = _indexed_files[key] = fidx.IndexedFasta(inFilePath)
+    return data
+
+class SeqWindow(object) :
+    """ Bases [start, end) of one strand of the record seq_id (of length
+    length) of the FASTA file inFilePath.  strand is 1 for the sequence or
+    -1 for its reverse complement, whose positions count from the last base
+    of the sequence.  Only the description is kept, so windows are cheap to
+    send to worker processes which read the bases themselves.
+    """
+    def __init__(self, inFilePath, seq_id, length, start, end, strand=1) :
+        self.path = inFilePath
+        self.seq_id = seq_id
+        self.length = length
+        self.start = start
+        self.end = end
+        self.strand = strand
+
+    def __len__(self) :
+        return self.end - self.start
+
+    def readSeq(self, before=0, after=0) :
+        """ Returns a 2-tuple where:
+        tuple[0] - string of the forward strand bases of the window with
+                   before extra bases before it and after bases after it,
+                   clipped to the record
+        tuple[1] - position (0-based) of tuple[0][0] in the record
+        """
+        lo = max(self.start - before, 0)
+        hi = min(self.end + after, self.length)
+        return (_getIndexedFasta(self.path).getSeq(self.seq_id, lo, hi), lo)
+
+    def readCodes(self, before=0, after=0) :
+        """ Returns a 2-tuple (base codes of the window on its strand, see
+        dna_kmers.encodeDna, position of the first code on the strand).
+        before and after are as for readSeq, on the strand of the window.
+        """
+        lo = max(self.start - before, 0)
+        hi = min(self.end + after, self.length)
+        if self.strand > 0 :
+            dna = _getIndexedFasta(self.path).getSeq(self.seq_id, lo, hi)
+            return (kmers.encodeDna(dna), lo)
+        dna = _getIndexedFasta(self.path).getSeq(self.seq_id, self.length - hi,
+                                                  self.length - lo)
+        return (kmers.reverseComplementCodes(kmers.encodeDna(dna)), lo)
+
+class ChunkedSeq(object) :
+    """ The sequence of the record seq_id of inFilePath, of length length,
+    analyzed in windows of chunk_size bases (see top of this module).
+
+    jobs - number of worker processes the windows are spread over (see
+           dna_parallel.mapSeqs)
+    """
+    chunked = True   # Tells dna_parallel.mapSeqs to run it in this process
+
+    def __init__(self, inFilePath, seq_id, length,
+                 chunk_size=DEFAULT_CHUNK_SIZE, jobs=1) :
+        self.path = inFilePath
+        self.seq_id = seq_id
+        self.length = length
+        self.chunk_size = max(chunk_size, 1)
+        self.jobs = jobs
+
+    def __len__(self) :
+        return self.length
+
+    def getWindows(self, strand=1) :
+        """ Returns the list of SeqWindow that cover the strand in order. """
+        return [SeqWindow(self.path, self.seq_id, self.length, start,
+                          min(start + self.chunk_size, self.length), strand) \
+                for start in range(0, self.length, self.chunk_size)]
+
+    def mapWindows(self, func, args=(), strand=1) :
+        """ Generator that yields func(window, *args) for each window of the
+        strand, in order (see dna_parallel.mapSeqs).
+        """
+        windows = (("{}:{}-{}".format(self.seq_id, window.start, window.end),
+                    window) for window in self.getWindows(strand))
+        for key, result in parallel.mapSeqs(func, windows, args, self.jobs,
+                                            chunk_size=1) :
+            yield result
+
+    def countKmers(self, n=2, values_are_counts=True) :
+        """ Same as dna_kmers.countKmers on the whole sequence. """
+        merged = {}
+        for counts in self.mapWindows(countWindowKmers,
+                                      (n, values_are_counts)) :
+            for kmer, value in counts.items() :
+                if values_are_counts :
+                    merged[kmer] = merged.get(kmer, 0) + value
+                elif kmer in merged :
+                    merged[kmer].extend(value)
+                else :
+                    merged[kmer] = value
+
+        return merged
+
+    def countKmer(self, kmer) :
+        """ Same as dna_kmers.countKmer on the whole sequence. """
+        return sum(self.mapWindows(countWindowKmer, (kmer, )))
+
+    def iterKmerCodes(self, n) :
+        """ Same as dna_kmers.iterKmerCodes on the whole sequence.  Windows
+        are read one at a time in this process.
+        """
+        for window in self.getWindows() :
+            dna, offset = window.readSeq(before=n - 1)
+            for i, kmer in kmers.iterKmerCodes(dna, n) :
+                yield (i + offset, kmer)
+
+    def countMotifs(self, automaton) :
+        """ Same as dna_motifs.countMotifs on the whole sequence. """
+        totals = None
+        for counts in self.mapWindows(countWindowMotifs, (automaton, )) :
+            totals = counts if totals is None else \
+                     [t + c for t, c in zip(totals, counts)]
+
+        return totals if totals is not None else \
+               [0] * len(automaton[3])
+
+    def iterOpenReadingFrames(self, reading_frame=1, longest_only=False) :
+        """ Same as dna_orfs.iterOpenReadingFrames on the whole sequence:
+        the ORFs of each window (see scanWindowORFs) are joined through the
+        start codons left open at the end of each window.
+        """
+        strand = 1 if reading_frame > 0 else -1
+        orf_count = 0
+        carried = []   # Start codons open at the end of the last window
+        for first_stop, head, orfs, tail in self.mapWindows(scanWindowORFs,
+                                            (reading_frame, longest_only),
+                                            strand) :
+            if first_stop is None :   # No stop codon: all starts stay open
+                if not (longest_only and carried) : carried = carried + tail
+                continue
+            # With longest_only, a carried start hides the window's own.
+            closing = carried if longest_only and carried else carried + head
+            for start in closing :
+                yield self._getORF(start, first_stop, strand)
+            for start, stop in orfs :
+                yield self._getORF(start, stop, strand)
+            orf_count += len(closing) + len(orfs)
+            carried = tail
+        if prof.ENABLED : prof.addCount('orfs_emitted', orf_count)
+
+    def _getORF(self, start, stop, strand) :
+        """ Returns the (start index, length) 2-tuple of the ORF from the
+        start codon at start to the stop codon at stop (0-based positions
+        on the strand), as in dna_orfs.iterOpenReadingFrames.
+        """
+        index = start + 1 if strand > 0 else self.length - start
+        return (index, stop + 3 - start)
+
+def countWindowKmers(window, n, values_are_counts=True) :
+    """ Returns the k-mer table (see dna_kmers.countKmers) of the k-mers of
+    size n that end in window.  Indices are 1-based in the record.
+    """
+    dna, offset = window.readSeq(before=n - 1)
+    counts = kmers.countKmers(dna, n, values_are_counts)
+    if not values_are_counts and offset :
+        for positions in counts.values() :
+            positions[:] = [i + offset for i in positions]
+
+    return counts
+
+def countWindowKmer(window, kmer) :
+    """ Returns the number of occurances of kmer that end in window. """
+    dna, offset = window.readSeq(before=len(kmer) - 1)
+    return kmers.countKmer(dna, kmer)
+
+def countWindowMotifs(window, automaton) :
+    """ Returns the number of occurances of each motif of automaton (see
+    dna_motifs.countMotifs) that end in window.
+    """
+    longest = max([len(motif) for motif in automaton[0]] or [1])
+    dna, offset = window.readSeq(before=longest - 1)
+    return motifs.countMotifs(dna, automaton, window.start - offset)
+
+@prof.timed('orf_scan')
+def scanWindowORFs(window, reading_frame, longest_only=False) :
+    """ Scans the codons of reading_frame that start in window, a window of
+    the strand of reading_frame, as dna_orfs.iterOpenReadingFrames does,
+    and returns a 4-tuple where (positions are 0-based on the strand):
+    tuple[0] - position of the first stop codon, None if there is none
+    tuple[1] - list of the start codons of the window closed by that stop
+               codon, to which the starts carried from the previous windows
+               are added
+    tuple[2] - list of 2-tuples (start, stop) for the ORFs closed by the
+               later stop codons, in order
+    tuple[3] - list of the start codons still open at the end of the window
+    """
+    codes, offset = window.readCodes(after=2)
+    first = abs(reading_frame) - 1
+    start_index = window.start + (first - window.start) % 3
+    end_index = min(window.end, window.length - 2)
+    first_stop = None
+    head, orfs, open_starts = [], [], []
+    for i in range(start_index, end_index, 3) :
+        codon = codes[i - offset:i - offset + 3]
+        if codon == orf.START_CODON :
+            if not (longest_only and open_starts) :
+                open_starts.append(i)
+        elif codon in orf.STOP_CODONS :
+            if first_stop is None :
+                first_stop, head = i, open_starts
+            else :
+                orfs.extend((start, i) for start in open_starts)
+            open_starts = []
+    if prof.ENABLED :
+        prof.addCount('orf_bases_scanned', len(window))
+        prof.addCount('codons_tested', len(range(start_index, end_index, 3)))
+
+    return (first_stop, head, orfs, open_starts)
+
+class ChunkedFasta(object) :
+    """ Read-only, dictionary-like access to the records of the FASTA file
+    inFilePath, like fasta_index.IndexedFasta, except that the value of a
+    record longer than chunk_size bases is a ChunkedSeq instead of a string,
+    so it is never held in memory whole.  Shorter records are plain
+    strings.
+
+    jobs - see ChunkedSeq
+    """
+    def __init__(self, inFilePath, chunk_size=DEFAULT_CHUNK_SIZE, jobs=1) :
+        self.path = inFilePath
+        self.chunk_size = chunk_size
+        self.jobs = jobs
+        self.data = _getIndexedFasta(inFilePath)
+
+    def __len__(self) :
+        return len(self.data)
+
+    def __contains__(self, seq_id) :
+        return seq_id in self.data
+
+    def __iter__(self) :
+        return iter(self.data)
+
+    def keys(self) :
+        return self.data.keys()
+
+    def items(self) :
+        for seq_id in self.data :
+            yield (seq_id, self[seq_id])
+
+    def __getitem__(self, seq_id) :
+        length = self.data.getSeqLength(seq_id)
+        if length <= self.chunk_size :
+            return self.data.getSeq(seq_id)
+        return ChunkedSeq(self.path, seq_id, length, self.chunk_size, self.jobs)
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+from array import array
+import stage_profile as prof
+
+# k-mer counting engine.  A sequence is translated once into base codes
+# (A=0, C=1, G=2, T=3, anything else=4) and each k-mer is kept as a rolling
+# integer of 2 bits per base, so every k-mer is counted in O(1) and a whole
+# sequence in O(len(dna)).  k-mers that contain N or any other ambiguity
+# code are skipped.
+
+AMBIGUOUS = 4
+BASES = 'acgt'   # Base of each code, used to decode k-mers
+
+CODE_TABLE = bytearray([AMBIGUOUS]) * 256
+for _code, _bases in enumerate((b'Aa', b'Cc', b'Gg', b'Tt')) :
+    for _base in _bases :
+        CODE_TABLE[_base] = _code
+CODE_TABLE = bytes(CODE_TABLE)
+
+# Base code of the complement of each base code: A <-> T, C <-> G and
+# anything else stays ambiguous.
+COMPLEMENT_CODES = bytes([3, 2, 1, 0]) + bytes([AMBIGUOUS]) * 252
+
+# k-mers up to this size are counted in a flat array of 4**n counters,
+# larger ones in a dictionary.  The array is only used for sequences at
+# least as long as it, since it is allocated and zeroed for each sequence.
+MAX_ARRAY_N = 10
+
+def encodeDna(dna) :
+    """ Returns a bytes object with the base code of each base in dna, a
+    string of A's, T's, G's and C's which can be upper or lower case, or a
+    packed_seqs.PackedSequence whose codes are read without decoding it.
+    """
+    if hasattr(dna, 'toCodes') :
+        return dna.toCodes()
+    return dna.encode('ascii', 'replace').translate(CODE_TABLE)
+
+def reverseComplementCodes(codes) :
+    """ Returns a bytes object with the base codes of the reverse
+    complement of the sequence whose base codes are codes (see encodeDna).
+    """
+    return bytes(codes[::-1]).translate(COMPLEMENT_CODES)
+
+def encodeKmer(kmer) :
+    """ Returns the integer code of the string kmer, or -1 if kmer contains
+    a base other than A, C, G or T.
+    """
+    code = 0
+    for c in encodeDna(kmer) :
+        if c == AMBIGUOUS : return -1
+        code = (code << 2) | c
+
+    return code
+
+def decodeKmer(code, n) :
+    """ Returns the lower case string of length n for the k-mer code. """
+    return ''.join(BASES[(code >> (2 * i)) & 3] for i in range(n - 1, -1, -1))
+
+def iterKmerCodes(dna, n) :
+    """ Generator that yields a 2-tuple (python index, k-mer code) for each
+    k-mer of size n in dna that only has A's, C's, G's and T's.  dna can
+    also be a dna_chunks.ChunkedSeq, which reads itself in windows.
+    """
+    if hasattr(dna, 'iterKmerCodes') :
+        yield from dna.iterKmerCodes(n)
+        return
+    if n < 1 : return
+    mask = (1 << (2 * n)) - 1
+    kmer = 0
+    run = 0      # Number of unambiguous bases ending at index i
+    for i, c in enumerate(encodeDna(dna)) :
+        if c == AMBIGUOUS :
+            run = 0
+            continue
+        kmer = ((kmer << 2) | c) & mask
+        run += 1
+        if run >= n :
+            yield (i - n + 1, kmer)
+
+@prof.timed('kmer_count')
+def countKmers(dna, n=2, values_are_counts=True) :
+    """ Returns a dictionary where keys = k-mer codes (see decodeKmer) of
+    the substrings of length n in dna and values are either 1) the count of
+    each k-mer if values_are_counts = True (default) or 2) the list of
+    1-based indices of each k-mer in dna if values_are_counts = False.
+    Keys are in order of first occurance in dna.
+
+    dna - string, rep'n of DNA sequence of A's, T's, G's and C's which
+          can be upper or lower case, or a dna_chunks.ChunkedSeq
+    n - integer, size of the k-mers
+    """
+    if hasattr(dna, 'countKmers') :
+        return dna.countKmers(n, values_are_counts)
+    if not values_are_counts :
+        positions = {}
+        for i, kmer in iterKmerCodes(dna, n) :
+            if kmer in positions :
+                positions[kmer].append(i + 1)
+            else :
+                positions[kmer] = [i + 1, ]
+        if prof.ENABLED :
+            _countProfile(dna, sum(len(p) for p in positions.values()))
+        return positions
+    if n > MAX_ARRAY_N or len(dna) < 1 << (2 * n) :
+        counts = {}
+        for i, kmer in iterKmerCodes(dna, n) :
+            counts[kmer] = counts.get(kmer, 0) + 1
+    else :
+        table = array('L', [0]) * (1 << (2 * n))
+        order = []   # k-mers in order of first occurance
+        for i, kmer in iterKmerCodes(dna, n) :
+            if table[kmer] == 0 : order.append(kmer)
+            table[kmer] += 1
+        counts = {kmer : table[kmer] for kmer in order}
+    if prof.ENABLED : _countProfile(dna, sum(counts.values()))
+
+    return counts
+
+def _countProfile(dna, kmer_count) :
+    """ Adds a k-mer count of dna to the stage_profile counters. """
+    prof.addCount('kmer_bases_scanned', len(dna))
+    prof.addCount('kmers_counted', kmer_count)
+
+@prof.timed('kmer_count')
+def countKmer(dna, kmer) :
+    """ Returns the number of (possibly overlapping) occurances of the
+    string kmer in dna, ignoring case.  dna can also be a
+    dna_chunks.ChunkedSeq.
+    """
+    if hasattr(dna, 'countKmer') : return dna.countKmer(kmer)
+    code = encodeKmer(kmer)
+    if code < 0 : return 0   # Ambiguous k-mers are never counted
+
+    return sum(1 for i, c in iterKmerCodes(dna, len(kmer)) if c == code)
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+import dna_kmers as kmers, dna_parallel as parallel
+import stage_profile as prof
+
+# Multi-pattern motif counting with an Aho-Corasick automaton.  All motifs
+# are compiled into one automaton over the base codes of dna_kmers, so every
+# motif is counted in a single pass over each sequence no matter how many
+# motifs there are or how long they are.  Overlapping matches are counted,
+# the same way getOccsOfRepeatInSingleSeq counts them, and motifs or
+# sequence stretches with bases other than A, C, G or T never match.
+
+def buildMotifAutomaton(motifs) :
+    """ Returns a 5-tuple that represents the automaton for motifs where:
+    tuple[0] - list of motifs (lower case, duplicates removed) in the order
+               they were first given
+    tuple[1] - transition table: list with a 4 element list per state that
+               gives the next state for each base code
+    tuple[2] - list of states in breadth first order
+    tuple[3] - list of the state reached by each motif in tuple[0], or -1 if
+               the motif can never match
+    tuple[4] - list with the failure link of each state
+
+    motifs - iterable of strings of A's, T's, G's and C's which can be upper
+             or lower case
+    """
+    unique_motifs = list(dict.fromkeys(motif.lower() for motif in motifs))
+    # Build the trie.
+    goto = [[-1, -1, -1, -1], ]
+    motif_states = []
+    for motif in unique_motifs :
+        codes = kmers.encodeDna(motif)
+        if len(codes) == 0 or kmers.AMBIGUOUS in codes :
+            motif_states.append(-1)
+            continue
+        state = 0
+        for c in codes :
+            if goto[state][c] < 0 :
+                goto[state][c] = len(goto)
+                goto.append([-1, -1, -1, -1])
+            state = goto[state][c]
+        motif_states.append(state)
+    # Turn the trie into a complete transition table and set failure links.
+    fail = [0] * len(goto)
+    bfs_order = [0, ]
+    for c in range(4) :
+        if goto[0][c] < 0 : goto[0][c] = 0
+        else : bfs_order.append(goto[0][c])
+    i = 1
+    while i < len(bfs_order) :
+        state = bfs_order[i]
+        for c in range(4) :
+            child = goto[state][c]
+            if child < 0 :
+                goto[state][c] = goto[fail[state]][c]
+            else :
+                fail[child] = goto[fail[state]][c]
+                bfs_order.append(child)
+        i += 1
+
+    return (unique_motifs, goto, bfs_order, motif_states, fail)
+
+@prof.timed('motif_count')
+def countMotifs(dna, automaton, skip=0) :
+    """ Returns a list with the number of occurances in dna of each motif of
+    automaton (see buildMotifAutomaton), in the same order as its motifs.
+
+    dna - string, rep'n of DNA sequence of A's, T's, G's and C's which
+          can be upper or lower case, or a dna_chunks.ChunkedSeq
+    skip - number of bases at the start of dna that are only read to set
+           the state of the automaton: matches ending there aren't counted
+    """
+    if hasattr(dna, 'countMotifs') : return dna.countMotifs(automaton)
+    unique_motifs, goto, bfs_order, motif_states, fail = automaton
+    visits = [0] * len(goto)
+    state = 0
+    codes = kmers.encodeDna(dna)
+    for c in codes[:skip] :
+        state = 0 if c == kmers.AMBIGUOUS else goto[state][c]
+    for c in codes[skip:] :
+        if c == kmers.AMBIGUOUS :
+            state = 0
+        else :
+            state = goto[state][c]
+            visits[state] += 1
+    # A visit to a state is also a match of every motif on its failure
+    # chain: push the visits down the failure links, deepest states first.
+    for state in reversed(bfs_order[1:]) :
+        visits[fail[state]] += visits[state]
+    if prof.ENABLED : prof.addCount('motif_bases_scanned', len(codes) - skip)
+
+    return [visits[s] if s >= 0 else 0 for s in motif_states]
+
+def getMotifCounts(dna_seqs, motifs, jobs=1) :
+    """ Returns a dictionary with keys that are sequence ids and values that
+    are dictionaries with the motifs in motifs as keys and the number of
+    occurances of each motif in that sequence as values.
+
+    dna_seqs - Dictionary where keys = sequence identifiers and values =
+    DNA seqeunce for that record, or an iterable of records as yielded by
+    read_fasta.iterFasta.
+    motifs - list of strings of A's, T's, G's and C's
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
+    """
+    automaton = buildMotifAutomaton(motifs)
+    motif_index = {motif : i for i, motif in enumerate(automaton[0])}
+    result = {}
+    for sid, counts in parallel.mapSeqs(countMotifs, dna_seqs, (automaton, ),
+                                        jobs) :
+        result[sid] = {motif : counts[motif_index[motif.lower()]] \
+                       for motif in motifs}
+
+    return result
+
+def readMotifFile(inFilePath) :
+    """ Returns the list of motifs in the text file inFilePath which has one
+    motif per line.  Blank lines and lines that start with # or > are
+    skipped, so a FASTA file of short sequences can also be used.
+    """
+    motifs = []
+    with open(inFilePath) as f :
+        for line in f :
+            line = line.strip()
+            if line and not line.startswith(('#', '>')) :
+                motifs.append(line)
+
+    return motifs
@@ -1,120 +1,242 @@
 #!/usr/bin/python3
+import heapq
+import dna_kmers as kmers, dna_motifs as motifs, dna_parallel as parallel
 
+# The functions that count repeats over all the sequences of a FASTA file
+# (getOccsOfRepeatInAllSeqs, getAllOccsOfRepeat, getFirstMostFrequentRepeatN
+# and getAllMostFrequentRepeatN) answer from its suffix index instead of
+# scanning the sequences when dna_seqs has one, see
+# suffix_index.SuffixIndexedFasta.  The results are the same.
+
+def getSuffixIndex(dna_seqs) :
+    """ Returns the suffix_index.SuffixIndex of dna_seqs, or None if it
+    doesn't have one.
+    """
+    return getattr(dna_seqs, 'suffix_index', None)
 
 def getNRepeats(dna, n=2, values_are_counts=True) :
     """ Returns a dictionary where:
     keys = lower case substrings of length n in dna and values are are either
     1) the frequency/count of each substring if values_are_counts = True
     (default) or 2) the index of each substring found in dna if
-    values_are_counts = False.
+    values_are_counts = False.  Keys are in order of first occurance and
+    substrings with bases other than A, C, G or T (e.g. N) are not counted.
     
     dna - string, rep'n of DNA sequence of A's, T's, G's and C's which
           can be upper or lower case
     n - integer, allowable value: 1 to len(dna), length of substrings
         to count frequencies on
     """
-    dna = dna.lower()
-    # Get all the substrings and set them as keys in our dictionary.
-    repeats = {}
-    for i in range(0, len(dna)-n) :
-        substr = dna[i:i+n]
-        if values_are_counts :
-            repeats[substr] = 0
-        else :
-            repeats[substr] = []
-    # Count or get start index of each instance of each key.
-    for key in repeats.keys() :
-        for j in range(0, len(dna)-n) :
-            subdna = dna[j:j+n]
-            if key == subdna :
-                if values_are_counts :
-                    repeats[key] += 1
-                else :
-                    repeats[key].append(j+1) # convert to 1-based indices
+    repeats = kmers.countKmers(dna, n, values_are_counts)
                 
-    return repeats
+    return {kmers.decodeKmer(kmer, n) : value \
+            for kmer, value in repeats.items()}
     
-def getFirstMostFrequentRepeatN(dna_seqs, nrep) :
+def getMostFrequentRepeatsInCounts(repeats, nreps) :
+    """ Returns the 2-tuple described in getMostFrequentRepeatsInSeq from
+    repeats, a k-mer table of size nreps as returned by
+    dna_kmers.countKmers.
+    """
+    longest_n_repeats = []
+    longest_n_sub_count = -1
+    for nrepeat, nrep_count in repeats.items() :
+        if nrep_count > longest_n_sub_count :
+            longest_n_sub_count = nrep_count
+            longest_n_repeats = [nrepeat, ]
+        elif nrep_count == longest_n_sub_count :
+            longest_n_repeats.append(nrepeat)
+
+    return (longest_n_sub_count,
+            [kmers.decodeKmer(nrepeat, nreps) for nrepeat in longest_n_repeats])
+
+def getMostFrequentRepeatsInSeq(dna, nreps) :
+    """ Returns a 2-tuple where:
+    tuple[0] = integer number of occurances of the most frequently occuring
+               repeats of size nreps in dna, -1 if dna has no such repeat
+    tuple[1] = list of those repeats in order of first occurance
+    """
+    repeats = kmers.countKmers(dna, nreps)  # Get all repeats size n.
+
+    return getMostFrequentRepeatsInCounts(repeats, nreps)
+
+def mergeFirstMostFrequentRepeat(seqs_repeats) :
+    """ Returns the result of getFirstMostFrequentRepeatN from
+    seqs_repeats, an iterable of 2-tuples (seq_id, 2-tuple as returned by
+    getMostFrequentRepeatsInSeq) in record order.
+    """
+    longest_n_repeat = ""
+    longest_n_sub_count = -1
+    for seq_id, (nrep_count, nrepeats) in seqs_repeats :
+        if nrep_count > longest_n_sub_count :
+            longest_n_sub_count = nrep_count
+            longest_n_repeat = nrepeats[0]
+
+    return longest_n_repeat
+
+def mergeMostFrequentRepeats(seqs_repeats) :
+    """ Returns the result of getAllMostFrequentRepeatN from seqs_repeats,
+    an iterable of 2-tuples (seq_id, 2-tuple as returned by
+    getMostFrequentRepeatsInSeq) in record order.
+    """
+    longest_n_repeats = []
+    longest_n_sub_count = -1
+    for seq_id, (nrep_count, nrepeats) in seqs_repeats :
+        if nrep_count > longest_n_sub_count :
+            longest_n_sub_count = nrep_count
+            longest_n_repeats = list(nrepeats)
+        elif nrep_count == longest_n_sub_count :
+            longest_n_repeats.extend(nrepeats)
+
+    return (longest_n_repeats, longest_n_sub_count)
+
+def getFirstMostFrequentRepeatN(dna_seqs, nrep, jobs=1) :
     """ Returns a string that is the first instance of the most frequently
     occuring repeat of size nrep.
     
     dna_seqs - Dictionary where keys = sequence identifiers and values =
-    DNA seqeunce for that record.
+    DNA seqeunce for that record, or an iterable of records as yielded by
+    read_fasta.iterFasta.
     nrep - Size of the repeat to search on.
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
     """
-    longest_n_repeat = ""
-    longest_n_sub_count = -1
-    for seq_id in dna_seqs.keys() :
-        dna = dna_seqs[seq_id]
-        repeats = getNRepeats(dna, nrep)
-        for nrepeat, nrep_count in repeats.items() :
-            if nrep_count > longest_n_sub_count :
-                longest_n_sub_count = nrep_count
-                longest_n_repeat = nrepeat
+    index = getSuffixIndex(dna_seqs)
+    if index is not None :
+        return mergeFirstMostFrequentRepeat(index.getMostFrequentRepeats(nrep))
+    seqs_repeats = parallel.mapSeqs(getMostFrequentRepeatsInSeq, dna_seqs,
+                                    (nrep, ), jobs)
     
-    return longest_n_repeat
+    return mergeFirstMostFrequentRepeat(seqs_repeats)
 
-def getAllMostFrequentRepeatN(dna_seqs, nreps) :
+def getAllMostFrequentRepeatN(dna_seqs, nreps, jobs=1) :
     """ Returns a 2-tuple where:
     tuple[0] = list of strings that are all the instances of the most
                frequently occuring repeats of size nrep.
     tuple[1] = integer number of occurances of the repeats in tuple[0]
     
     dna_seqs - Dictionary where keys = sequence identifiers and values =
-    DNA seqeunce for that record.
+    DNA seqeunce for that record, or an iterable of records as yielded by
+    read_fasta.iterFasta.
     nrep - Size of the repeat to search on.
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
     """
-    longest_n_repeats = []
-    longest_n_sub_count = -1
-    for seq_id in dna_seqs.keys() :
-        dna = dna_seqs[seq_id]
-        repeats = getNRepeats(dna, nreps)  # Get all repeats size n.
-        for nrepeat, nrep_count in repeats.items() :
-            if nrep_count > longest_n_sub_count :
-                longest_n_sub_count = nrep_count
-                longest_n_repeats = [nrepeat, ]
-            elif nrep_count == longest_n_sub_count :
-                longest_n_repeats.append(nrepeat)
+    # Merge the most frequent repeats of each sequence in record order.
+    index = getSuffixIndex(dna_seqs)
+    if index is not None :
+        seqs_repeats = index.getMostFrequentRepeats(nreps)
+    else :
+        seqs_repeats = parallel.mapSeqs(getMostFrequentRepeatsInSeq, dna_seqs,
+                                        (nreps, ), jobs)
     
-    return (longest_n_repeats, longest_n_sub_count)
+    return mergeMostFrequentRepeats(seqs_repeats)
     
+def getTopRepeatsInSeq(dna, nreps, k) :
+    """ Returns a list with up to k 3-tuples, most frequent first, for the
+    k most frequent repeats of size nreps in dna:
+    tuple[0] - number of occurances of the repeat
+    tuple[1] - the repeat (lower case)
+    tuple[2] - index (1-based) of its first occurance in dna
+    Repeats with the same count are in order of first occurance.
+    """
+    counts = kmers.countKmers(dna, nreps)
+    top = heapq.nlargest(k, counts.items(), key=lambda item : item[1])
+    # Find where the chosen repeats first occur, stopping once all are seen.
+    first_index = {code : None for code, count in top}
+    missing = len(first_index)
+    for i, code in kmers.iterKmerCodes(dna, nreps) :
+        if missing == 0 : break
+        if code in first_index and first_index[code] is None :
+            first_index[code] = i + 1
+            missing -= 1
+
+    return [(count, kmers.decodeKmer(code, nreps), first_index[code]) \
+            for code, count in top]
+
+def getTopRepeats(dna_seqs, nreps, k, jobs=1) :
+    """ Returns a list with up to k 4-tuples, most frequent first, for the
+    k (repeat, sequence) pairs with the highest number of occurances of a
+    repeat of size nreps in a single sequence, the same per sequence counts
+    as getAllMostFrequentRepeatN:
+    tuple[0] - number of occurances of the repeat in the sequence
+    tuple[1] - the repeat (lower case)
+    tuple[2] - seq_id of the sequence
+    tuple[3] - index (1-based) of the first occurance of the repeat in it
+    Pairs with the same count are in record order, then in order of first
+    occurance.  Only the k best repeats of each sequence are kept and
+    merged through a heap of k elements.
+
+    dna_seqs - see getAllMostFrequentRepeatN
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
+    """
+    seqs_top = parallel.mapSeqs(getTopRepeatsInSeq, dna_seqs, (nreps, k), jobs)
+    repeats = ((count, repeat, seq_id, index) for seq_id, top in seqs_top \
+               for count, repeat, index in top)
+
+    return heapq.nlargest(k, repeats, key=lambda repeat : repeat[0])
+
 def getOccsOfRepeatInSingleSeq(dna, repeat) :
     """ Returns an integer which is the number of occurance of repeat
     in dna
     """
-    repeat = repeat.lower()
-    all_repeats = getNRepeats(dna, len(repeat))
-    occurances = all_repeats.get(repeat, 0)
+    occurances = kmers.countKmer(dna, repeat)
     
     return occurances
     
-def getOccsOfRepeatInAllSeqs(dna_seqs, repeat) :
+def getOccsOfRepeatInAllSeqs(dna_seqs, repeat, jobs=1) :
     """ Returns a dictionary with keys that are sequence ids and
     values that are integers which are the number of occurance of repeat
     in each of the sequences in dna_seqs
     
     dna_seqs - Dictionary where keys = sequence identifiers and values =
-    DNA seqeunce for that record.
+    DNA seqeunce for that record, or an iterable of records as yielded by
+    read_fasta.iterFasta.
     repeat - string of A's, T's, G's and C's which representing a nucleotide
-             sequence
+             sequence, or a list of such strings.  For a list, the values
+             of the returned dictionary are dictionaries with the repeats
+             as keys and their number of occurances as values, all counted
+             in one pass over each sequence (see dna_motifs).
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
     """
+    index = getSuffixIndex(dna_seqs)
+    if index is not None :
+        if isinstance(repeat, str) :
+            return dict(zip(index.seq_ids, index.countRepeat(repeat).tolist()))
+        counts = {rep : index.countRepeat(rep).tolist() for rep in repeat}
+        return {sid : {rep : counts[rep][i] for rep in repeat} \
+                for i, sid in enumerate(index.seq_ids)}
+    if not isinstance(repeat, str) :
+        return motifs.getMotifCounts(dna_seqs, repeat, jobs)
     result = {}
-    for sid, dna in dna_seqs.items() :
-        result[sid] = getOccsOfRepeatInSingleSeq(dna, repeat)
+    for sid, count in parallel.mapSeqs(getOccsOfRepeatInSingleSeq, dna_seqs,
+                                       (repeat, ), jobs) :
+        result[sid] = count
         
     return result
     
-def getAllOccsOfRepeat(dna_seqs, repeat) :
+def getAllOccsOfRepeat(dna_seqs, repeat, jobs=1) :
     """ Returns an integer that's the count of all instance of repeat
     over all sequences in dna_seqs.
     
     dna_seqs - Dictionary where keys = sequence identifiers and values =
-    DNA seqeunce for that record.
+    DNA seqeunce for that record, or an iterable of records as yielded by
+    read_fasta.iterFasta.
     repeat - string of A's, T's, G's and C's which representing a nucleotide
-             sequence
+             sequence, or a list of such strings in which case a dictionary
+             with the total count of each repeat is returned.
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
     """
+    index = getSuffixIndex(dna_seqs)
+    if index is not None :
+        if isinstance(repeat, str) :
+            return int(index.countRepeat(repeat).sum())
+        return {rep : int(index.countRepeat(rep).sum()) for rep in repeat}
+    allOccsOfRepeat = getOccsOfRepeatInAllSeqs(dna_seqs, repeat, jobs)
+    if not isinstance(repeat, str) :
+        result = {rep : 0 for rep in repeat}
+        for counts in allOccsOfRepeat.values() :
+            for rep, count in counts.items() :
+                result[rep] += count
+        return result
     result = 0
-    allOccsOfRepeat = getOccsOfRepeatInAllSeqs(dna_seqs, repeat)
     for count in allOccsOfRepeat.values() :
         result += count
     
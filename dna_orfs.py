@@ -1,3 +1,7 @@
+import sys, heapq
+import read_fasta, dna_kmers as kmers, dna_parallel as parallel
+import stage_profile as prof
+
 
 # test:
 # dna = "ATGGGTATGGGGTGA", start codons at 0 and 6, stop codon at 12
@@ -45,7 +49,124 @@ def getNextCodonIndex(dna, start_index=0, find_start_codon=True,
     
     return next_start_index
 
-def getOpenReadingFrames(raw_dna, reading_frame=1) :
+# Start and stop codons as base codes (see dna_kmers.encodeDna).  Sequences
+# are encoded once so codons are compared without any case folding.
+START_CODON = kmers.encodeDna('atg')
+STOP_CODONS = frozenset(kmers.encodeDna(c) for c in ('tga', 'tag', 'taa'))
+
+# Reading frames 1, 2 and 3 start at the first, second and third base of the
+# sequence; -1, -2 and -3 at the first, second and third base of its reverse
+# complement, i.e. the last, second to last and third to last base of the
+# sequence read backwards.  reading_frame 0 means the three forward frames
+# and ALL_FRAMES the six frames of both strands.
+FORWARD_FRAMES = (1, 2, 3)
+REVERSE_FRAMES = (-1, -2, -3)
+ALL_FRAMES = 6
+
+def getReadingFrames(reading_frame) :
+    """ Returns the tuple of reading frames meant by reading_frame: the
+    frame itself for 1, 2, 3, -1, -2 or -3, the forward frames for 0 and all
+    six frames for ALL_FRAMES.  Returns None if reading_frame is not valid.
+    """
+    if reading_frame in FORWARD_FRAMES + REVERSE_FRAMES :
+        return (reading_frame, )
+    elif reading_frame == 0 :
+        return FORWARD_FRAMES
+    elif reading_frame == ALL_FRAMES :
+        return FORWARD_FRAMES + REVERSE_FRAMES
+    return None
+
+class StrandCodes(object) :
+    """ Base codes of a DNA sequence (see dna_kmers.encodeDna) and of its
+    reverse complement, each built once and shared by every reading frame.
+    Can be passed to the ORF functions of this module in place of raw_dna.
+    """
+    def __init__(self, raw_dna, reverse=True) :
+        self.codes = kmers.encodeDna(raw_dna)
+        self.rc_codes = kmers.reverseComplementCodes(self.codes) \
+                        if reverse else None
+
+    def __len__(self) :
+        return len(self.codes)
+
+    def getFrameCodes(self, reading_frame) :
+        """ Returns the codes of the strand read by reading_frame. """
+        if reading_frame > 0 : return self.codes
+        if self.rc_codes is None :
+            self.rc_codes = kmers.reverseComplementCodes(self.codes)
+        return self.rc_codes
+
+def isChunked(raw_dna) :
+    """ Returns True if raw_dna is a dna_chunks.ChunkedSeq, which finds its
+    own ORFs window by window.
+    """
+    return hasattr(raw_dna, 'iterOpenReadingFrames')
+
+def getStrandCodes(raw_dna, reading_frames=FORWARD_FRAMES) :
+    """ Returns raw_dna if it is already a StrandCodes (or a
+    dna_chunks.ChunkedSeq), otherwise a new StrandCodes with the reverse
+    complement only if a frame in reading_frames needs it.
+    """
+    if isinstance(raw_dna, StrandCodes) or isChunked(raw_dna) : return raw_dna
+    return StrandCodes(raw_dna, any(rframe < 0 for rframe in reading_frames))
+
+@prof.timed('orf_scan')
+def scanOpenReadingFrames(raw_dna, reading_frame=1, longest_only=False) :
+    """ Returns a list called orfs_list containing 2-tuples, one for each
+    Open Reading Frame (ORF) in reading_frame of raw_dna where:
+    tuple[0] = index of start codon (1-based)
+    tuple[1] = length of the ORF
+
+    Every start codon that is followed by a stop codon gives an ORF which
+    ends at the first such stop codon.  The reading frame is walked once:
+    start codons are kept open until a stop codon is reached, at which
+    point an ORF is emitted for each of them.
+
+    raw_dna - string, rep'n of DNA sequence of A's, T's, G's and C's
+          which can be upper or lower case, a packed_seqs.PackedSequence,
+          a StrandCodes or a dna_chunks.ChunkedSeq
+    reading_frame - int, valid values: 1, 2, 3, -1, -2 or -3
+    longest_only - boolean. If True, only the longest ORF ending at each
+          stop codon (the one from the first open start codon) is emitted.
+
+    Indices are always on the forward strand.  For the reverse frames the
+    start index is the first base of the start codon read on the reverse
+    strand, so the ORF covers the length bases ending at that index.
+    orfs_list is in order of start codon along its strand.
+    """
+    return list(iterOpenReadingFrames(raw_dna, reading_frame, longest_only))
+
+def iterOpenReadingFrames(raw_dna, reading_frame=1, longest_only=False) :
+    """ Generator that yields the ORFs of scanOpenReadingFrames one at a
+    time, in the same order, without building the list.
+    """
+    if isChunked(raw_dna) :
+        yield from raw_dna.iterOpenReadingFrames(reading_frame, longest_only)
+        return
+    codes = getStrandCodes(raw_dna, (reading_frame, ))\
+            .getFrameCodes(reading_frame)
+    # Start indices on the reverse strand map back to the forward strand.
+    to_forward = len(codes) if reading_frame < 0 else -1
+    first = abs(reading_frame) - 1
+    orf_count = 0
+    open_starts = []  # python indices of start codons waiting for a stop
+    for i in range(first, len(codes) - 2, 3) :
+        codon = codes[i:i+3]
+        if codon == START_CODON :
+            if not (longest_only and open_starts) :
+                open_starts.append(i)
+        elif codon in STOP_CODONS and open_starts :
+            for start in open_starts :
+                yield (abs(to_forward - start), i + 3 - start)
+            orf_count += len(open_starts)
+            open_starts = []
+    # Start codons still open at the end have no stop codon: not ORFs.
+    if prof.ENABLED :
+        prof.addCount('orf_bases_scanned', len(codes))
+        prof.addCount('codons_tested', len(range(first, len(codes) - 2, 3)))
+        prof.addCount('orfs_emitted', orf_count)
+
+def getOpenReadingFrames(raw_dna, reading_frame=1, longest_only=False) :
     """ Returns a list called orfs_list containing 2-tuples. Each tuple
     corresponds to an Open Reading Frame (ORF) where:
     tuple[0] = index of start codon
@@ -54,37 +175,123 @@ def getOpenReadingFrames(raw_dna, reading_frame=1) :
     raw_dna - string, rep'n of DNA sequence of A's, T's, G's and C's
           which can be upper or lower case
     reading_frame - int, valid values: 1, 2, or 3 corresponding to reading
-          frames 1, 2, or 3 respespectively to be used in reading dna string
+          frames 1, 2, or 3 respespectively to be used in reading dna string,
+          or -1, -2, -3 for the frames of the reverse strand (see
+          scanOpenReadingFrames)
+    longest_only - boolean. If True, only the longest ORF ending at each stop
+          codon is returned (see scanOpenReadingFrames).  The longest ORF of
+          the sequence is the same either way.
     
     orfs_list is sorted by tuple[1] (ORF length) ascending order
     """
-    dna = raw_dna[reading_frame-1:]  # Read only bases in the reading frame
-    orfs_list = []
-    start_codon_python_index = getNextCodonIndex(dna) # Start at beginning
-    while start_codon_python_index > -1 :
-        stop_codon_python_index = \
-        getNextCodonIndex(dna, start_codon_python_index + 3, False)
-        if stop_codon_python_index > -1 :
-            orf_length = stop_codon_python_index + 3 - start_codon_python_index
-            # Create returned tuples as 1-based indices.
-            start_codon_index = start_codon_python_index + 1
-            stop_codon_index = stop_codon_python_index + 1
-            true_start_codon_index = start_codon_index+reading_frame-1
-            orf_record = (true_start_codon_index, orf_length)
-            orfs_list.append(orf_record)
-            #print("  *********** adding tuple:", orf_record, " ***********\n")
-        else :
-            break  # No more stop codons following start codons: exit
-        # Look for next start codon.
-        start_codon_python_index = \
-        getNextCodonIndex(dna, start_codon_python_index + 3)
-    # Sort list by third element in tuple: (how does lambda thingy work?...)
-    # http://stackoverflow.com/questions/3121979/how-to-sort-list-tuple-of-lists-tuples
-    orfs_list = sorted(orfs_list, key=lambda tup: tup[1])
+    orfs_list = scanOpenReadingFrames(raw_dna, reading_frame, longest_only)
+    # Sort list by second element in tuple.  The sort is stable so ORFs of
+    # equal length stay in order of start codon index.
+    if prof.ENABLED : start = prof.now()
+    orfs_list.sort(key=lambda tup: tup[1])
+    if prof.ENABLED : prof.addTime('orf_sort', start)
     
     return orfs_list
     
-def getShortLongestORFsInAll(dna_dict, want_shortest=True, reading_frame=1) :
+def _getBackendModule(backend) :
+    """ Returns the module implementing the ORF backend named backend:
+    'python' (this module, the reference) or 'numpy' (dna_orfs_np).
+    """
+    if backend == 'python' :
+        return sys.modules[__name__]
+    elif backend == 'numpy' :
+        import dna_orfs_np  # Optional: needs NumPy installed
+        return dna_orfs_np
+    raise ValueError("Unknown ORF backend: {}".format(backend))
+
+def getFramesORFs(raw_dna, reading_frames=(1, 2, 3), longest_only=False,
+                  backend='python') :
+    """ Returns a dictionary where keys are the reading frames in
+    reading_frames and values are the ORF lists for that frame as returned
+    by getOpenReadingFrames.
+
+    backend - 'python' (default) or 'numpy'. Both encode raw_dna (and its
+              reverse complement if a frame needs it) once for all frames;
+              the numpy backend also finds the ORFs of all frames together.
+              A dna_chunks.ChunkedSeq always uses the python backend.
+    """
+    if backend == 'python' or isChunked(raw_dna) :
+        strands = getStrandCodes(raw_dna, reading_frames)
+        return {rframe : getOpenReadingFrames(strands, rframe, longest_only) \
+                for rframe in reading_frames}
+    return _getBackendModule(backend).getFramesORFs(raw_dna, reading_frames,
+                                                    longest_only)
+
+def getFramesShortLongestORF(raw_dna, reading_frames=(1, 2, 3),
+                             want_shortest=True, backend='python') :
+    """ Returns a dictionary where keys are the reading frames in
+    reading_frames and values are the 2-tuple (start index, length) of the
+    shortest (want_shortest = True) or longest ORF in that frame, or None if
+    there is no ORF in that frame.  See getFramesORFs for backend.
+    """
+    if isChunked(raw_dna) :
+        return {rframe : selectShortLongestORF(iterOpenReadingFrames(raw_dna,
+                         rframe, not want_shortest), want_shortest) \
+                for rframe in reading_frames}
+    if backend != 'python' :
+        return _getBackendModule(backend).getFramesShortLongestORF(\
+               raw_dna, reading_frames, want_shortest)
+    strands = getStrandCodes(raw_dna, reading_frames)
+    frames_orf = {}
+    for rframe in reading_frames :
+        # Only the longest ORF per stop codon can be the longest overall.
+        orfs = getOpenReadingFrames(strands, rframe, not want_shortest)
+        if len(orfs) < 1 :
+            frames_orf[rframe] = None
+        else :
+            frames_orf[rframe] = orfs[0] if want_shortest else orfs[-1]
+
+    return frames_orf
+
+def getFramesShortAndLongestORF(raw_dna, reading_frames=(1, 2, 3),
+                                backend='python') :
+    """ Returns a dictionary where keys are the reading frames in
+    reading_frames and values are 2-tuples (shortest ORF, longest ORF) as
+    picked by getFramesShortLongestORF, each None if there is no ORF in that
+    frame.  Each frame is scanned once for both.  See getFramesORFs for
+    backend.
+    """
+    if isChunked(raw_dna) :
+        frames_orfs = {}
+        for rframe in reading_frames :
+            shortest = longest = None
+            for orf in iterOpenReadingFrames(raw_dna, rframe) :
+                if shortest is None or orf[1] < shortest[1] : shortest = orf
+                if longest is None or orf[1] >= longest[1] : longest = orf
+            frames_orfs[rframe] = (shortest, longest)
+        return frames_orfs
+    if backend != 'python' :
+        return _getBackendModule(backend).getFramesShortAndLongestORF(\
+               raw_dna, reading_frames)
+    strands = getStrandCodes(raw_dna, reading_frames)
+    frames_orfs = {}
+    for rframe in reading_frames :
+        orfs = getOpenReadingFrames(strands, rframe)
+        frames_orfs[rframe] = (orfs[0], orfs[-1]) if orfs else (None, None)
+
+    return frames_orfs
+
+def selectShortLongestORF(orfs, want_shortest=True) :
+    """ Returns the ORF of getOpenReadingFrames that getFramesShortLongestORF
+    picks, the first shortest or the last longest, from orfs, an iterable of
+    the unsorted ORFs in the order of scanOpenReadingFrames.  Only one ORF
+    is held at a time.  Returns None if orfs is empty.
+    """
+    best = None
+    for orf in orfs :
+        if best is None or (orf[1] < best[1] if want_shortest else \
+                            orf[1] >= best[1]) :
+            best = orf
+
+    return best
+
+def getShortLongestORFsInAll(dna_dict, want_shortest=True, reading_frame=1,
+                             backend='python', jobs=1) :
     """ Returns a 3-tuple where 
     
     tuple[0] - length of the ORF, shortest if want_shortest = True or
@@ -94,61 +301,165 @@ def getShortLongestORFsInAll(dna_dict, want_shortest=True, reading_frame=1) :
     
     If no ORFs could be found, return tuple will have -1 in first 2 elements.
     
-    dna - string, rep'n of DNA sequence of A's, T's, G's and C's which
-          can be upper or lower case
+    dna_dict - keys = sequence ids, values = DNA sequence of A's, T's, G's
+               and C's which can be upper or lower case.  Can also be an
+               iterable of records as yielded by read_fasta.iterFasta
     reading_frame - reading frame to find longest or shortest ORF on. Valid
-                    values are 1, 2, 3, or 0 if over all reading frames
+                    values are 1, 2, 3, -1, -2, -3, 0 if over the forward
+                    reading frames or ALL_FRAMES (6) if over all six
+    backend - 'python' (default) or 'numpy', see getFramesORFs
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
+    """
+    rframes = getReadingFrames(reading_frame)
+    if rframes is None : return -1
+    if len(rframes) == 1 : rframes = list(rframes)
+    print("rframes = {}".format(rframes))
+    seqs_frames_orf = parallel.mapSeqs(getFramesShortLongestORF, dna_dict,
+                                       (rframes, want_shortest, backend), jobs)
+        
+    return mergeShortLongestORFs(seqs_frames_orf, rframes, want_shortest)
+
+def mergeShortLongestORFs(seqs_frames_orf, reading_frames, want_shortest=True) :
+    """ Returns the 3-tuple described in getShortLongestORFsInAll from the
+    per sequence results seqs_frames_orf, an iterable of 2-tuples
+    (seq_id, dictionary as returned by getFramesShortLongestORF).
+
+    reading_frames - the reading frames to merge, in order
     """
     minmaxlen = -1
     minmaxindex = -1
     minmaxseq = "unassigned"
-    if not(reading_frame in (0, 1, 2, 3)) : return minmaxlen
-    all_rfs = (1, 2, 3)  # All valid reading frames
-    rframes = [reading_frame, ] if (reading_frame in all_rfs) else all_rfs
-    print("rframes = {}".format(rframes))
-    for rframe in rframes :
-        for seq_id, dna in dna_dict.items() :
-            orfs = getOpenReadingFrames(dna, rframe)
-            if len(orfs) < 1 :
-                # print("len={}, index={}, seq={}".format(orfs[-1][1], orfs[-1][0], seq_id))
+    # Keep the best ORF of each reading frame so the sequences only need to
+    # be read once.  Frames are merged in order afterwards, which gives the
+    # same result as searching one reading frame at a time.
+    frame_bests = {rframe : (minmaxlen, minmaxindex, minmaxseq) \
+                   for rframe in reading_frames}
+    for seq_id, frames_orf in seqs_frames_orf :
+        for rframe in reading_frames :
+            orf = frames_orf[rframe]
+            if orf is None :
                 continue  # Couldn't find an ORF in this seq_id
+            best = frame_bests[rframe]
             if want_shortest :
-                if orfs[0][1] < minmaxlen :
-                    minmaxindex = orfs[0][0]
-                    minmaxlen = orfs[0][1]
-                    minmaxseq = seq_id
+                if orf[1] < best[0] :
+                    frame_bests[rframe] = (orf[1], orf[0], seq_id)
             else :
-                if orfs[-1][1] > minmaxlen :
-                    minmaxindex = orfs[-1][0]
-                    minmaxlen = orfs[-1][1]
-                    minmaxseq = seq_id
+                if orf[1] > best[0] :
+                    frame_bests[rframe] = (orf[1], orf[0], seq_id)
+    for rframe in reading_frames :
+        best = frame_bests[rframe]
+        if want_shortest :
+            if best[0] < minmaxlen :
+                minmaxlen, minmaxindex, minmaxseq = best
+        else :
+            if best[0] > minmaxlen :
+                minmaxlen, minmaxindex, minmaxseq = best
         
     return (minmaxlen, minmaxindex, minmaxseq)
-    
-def getLengthLongestORF(dna_dict, seq_id, reading_frame=1) :
+
+def selectTopORFs(orfs, k, want_shortest=False, key=lambda orf : orf[1]) :
+    """ Returns a list with the k longest (or shortest if want_shortest =
+    True) ORFs of the iterable orfs, best first.  Only k ORFs are held in
+    memory at a time.  ORFs of equal length stay in the order of orfs.
+
+    key - function that returns the length of an element of orfs
+    """
+    if want_shortest :
+        return heapq.nsmallest(k, orfs, key=key)
+    return heapq.nlargest(k, orfs, key=key)
+
+@prof.timed('orf_top')
+def getFramesTopORFs(raw_dna, k, reading_frames=(1, 2, 3), want_shortest=False,
+                     backend='python') :
+    """ Returns a list with up to k 3-tuples (start index, length, reading
+    frame) for the k longest (or shortest if want_shortest = True) ORFs of
+    raw_dna in reading_frames, best first.  ORFs of equal length are in
+    order of reading frame, then along their strand.  The ORFs are streamed
+    through a heap of k elements instead of being listed and sorted.
+
+    backend - 'python' (default) or 'numpy', see getFramesORFs
+    """
+    if backend != 'python' and not isChunked(raw_dna) :
+        return _getBackendModule(backend).getFramesTopORFs(\
+               raw_dna, k, reading_frames, want_shortest)
+    strands = getStrandCodes(raw_dna, reading_frames)
+    orfs = ((start, length, rframe) for rframe in reading_frames \
+            for start, length in iterOpenReadingFrames(strands, rframe))
+
+    return selectTopORFs(orfs, k, want_shortest)
+
+def getTopORFs(dna_dict, k, reading_frame=0, want_shortest=False,
+               backend='python', jobs=1) :
+    """ Returns a list with up to k 4-tuples, best first, for the k
+    longest (or shortest if want_shortest = True) ORFs over all sequences:
+    tuple[0] - length of the ORF
+    tuple[1] - index of its start codon (1-based)
+    tuple[2] - seq_id of the sequence where it was found
+    tuple[3] - its reading frame
+    ORFs of equal length are in record order, then in order of reading
+    frame and along their strand.  Memory is bounded by k ORFs per sequence in
+    flight (see getFramesTopORFs), not by the number of ORFs in the file.
+    Returns -1 if reading_frame is not valid.
+
+    dna_dict - see getShortLongestORFsInAll
+    reading_frame - 1, 2, 3, -1, -2, -3, 0 (default) for the forward
+                    reading frames or ALL_FRAMES for all six
+    backend - 'python' (default) or 'numpy', see getFramesORFs
+    jobs - number of worker processes (see dna_parallel.mapSeqs)
+    """
+    rframes = getReadingFrames(reading_frame)
+    if rframes is None : return -1
+    seqs_orfs = parallel.mapSeqs(getFramesTopORFs, dna_dict,
+                                 (k, rframes, want_shortest, backend), jobs)
+    orfs = ((length, start, seq_id, rframe) for seq_id, seq_orfs in seqs_orfs \
+            for start, length, rframe in seq_orfs)
+
+    return selectTopORFs(orfs, k, want_shortest, key=lambda orf : orf[0])
+
+def getLengthLongestORF(dna_dict, seq_id, reading_frame=1, backend='python') :
     """ Returns a 2-tuples:
     tuple[0] - length of the longest ORF in seq_id
     tuple[1] - reading for which the longeset ORF is computed
     
     dna_dict - keys = sequence ids, values = DNA sequence of A's, T's, G's
-               and C's which can be upper or lower case
+               and C's which can be upper or lower case.  Can also be an
+               iterable of records as yielded by read_fasta.iterFasta
+    reading_frame - 1, 2, 3, -1, -2, -3, 0 for the forward reading frames
+                    or ALL_FRAMES for all six
+    backend - 'python' (default) or 'numpy', see getFramesORFs
+    """
+    reading_frames = getReadingFrames(reading_frame)
+    if reading_frames is None :
+        print("getLengthLongestORF expecting reading_frame to be 1,2,3,-1,-2,\
+-3, 0 or {}.".format(ALL_FRAMES))
+        return (-1, reading_frame)
+    dna = read_fasta.getSeq(dna_dict, seq_id)
+    frames_orfs = getFramesORFs(dna, reading_frames, False, backend)
+
+    return getLengthLongestORFInFrames(frames_orfs, reading_frame)
+
+def getLengthLongestORFInFrames(frames_orfs, reading_frame=1) :
+    """ Returns the 2-tuple described in getLengthLongestORF from
+    frames_orfs, the ORF lists of the sequence as returned by getFramesORFs
+    for the frames meant by reading_frame (see getReadingFrames).
     """
-    dna = dna_dict[seq_id]
-    if reading_frame in (1, 2, 3) :
-        orfs = getOpenReadingFrames(dna, reading_frame)
-        if len(orfs) > 1 :
-            return (orfs[-1][0], reading_frame)
+    reading_frames = getReadingFrames(reading_frame)
+    if reading_frames is None :
+        print("getLengthLongestORF expecting reading_frame to be 1,2,3,-1,-2,\
+-3, 0 or {}.".format(ALL_FRAMES))
+        return (-1, reading_frame)
+    elif len(reading_frames) == 1 :
+        orfs = frames_orfs[reading_frame]
+        if orfs :
+            return (orfs[-1][1], reading_frame)
         else :
             return (0, reading_frame)
-    elif reading_frame == 0 :
+    else :
         lorf = -1  # Init length of longest ORF
-        for rf in (1, 2, 3) :
-            orfs = getOpenReadingFrames(dna, rf)
-            if orfs[-1][1] > lorf :
+        rframe = reading_frame   # Frame of the longest ORF
+        for rf in reading_frames :
+            orfs = frames_orfs[rf]
+            if orfs and orfs[-1][1] > lorf :  # Skip frames without ORFs
                 lorf = orfs[-1][1]
                 rframe = rf
-        return(lorf, rf)
-    else :
-        print("getLengthLongestORF expecting reading_frame to be 1,2,3, or 0.")
-        return (-1, reading_frame)
-    
+        return(lorf, rframe)
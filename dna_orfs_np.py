@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+import numpy as np
+import stage_profile as prof
+
+# NumPy backend for dna_orfs.  A sequence is encoded once into an array of
+# 2-bit base codes, every position gets a codon code, and the start and stop
+# codons of all three reading frames are found with vectorized comparisons.
+# ORFs are then paired with the following stop codon using searchsorted.
+# The reverse frames do the same on the reverse complement of the codes.
+
+# Base codes: A=0, C=1, G=2, T=3.  Anything else (N, ambiguity codes, ...)
+# is 4 and makes every codon that contains it invalid.
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _bases in enumerate(('Aa', 'Cc', 'Gg', 'Tt')) :
+    for _base in _bases :
+        BASE_CODES[ord(_base)] = _code
+
+INVALID_CODON = 255
+
+# Base code of the complement of each base code (see dna_kmers).
+COMPLEMENT_CODES = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+
+def _getCodonCode(codon) :
+    """ Returns the 6-bit code of the 3 character string codon. """
+    c0, c1, c2 = (int(BASE_CODES[ord(b)]) for b in codon)
+    return (c0 << 4) | (c1 << 2) | c2
+
+START_CODON_CODES = np.array([_getCodonCode('atg')], dtype=np.uint8)
+STOP_CODON_CODES = np.array([_getCodonCode(c) for c in ('tga', 'tag', 'taa')],
+                            dtype=np.uint8)
+
+def encodeDna(raw_dna) :
+    """ Returns a uint8 array with the base code of each character of
+    raw_dna, a string which can be upper or lower case, or a
+    packed_seqs.PackedSequence.
+    """
+    if hasattr(raw_dna, 'toCodes') :   # Already 2-bit codes (4 = not ACGT)
+        return np.frombuffer(raw_dna.toCodes(), dtype=np.uint8)
+    raw = np.frombuffer(raw_dna.encode('ascii', 'replace'), dtype=np.uint8)
+    return BASE_CODES[raw]
+
+def getCodonCodes(codes) :
+    """ Returns a uint8 array where element i is the codon code of the 3
+    bases starting at python index i of the encoded sequence codes, or
+    INVALID_CODON if any of those bases is not A, C, G or T.
+    """
+    if len(codes) < 3 : return np.zeros(0, dtype=np.uint8)
+    c0, c1, c2 = codes[:-2], codes[1:-1], codes[2:]
+    codons = (c0 << 4) | (c1 << 2) | c2
+    codons[(c0 | c1 | c2) > 3] = INVALID_CODON
+
+    return codons
+
+def reverseComplement(codes) :
+    """ Returns the base codes of the reverse complement of the sequence
+    whose base codes are codes (see encodeDna).
+    """
+    return COMPLEMENT_CODES[codes[::-1]]
+
+def getStartStopIndices(raw_dna) :
+    """ Returns a 2-tuple of sorted int arrays with the python indices of
+    all start codons and of all stop codons in raw_dna, in any frame.
+    """
+    return _getCodeStartStops(encodeDna(raw_dna))
+
+def _getCodeStartStops(codes) :
+    """ Same as getStartStopIndices for the encoded sequence codes. """
+    codons = getCodonCodes(codes)
+    starts = np.flatnonzero(np.isin(codons, START_CODON_CODES))
+    stops = np.flatnonzero(np.isin(codons, STOP_CODON_CODES))
+    if prof.ENABLED :
+        prof.addCount('orf_bases_scanned', len(codes))
+        prof.addCount('codons_tested', len(codons))
+
+    return (starts, stops)
+
+@prof.timed('orf_scan')
+def _getStrandsStartStops(raw_dna, reading_frames) :
+    """ Returns a 2-tuple where:
+    tuple[0] - length of raw_dna
+    tuple[1] - dictionary with the start and stop indices (see
+               getStartStopIndices) of the forward strand under key 1 and of
+               the reverse complement under key -1, each only if a frame in
+               reading_frames reads that strand
+    raw_dna is only encoded once.
+    """
+    codes = encodeDna(raw_dna)
+    strands = {}
+    if any(rframe > 0 for rframe in reading_frames) :
+        strands[1] = _getCodeStartStops(codes)
+    if any(rframe < 0 for rframe in reading_frames) :
+        strands[-1] = _getCodeStartStops(reverseComplement(codes))
+
+    return (len(codes), strands)
+
+def _pairFrameORFs(starts, stops, reading_frame, longest_only=False) :
+    """ Returns a 2-tuple (start indices, lengths) of int arrays for the
+    ORFs in reading_frame (1, 2 or 3) of one strand, in order of start
+    codon.  starts and stops are as returned by getStartStopIndices.
+    """
+    frame = reading_frame - 1
+    fstarts = starts[starts % 3 == frame]
+    fstops = stops[stops % 3 == frame]
+    # Index of the first stop codon after each start codon.
+    next_stop = np.searchsorted(fstops, fstarts)
+    has_stop = next_stop < len(fstops)
+    fstarts, next_stop = fstarts[has_stop], next_stop[has_stop]
+    if longest_only :
+        # Keep only the first start codon before each stop codon.
+        first = np.unique(next_stop, return_index=True)[1]
+        fstarts, next_stop = fstarts[first], next_stop[first]
+    if prof.ENABLED : prof.addCount('orfs_emitted', len(fstarts))
+
+    return (fstarts, fstops[next_stop] + 3 - fstarts)
+
+def _getFrameORFs(length, strands, reading_frame, longest_only=False) :
+    """ Returns a 2-tuple (start indices, lengths) of int arrays for the
+    ORFs in reading_frame, in order of start codon along its strand.  Start
+    indices are 1-based on the forward strand as in
+    dna_orfs.scanOpenReadingFrames.  length and strands are as returned by
+    _getStrandsStartStops.
+    """
+    starts, stops = strands[1 if reading_frame > 0 else -1]
+    fstarts, lengths = _pairFrameORFs(starts, stops, abs(reading_frame),
+                                      longest_only)
+    if reading_frame < 0 :
+        return (length - fstarts, lengths)
+    return (fstarts + 1, lengths)
+
+def getOpenReadingFrames(raw_dna, reading_frame=1, longest_only=False) :
+    """ Same as dna_orfs.getOpenReadingFrames. """
+    return getFramesORFs(raw_dna, (reading_frame, ), longest_only)\
+           [reading_frame]
+
+def getFramesORFs(raw_dna, reading_frames=(1, 2, 3), longest_only=False) :
+    """ Returns a dictionary where keys are the reading frames in
+    reading_frames and values are ORF lists as returned by
+    dna_orfs.getOpenReadingFrames.  raw_dna is only encoded once.
+    """
+    length, strands = _getStrandsStartStops(raw_dna, reading_frames)
+    frames_orfs = {}
+    for rframe in reading_frames :
+        fstarts, lengths = _getFrameORFs(length, strands, rframe, longest_only)
+        order = np.argsort(lengths, kind='stable')
+        frames_orfs[rframe] = list(zip(fstarts[order].tolist(),
+                                       lengths[order].tolist()))
+
+    return frames_orfs
+
+def getFramesTopORFs(raw_dna, k, reading_frames=(1, 2, 3), want_shortest=False) :
+    """ Same as dna_orfs.getFramesTopORFs. """
+    length, strands = _getStrandsStartStops(raw_dna, reading_frames)
+    frame_starts, frame_lengths, frames = [], [], []
+    for rframe in reading_frames :
+        fstarts, lengths = _getFrameORFs(length, strands, rframe)
+        frame_starts.append(fstarts)
+        frame_lengths.append(lengths)
+        frames.append(np.full(len(lengths), rframe))
+    if not frame_starts : return []
+    fstarts = np.concatenate(frame_starts)
+    lengths = np.concatenate(frame_lengths)
+    # A stable sort keeps ORFs of equal length in frame and strand order.
+    order = np.argsort(lengths if want_shortest else -lengths,
+                       kind='stable')[:k]
+    return list(zip(fstarts[order].tolist(), lengths[order].tolist(),
+                    np.concatenate(frames)[order].tolist()))
+
+def getFramesShortLongestORF(raw_dna, reading_frames=(1, 2, 3),
+                             want_shortest=True) :
+    """ Returns a dictionary where keys are the reading frames in
+    reading_frames and values are the 2-tuple (start index, length) of the
+    shortest (want_shortest = True) or longest ORF in that frame, or None if
+    the frame has no ORF.  The ORF picked is the one at index 0 (shortest)
+    or -1 (longest) of the sorted list from getOpenReadingFrames.
+    """
+    length, strands = _getStrandsStartStops(raw_dna, reading_frames)
+    frames_orf = {}
+    for rframe in reading_frames :
+        fstarts, lengths = _getFrameORFs(length, strands, rframe,
+                                         not want_shortest)
+        if len(lengths) == 0 :
+            frames_orf[rframe] = None
+            continue
+        if want_shortest :
+            i = int(np.argmin(lengths))   # first of the shortest
+        else :
+            i = int(np.flatnonzero(lengths == lengths.max())[-1])
+        frames_orf[rframe] = (int(fstarts[i]), int(lengths[i]))
+
+    return frames_orf
+
+def getFramesShortAndLongestORF(raw_dna, reading_frames=(1, 2, 3)) :
+    """ Returns a dictionary where keys are the reading frames in
+    reading_frames and values are 2-tuples (shortest ORF, longest ORF) as
+    picked by getFramesShortLongestORF, each None if the frame has no ORF.
+    The ORFs of each frame are found once for both.
+    """
+    length, strands = _getStrandsStartStops(raw_dna, reading_frames)
+    frames_orfs = {}
+    for rframe in reading_frames :
+        fstarts, lengths = _getFrameORFs(length, strands, rframe, False)
+        if len(lengths) == 0 :
+            frames_orfs[rframe] = (None, None)
+            continue
+        s = int(np.argmin(lengths))   # first of the shortest
+        l = int(np.flatnonzero(lengths == lengths.max())[-1])
+        frames_orfs[rframe] = ((int(fstarts[s]), int(lengths[s])),
+                               (int(fstarts[l]), int(lengths[l])))
+
+    return frames_orfs
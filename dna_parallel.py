@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import read_fasta, stage_profile as prof
+
+# Runs a per-sequence analysis over the records of a FASTA file on a pool of
+# worker processes.  Records are sent to the workers in chunks and results
+# come back in the same order as the records, so callers can merge them
+# exactly as they would in a serial loop.  A record too long to send whole
+# (a dna_chunks.ChunkedSeq) is analyzed in this process instead, where it
+# spreads its own windows over a pool of workers.
+
+def getJobCount(jobs) :
+    """ Returns the number of worker processes to use for jobs: jobs itself
+    if it is positive, otherwise the number of CPUs.
+    """
+    if jobs is None or jobs < 1 :
+        return os.cpu_count() or 1
+    return jobs
+
+def _runChunk(func, args, chunk, profile=False) :
+    """ Returns a list of (seq_id, func(dna, *args)) for each (seq_id, dna)
+    in chunk.  Runs in a worker process.  If profile is True, returns a
+    2-tuple (that list, stage_profile.getSnapshot() of the chunk) instead.
+    """
+    if not profile :
+        return [(seq_id, func(dna, *args)) for seq_id, dna in chunk]
+    prof.enable()
+    results = [_runTimed(func, seq_id, dna, args) for seq_id, dna in chunk]
+    return (results, prof.getSnapshot())
+
+def _runTimed(func, seq_id, dna, args) :
+    """ Returns (seq_id, func(dna, *args)) and records the time it took
+    (see stage_profile.addRecordTime).
+    """
+    start = prof.now()
+    result = func(dna, *args)
+    prof.addRecordTime(func.__name__, seq_id, len(dna), prof.now() - start)
+    return (seq_id, result)
+
+def _getChunkResults(future, profile) :
+    """ Returns the results of a chunk sent to a worker, merging its
+    profile into this process's one if profile is True.
+    """
+    if not profile : return future.result()
+    results, snapshot = future.result()
+    prof.merge(snapshot)
+    return results
+
+def _iterChunks(items, chunk_size) :
+    """ Generator that yields lists of up to chunk_size elements of items.
+    A (seq_id, dna) item whose dna is chunked (see top of this module) is
+    yielded alone, as the tuple itself.
+    """
+    chunk = []
+    for item in items :
+        if getattr(item[1], 'chunked', False) :
+            if chunk : yield chunk
+            chunk = []
+            yield item
+            continue
+        chunk.append(item)
+        if len(chunk) == chunk_size :
+            yield chunk
+            chunk = []
+    if chunk : yield chunk
+
+def mapSeqs(func, dna_seqs, args=(), jobs=1, chunk_size=4) :
+    """ Generator that yields a 2-tuple (seq_id, func(dna, *args)) for each
+    record of dna_seqs, in the same order as the records.
+
+    func - function that takes a DNA sequence string as its first argument.
+           It must be defined at module level so it can be sent to workers.
+    dna_seqs - Dictionary where keys = sequence identifiers and values =
+    DNA seqeunce for that record, or an iterable of records as yielded by
+    read_fasta.iterFasta.
+    args - tuple of extra arguments passed to func after the sequence
+    jobs - number of worker processes. 1 (default) runs func in this
+           process, 0 or None uses one worker per CPU.
+    chunk_size - number of records sent to a worker at a time
+    """
+    items = read_fasta.getSeqItems(dna_seqs)
+    jobs = getJobCount(jobs)
+    profile = prof.ENABLED
+    if jobs == 1 :
+        for seq_id, dna in items :
+            if profile :
+                yield _runTimed(func, seq_id, dna, args)
+            else :
+                yield (seq_id, func(dna, *args))
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool :
+        # Only a few chunks per worker are in flight so that a streamed
+        # file is never read much ahead of the results.
+        pending = deque()
+        for chunk in _iterChunks(items, chunk_size) :
+            if isinstance(chunk, tuple) :
+                # Results of the records before it come first.
+                while pending :
+                    for result in _getChunkResults(pending.popleft(),
+                                                   profile) :
+                        yield result
+                seq_id, dna = chunk
+                if profile :
+                    yield _runTimed(func, seq_id, dna, args)
+                else :
+                    yield (seq_id, func(dna, *args))
+                continue
+            pending.append(pool.submit(_runChunk, func, args, chunk, profile))
+            if len(pending) >= 2 * jobs :
+                for result in _getChunkResults(pending.popleft(), profile) :
+                    yield result
+        while pending :
+            for result in _getChunkResults(pending.popleft(), profile) :
+                yield result
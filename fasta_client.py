@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+import sys, os, json, socket, http.client
+
+# Thin client of fasta_server.py.  It only sends the FASTA file name and the
+# command line options to the server and prints the JSON results, so a
+# query costs a connection instead of reading and analyzing the file.
+# Nothing here imports the analysis modules, to keep start up short.
+#
+# The server address is either host:port (HTTP over TCP) or the path of a
+# Unix socket.
+
+DEFAULT_ADDRESS = "127.0.0.1:8765"
+
+class UnixHTTPConnection(http.client.HTTPConnection) :
+    """ HTTPConnection over the Unix socket socketPath. """
+    def __init__(self, socketPath, timeout=None) :
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socketPath
+
+    def connect(self) :
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None : self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+def isUnixAddress(address) :
+    """ Returns True if address is the path of a Unix socket rather than
+    host:port.
+    """
+    return os.sep in address or ':' not in address
+
+def getConnection(address, timeout=None) :
+    """ Returns an http.client.HTTPConnection to the server at address. """
+    if isUnixAddress(address) :
+        return UnixHTTPConnection(address, timeout)
+    host, port = address.rsplit(':', 1)
+    return http.client.HTTPConnection(host, int(port), timeout=timeout)
+
+def sendRequest(address, method, path, body=None, timeout=None) :
+    """ Sends an HTTP request to the server at address and returns a 2-tuple
+    (HTTP status, decoded JSON reply).  body, if given, is sent as JSON.
+    """
+    conn = getConnection(address, timeout)
+    try :
+        data = json.dumps(body).encode() if body is not None else None
+        conn.request(method, path, data,
+                     {'Content-Type' : 'application/json'})
+        response = conn.getresponse()
+        return (response.status, json.loads(response.read().decode()))
+    finally :
+        conn.close()
+
+def queryServer(address, file_fasta, options, timeout=None) :
+    """ Returns the reply of the server at address to the command line
+    options (a list of strings, as given to analyze_fasta.py after the file
+    name) for the FASTA file file_fasta: a dictionary with 'results', the
+    list of analyze_fasta.runQueries, or 'error'.
+    """
+    status, reply = sendRequest(address, 'POST', '/query',
+                                {'file' : os.path.abspath(file_fasta),
+                                 'options' : list(options)}, timeout)
+    if status != 200 and 'error' not in reply :
+        reply['error'] = "Server replied with HTTP status {}".format(status)
+
+    return reply
+
+def printReply(reply) :
+    """ Prints the results of reply (see queryServer) as JSON, like
+    analyze_fasta.py --batch, or the error to stderr.  Returns the exit
+    status: 0 if there are results, 1 otherwise.
+    """
+    if 'error' in reply :
+        print(reply['error'], file=sys.stderr)
+        return 1
+    print(json.dumps(reply['results'], indent=2))
+    return 0
+
+def main() :
+    if len(sys.argv) < 3 :
+        print("usage: fasta_client.py ADDRESS FASTAFILE [options]\n  ADDRESS "
+              "is host:port or the path of a Unix socket, options are those "
+              "of analyze_fasta.py", file=sys.stderr)
+        return 2
+    try :
+        reply = queryServer(sys.argv[1], sys.argv[2], sys.argv[3:])
+    except (OSError, http.client.HTTPException) as e :
+        print("Can't reach the server at {}: {}".format(sys.argv[1], e),
+              file=sys.stderr)
+        return 1
+    return printReply(reply)
+
+if __name__ == "__main__" :
+    sys.exit(main())
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+import sys, argparse, random, math
+
+# Seeded generator of synthetic FASTA files for benchmarks.  Record count,
+# length distribution, line width, GC content and the density of long open
+# reading frames are all controlled, and the same parameters and seed always
+# produce the same file, from a few KB up to GB scale.
+
+STOP_CODONS = ('TAA', 'TAG', 'TGA')
+SENSE_CODONS = tuple(a + b + c for a in 'ACGT' for b in 'ACGT' for c in 'ACGT'
+                     if a + b + c not in STOP_CODONS)
+
+def getBaseWeights(gc_content=0.5) :
+    """ Returns the weights of A, C, G and T for a sequence whose fraction
+    of G's and C's is gc_content.
+    """
+    return ((1 - gc_content) / 2, gc_content / 2, gc_content / 2,
+            (1 - gc_content) / 2)
+
+def getRecordLength(rng, min_length, max_length, length_dist='uniform') :
+    """ Returns a random record length in [min_length, max_length].
+
+    rng - random.Random used to draw the length
+    length_dist - 'uniform', 'lognormal' (many short records and a few long
+                  ones) or 'fixed' (always max_length)
+    """
+    if length_dist == 'fixed' or min_length >= max_length :
+        return max_length
+    if length_dist == 'lognormal' :
+        # Median at the geometric mean of the bounds, ~95% inside them.
+        lo, hi = math.log(max(min_length, 1)), math.log(max(max_length, 1))
+        mu, sigma = (lo + hi) / 2, (hi - lo) / 4
+        length = int(rng.lognormvariate(mu, sigma))
+        return min(max(length, min_length), max_length)
+    return rng.randint(min_length, max_length)
+
+def generateSeq(rng, length, gc_content=0.5, orf_density=0.0,
+                orf_codons=(50, 500)) :
+    """ Returns a random DNA string of the given length.
+
+    rng - random.Random used to draw the bases
+    gc_content - fraction of G's and C's in the background sequence
+    orf_density - mean number of long ORFs planted per 1000 bases.  Each is
+                  an ATG, a random number of sense codons in the range
+                  orf_codons and a stop codon, placed at a random offset.
+    """
+    seq = rng.choices('ACGT', getBaseWeights(gc_content), k=length)
+    orf_count = int(orf_density * length / 1000)
+    if rng.random() < orf_density * length / 1000 - orf_count :
+        orf_count += 1
+    for i in range(orf_count) :
+        ncodons = rng.randint(orf_codons[0], orf_codons[1])
+        orf = 'ATG' + ''.join(rng.choices(SENSE_CODONS, k=ncodons)) + \
+              rng.choice(STOP_CODONS)
+        if len(orf) > length : continue
+        start = rng.randint(0, length - len(orf))
+        seq[start:start + len(orf)] = orf
+
+    return ''.join(seq)
+
+def generateRecords(seed=0, record_count=100, min_length=500,
+                    max_length=5000, length_dist='uniform', gc_content=0.5,
+                    orf_density=0.0) :
+    """ Generator that yields a 2-tuple (sequence identifier, DNA sequence)
+    for each of record_count random records.  See getRecordLength and
+    generateSeq for the other parameters.
+    """
+    rng = random.Random(seed)
+    for i in range(record_count) :
+        length = getRecordLength(rng, min_length, max_length, length_dist)
+        yield ('synthetic|{}|{}'.format(seed, i + 1),
+               generateSeq(rng, length, gc_content, orf_density))
+
+def writeFasta(outFilePath, records, line_width=60) :
+    """ Writes the (sequence identifier, DNA sequence) records to the FASTA
+    file outFilePath with line_width bases per line (0 = one line per
+    sequence) and returns a 2-tuple (number of records, number of bases).
+    """
+    record_count = base_count = 0
+    with open(outFilePath, 'w') as f :
+        for seq_id, dna in records :
+            f.write('>{} synthetic record\n'.format(seq_id))
+            step = line_width if line_width > 0 else max(len(dna), 1)
+            f.write('\n'.join(dna[i:i + step] \
+                              for i in range(0, len(dna), step)))
+            f.write('\n')
+            record_count += 1
+            base_count += len(dna)
+
+    return (record_count, base_count)
+
+def generateFasta(outFilePath, seed=0, record_count=100, min_length=500,
+                  max_length=5000, length_dist='uniform', gc_content=0.5,
+                  orf_density=0.0, line_width=60) :
+    """ Writes a synthetic FASTA file (see generateRecords and writeFasta)
+    and returns a 2-tuple (number of records, number of bases).
+    """
+    records = generateRecords(seed, record_count, min_length, max_length,
+                              length_dist, gc_content, orf_density)
+    return writeFasta(outFilePath, records, line_width)
+
+def parseSize(size) :
+    """ Returns the integer number of bases in size, a string such as 5000,
+    20K, 50M or 1G.
+    """
+    size = size.strip().upper()
+    scale = {'K' : 10 ** 3, 'M' : 10 ** 6, 'G' : 10 ** 9}.get(size[-1:], 1)
+    if scale > 1 : size = size[:-1]
+    return int(float(size) * scale)
+
+def main() :
+    parser = argparse.ArgumentParser(description="Write a synthetic FASTA \
+    file.  The same parameters and seed always give the same file.")
+    parser.add_argument("filename", help="path of the FASTA file to write")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--records", type=int, default=100,
+    help="number of records, ignored if --total_bases is given")
+    parser.add_argument("--total_bases",
+    help="approximate size of the file in bases, e.g. 500K, 20M or 1G")
+    parser.add_argument("--min_length", default='500',
+    help="shortest record, e.g. 500 or 2K")
+    parser.add_argument("--max_length", default='5000',
+    help="longest record, e.g. 5000 or 1M")
+    parser.add_argument("--length_dist", default='uniform',
+                        choices=('uniform', 'lognormal', 'fixed'))
+    parser.add_argument("--gc", type=float, default=0.5,
+    help="fraction of G's and C's (default 0.5)")
+    parser.add_argument("--orf_density", type=float, default=0.0,
+    help="mean number of long ORFs planted per 1000 bases")
+    parser.add_argument("--line_width", type=int, default=60,
+    help="bases per line, 0 for one line per sequence")
+    args = parser.parse_args()
+
+    min_length = parseSize(args.min_length)
+    max_length = parseSize(args.max_length)
+    record_count = args.records
+    if args.total_bases :
+        mean_length = {'uniform' : (min_length + max_length) / 2,
+                       'lognormal' : (min_length * max_length) ** 0.5,
+                       'fixed' : max_length}[args.length_dist]
+        record_count = max(int(parseSize(args.total_bases) / mean_length), 1)
+    records, bases = generateFasta(args.filename, args.seed, record_count,
+                                   min_length, max_length, args.length_dist,
+                                   args.gc, args.orf_density, args.line_width)
+    print("Wrote {} records, {} bases to {}".format(records, bases,
+                                                    args.filename))
+
+if __name__ == "__main__" :
+    sys.exit(main())
@@ -0,0 +1,202 @@
+#!/usr/bin/python3
+import os, mmap
+import compressed_io as cio, read_fasta as rf
+
+# Each record in a FASTA index is described by a 4-tuple:
+# tuple[0] - length of the sequence (number of bases)
+# tuple[1] - byte offset of the first base of the sequence in the file
+# tuple[2] - number of bases on each sequence line (0 if line lengths vary)
+# tuple[3] - number of bytes on each sequence line including the newline
+#            (0 if line lengths vary)
+# The layout follows the samtools .fai format.  The first line of the index
+# file records the size and modification time of the FASTA file it was built
+# from so that a stale index can be detected and rebuilt, followed by
+# INDEX_VERSION so that an index written by an older indexer is rebuilt too.
+# For a gzip or BGZF compressed file the offsets are in the uncompressed data.
+
+INDEX_VERSION = 2   # 2: blank lines before the first sequence line skipped
+
+def getIndexPath(inFilePath) :
+    """ Returns the path of the index file kept next to inFilePath. """
+    return inFilePath + ".fxi"
+
+def _getFileStamp(inFilePath) :
+    """ Returns a 2-tuple (size in bytes, mtime in ns) for inFilePath. """
+    st = os.stat(inFilePath)
+    return (st.st_size, st.st_mtime_ns)
+
+def buildFastaIndex(inFilePath) :
+    """ Scans inFilePath once and returns a dictionary where keys are the
+    sequence identifiers and values are 4-tuples describing where the
+    sequence of each record is in the file (see top of this module).
+
+    inFilePath - path to the FASTA file to be indexed
+    Raises read_fasta.DuplicateSeqIdError if two records have the same
+    sequence identifier.
+    """
+    index = {}
+    name = None
+    offset = 0     # Byte offset of the current line in the file
+
+    def _addRecord() :
+        if irregular :
+            index[name] = (length, seq_offset, 0, 0)
+        else :
+            index[name] = (length, seq_offset, line_bases, line_width)
+
+    with cio.openFasta(inFilePath, binary=True) as f :
+        for line in f :
+            if line.startswith(b'>') :
+                if name is not None : _addRecord()
+                name = line.split()[0][1:].decode()
+                if name in index : raise rf.DuplicateSeqIdError(name)
+                seq_offset = offset + len(line)
+                length = line_bases = line_width = 0
+                irregular = False
+                last_short = False   # Only the last line may be short
+            elif name is not None :
+                bases = len(line.rstrip())
+                if bases == 0 and length == 0 :
+                    seq_offset += len(line)   # Blank line before the bases
+                elif bases > 0 :
+                    if line_bases == 0 :
+                        line_bases, line_width = bases, len(line)
+                    elif last_short or bases > line_bases or \
+                         len(line) - bases != line_width - line_bases :
+                        irregular = True
+                    length += bases
+                if bases < line_bases :
+                    last_short = True
+            offset += len(line)
+        if name is not None : _addRecord()
+
+    return index
+
+def writeFastaIndex(index, indexPath, stamp) :
+    """ Writes index (see buildFastaIndex) to indexPath.  stamp is the
+    (size, mtime) 2-tuple of the FASTA file the index was built from.
+    """
+    with open(indexPath, 'w') as f :
+        f.write("#{}\t{}\t{}\n".format(stamp[0], stamp[1], INDEX_VERSION))
+        for seq_id, entry in index.items() :
+            f.write("{}\t{}\t{}\t{}\t{}\n".format(seq_id, *entry))
+
+def readFastaIndex(indexPath) :
+    """ Returns a 2-tuple where:
+    tuple[0] - (size, mtime) stamp of the FASTA file the index was built from
+    tuple[1] - index dictionary (see buildFastaIndex)
+    Raises ValueError if the index file was written by another version.
+    """
+    index = {}
+    with open(indexPath) as f :
+        size, mtime, version = f.readline()[1:].split()
+        if int(version) != INDEX_VERSION :
+            raise ValueError("FASTA index version {}".format(version))
+        for line in f :
+            fields = line.rstrip('\n').split('\t')
+            index[fields[0]] = tuple(int(x) for x in fields[1:5])
+
+    return ((int(size), int(mtime)), index)
+
+def loadFastaIndex(inFilePath) :
+    """ Returns the index dictionary for inFilePath (see buildFastaIndex).
+    The index file next to inFilePath is used if it is up to date,
+    otherwise the index is rebuilt and saved.  If the index file can't be
+    written the index is still returned.
+    """
+    stamp = _getFileStamp(inFilePath)
+    indexPath = getIndexPath(inFilePath)
+    try :
+        index_stamp, index = readFastaIndex(indexPath)
+        if index_stamp == stamp :
+            return index
+    except (IOError, ValueError) :
+        pass   # Missing or unreadable index: rebuild it
+    index = buildFastaIndex(inFilePath)
+    try :
+        writeFastaIndex(index, indexPath, stamp)
+    except IOError :
+        pass
+
+    return index
+
+class IndexedFasta(object) :
+    """ Read-only, dictionary-like access to the records of a FASTA file.
+    The file is memory mapped and only the bytes of a requested sequence are
+    read.  A BGZF compressed file is read through its .gzi block index (see
+    compressed_io.BgzfFile) so only the blocks holding a requested sequence
+    are inflated.  A gzip file has no random access and is inflated into
+    memory when opened.  Keys are sequence identifiers and values are DNA
+    sequences, so an IndexedFasta can be passed where a dictionary from
+    read_fasta.readFasta is expected.
+    """
+    def __init__(self, inFilePath) :
+        self.path = inFilePath
+        self.index = loadFastaIndex(inFilePath)
+        self._file = open(inFilePath, 'rb')
+        compression = cio.getCompression(inFilePath)
+        if compression == 'bgzf' :
+            self._map = cio.BgzfFile(inFilePath)
+        elif compression == 'gzip' :
+            with cio.openFasta(inFilePath, binary=True) as f :
+                self._map = f.read()
+        elif os.fstat(self._file.fileno()).st_size > 0 :
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        else :
+            self._map = b''   # Can't mmap an empty file
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.close()
+
+    def close(self) :
+        if not isinstance(self._map, bytes) : self._map.close()
+        self._file.close()
+
+    def __len__(self) :
+        return len(self.index)
+
+    def __contains__(self, seq_id) :
+        return seq_id in self.index
+
+    def __iter__(self) :
+        return iter(self.index)
+
+    def keys(self) :
+        return self.index.keys()
+
+    def items(self) :
+        for seq_id in self.index :
+            yield (seq_id, self.getSeq(seq_id))
+
+    def __getitem__(self, seq_id) :
+        return self.getSeq(seq_id)
+
+    def getSeqLength(self, seq_id) :
+        """ Returns the number of bases in sequence seq_id. """
+        return self.index[seq_id][0]
+
+    def getSeq(self, seq_id, start=0, end=None) :
+        """ Returns the string dna[start:end] where dna is the sequence of
+        record seq_id.  start and end are 0-based python indices which can
+        be negative.  Raises KeyError if seq_id is not in the file.
+        """
+        length, offset, line_bases, line_width = self.index[seq_id]
+        start, end, step = slice(start, end).indices(length)
+        if end <= start : return ''
+        if line_bases == 0 :
+            # Line lengths vary: read the whole record and slice it.
+            rec_end = self._map.find(b'\n>', offset)
+            rec_end = len(self._map) if rec_end < 0 else rec_end
+            seq = self._map[offset:rec_end].translate(None, b' \t\r\n')
+            return seq[start:end].decode()
+        # Convert base positions to byte positions using the line layout.
+        first = offset + (start // line_bases) * line_width + \
+                start % line_bases
+        last = offset + ((end - 1) // line_bases) * line_width + \
+               (end - 1) % line_bases
+
+        return self._map[first:last + 1].translate(None, b' \t\r\n').decode()
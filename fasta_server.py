@@ -0,0 +1,237 @@
+#!/usr/bin/python3
+import sys, os, io, json, argparse, contextlib, signal, socketserver
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import analyze_fasta as af, fasta_client as client
+
+# Long running analysis server.  FASTA files are read once into memory by
+# each worker process and kept there (see FastaAnalysis preload) with every
+# intermediate product computed so far (sequence lengths, longest ORFs, most
+# frequent repeats, repeat counts), so a query only pays for what was never
+# asked before.  Each worker keeps at most max_files files: the least
+# recently queried one is dropped, with its products, to load another.  A
+# file that changes on disk is read again on its next query.  Repeats are
+# looked up in the suffix index of a file (see suffix_index) if it's up to
+# date.
+#
+# Requests are HTTP, over TCP or a Unix socket where the platform has them:
+# POST /query  {"file" : path, "options" : [analyze_fasta.py options]}
+#              replies {"results" : [...]} as analyze_fasta.py --batch, or
+#              {"error" : message}
+# GET /status  replies the files loaded in the server and its worker count
+# Each connection gets a thread which hands the query to a pool of worker
+# processes, so concurrent queries run in parallel.  Options that only make
+# sense for a one-shot run (--jobs, --chunk_size, the cache, --summary_db,
+# --suffix_index, --profile, --server) are ignored: the workers are the
+# parallelism and the products in memory are the cache.
+
+DEFAULT_MAX_FILES = 4
+
+# (path, orf_backend) -> ((size, mtime), FastaAnalysis), least recently
+# queried first
+_datasets = collections.OrderedDict()
+_max_datasets = DEFAULT_MAX_FILES
+
+def getDataset(file_fasta, orf_backend='python') :
+    """ Returns the FastaAnalysis of file_fasta kept by this process,
+    reading the file into memory if it isn't loaded yet or changed since.
+    The least recently queried files are dropped so that at most
+    _max_datasets are kept.  Raises IOError if the file can't be read.
+    """
+    if not os.path.isfile(file_fasta) :
+        raise IOError("Not a file: {}".format(file_fasta))
+    st = os.stat(file_fasta)
+    stamp = (st.st_size, st.st_mtime_ns)
+    key = (file_fasta, orf_backend)
+    if key not in _datasets or _datasets[key][0] != stamp :
+        _datasets.pop(key, None)   # Free the stale one first
+        while len(_datasets) >= _max_datasets :
+            _datasets.popitem(last=False)
+        _datasets[key] = (stamp, af.FastaAnalysis(file_fasta,
+                          orf_backend=orf_backend, keep_products=True,
+                          verbose=False, preload=True,
+                          suffix_index=af.openSuffixIndex(file_fasta)))
+    _datasets.move_to_end(key)
+    return _datasets[key][1]
+
+def _loadDatasets(files, max_files) :
+    """ Initializer of the worker processes: keeps at most max_files files
+    and loads files.
+    """
+    global _max_datasets
+    _max_datasets = max_files
+    for file_fasta in files :
+        getDataset(file_fasta)
+
+def parseOptions(file_fasta, options) :
+    """ Returns the list of queries (see analyze_fasta.getQueries) and the
+    ORF backend given by options, the command line options of
+    analyze_fasta.py for file_fasta.  Raises ValueError with the message of
+    the parser if options aren't valid.
+    """
+    # --help (or an abbreviation of it) would print to the server's stdout.
+    if any(option == '-h' or len(option) > 2 and '--help'.startswith(option) \
+           for option in options) :
+        raise ValueError("--help isn't a query, see analyze_fasta.py --help")
+    parser = af.getArgParser()
+    parser.prog = 'analyze_fasta.py'
+    errors = io.StringIO()
+    try :
+        with contextlib.redirect_stderr(errors) :
+            args = parser.parse_args([file_fasta, ] + list(options))
+            queries = af.getQueries(args)
+            if args.query_file :
+                queries += af.readQueryFile(args.query_file[0], parser,
+                                            file_fasta)
+    except SystemExit :
+        raise ValueError(errors.getvalue().strip().split('\n')[-1])
+
+    return (queries, args.orf_backend)
+
+def answerRequest(file_fasta, options) :
+    """ Returns the reply to a query (see top of this module): a dictionary
+    with 'results' or 'error'.  Runs in a worker process.
+    """
+    try :
+        queries, orf_backend = parseOptions(file_fasta, options)
+        if not queries : return {'error' : "No option to answer was given"}
+        data_fasta = getDataset(file_fasta, orf_backend)
+    except ValueError as e :
+        return {'error' : str(e)}
+    except IOError as e :
+        # The FASTA file, or a motif or query file named in the options.
+        return {'error' : "File doesn't exist: {}".format(e.filename or \
+                                                           file_fasta)}
+
+    return {'results' : af.runQueries(data_fasta, queries)}
+
+class QueryHandler(BaseHTTPRequestHandler) :
+    """ Handles the requests of one connection (see top of this module). """
+    def _reply(self, status, reply) :
+        data = json.dumps(reply).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) :
+        if self.path != '/status' :
+            return self._reply(404, {'error' : "Unknown path " + self.path})
+        self._reply(200, {'files' : self.server.files,
+                          'workers' : self.server.workers})
+
+    def do_POST(self) :
+        if self.path != '/query' :
+            return self._reply(404, {'error' : "Unknown path " + self.path})
+        try :
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode())
+            file_fasta, options = request['file'], request.get('options', [])
+            if not isinstance(file_fasta, str) or \
+               not all(isinstance(option, str) for option in options) :
+                raise TypeError
+        except (ValueError, KeyError, TypeError) :
+            return self._reply(400, {'error' : "Request must be JSON with \
+'file' and a list of 'options'"})
+        try :
+            reply = self.server.pool.submit(answerRequest,
+                        os.path.abspath(file_fasta), options).result()
+        except (Exception, SystemExit) as e :
+            return self._reply(500, {'error' : "{}: {}".format(\
+                                     type(e).__name__, e)})
+        self._reply(400 if 'error' in reply else 200, reply)
+
+    def log_message(self, format, *args) :
+        if self.server.verbose :
+            sys.stderr.write("{}\n".format(format % args))
+
+class _ServerMixIn(object) :
+    """ State shared by the TCP and Unix socket servers. """
+    daemon_threads = True
+
+    def setState(self, pool, files, workers, verbose) :
+        self.pool = pool
+        self.files = files
+        self.workers = workers
+        self.verbose = verbose
+
+class FastaHTTPServer(_ServerMixIn, ThreadingHTTPServer) :
+    pass
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer') :
+    class FastaUnixServer(_ServerMixIn,
+                          socketserver.ThreadingUnixStreamServer) :
+        pass
+
+def serve(files, address=client.DEFAULT_ADDRESS, workers=1, verbose=False,
+          max_files=DEFAULT_MAX_FILES) :
+    """ Loads the FASTA files in files into workers worker processes and
+    answers queries at address (host:port or the path of a Unix socket,
+    see fasta_client) until interrupted.  Each worker keeps at most
+    max_files files in memory, but never fewer than those in files.
+    """
+    files = [os.path.abspath(file_fasta) for file_fasta in files]
+    if client.isUnixAddress(address) and \
+       not hasattr(socketserver, 'ThreadingUnixStreamServer') :
+        raise ValueError("Unix sockets aren't supported on this platform")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_loadDatasets,
+         initargs=(files, max(max_files, len(files), 1))) as pool :
+        # Load the files now rather than on the first query.
+        for future in [pool.submit(len, ()) for i in range(workers)] :
+            future.result()
+        if client.isUnixAddress(address) :
+            if os.path.exists(address) : os.unlink(address)
+            server = FastaUnixServer(address, QueryHandler)
+        else :
+            host, port = address.rsplit(':', 1)
+            server = FastaHTTPServer((host, int(port)), QueryHandler)
+        server.setState(pool, files, workers, verbose)
+        print("Serving {} file(s) with {} worker(s) at {}".format(len(files),
+              workers, address), flush=True)
+        try :
+            server.serve_forever()
+        except KeyboardInterrupt :
+            pass
+        finally :
+            server.server_close()
+            if client.isUnixAddress(address) and os.path.exists(address) :
+                os.unlink(address)
+
+def main() :
+    parser = argparse.ArgumentParser(description="Answer analyze_fasta.py \
+    queries from FASTA files kept in memory.  Query it with fasta_client.py \
+    or analyze_fasta.py --server.")
+    parser.add_argument("files", nargs='*',
+    help="FASTA files to load at start up.  Other files are loaded on their \
+    first query")
+    parser.add_argument("--address", default=client.DEFAULT_ADDRESS,
+    help="host:port to listen on, or the path of a Unix socket (default \
+    {})".format(client.DEFAULT_ADDRESS))
+    parser.add_argument("--workers", type=int, default=1,
+    help="Number of worker processes answering queries (default 1).  Each \
+    one keeps its own copy of the files in memory")
+    parser.add_argument("--max_files", type=int, default=DEFAULT_MAX_FILES,
+    help="Number of files each worker keeps in memory (default {}).  The \
+    least recently queried one is dropped to load another".format(\
+    DEFAULT_MAX_FILES))
+    parser.add_argument("--verbose", action='store_true',
+    help="Log every request to stderr")
+    args = parser.parse_args()
+
+    for file_fasta in args.files :
+        if not os.path.isfile(file_fasta) :
+            print("File doesn't exist: {}".format(file_fasta))
+            return 1
+    # Stop on SIGTERM as on Ctrl-C, removing the Unix socket.
+    signal.signal(signal.SIGTERM, lambda signum, frame : sys.exit(0))
+    try :
+        serve(args.files, args.address, max(args.workers, 1), args.verbose,
+              args.max_files)
+    except ValueError as e :
+        print(e)
+        return 1
+
+if __name__ == "__main__" :
+    sys.exit(main())
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+import re
+from bisect import bisect_left, bisect_right
+import read_fasta, dna_kmers as kmers
+
+# Compact in-memory sequence store.  A, C, G and T are packed 4 bases per
+# byte (2 bits each, using the base codes of dna_kmers).  Anything else (N,
+# ambiguity codes, ...) is kept in a side list of runs and lower case
+# (soft-masked) stretches in a list of intervals, so the original string can
+# be rebuilt exactly.  The ORF and k-mer engines read the base codes
+# directly through toCodes(), without rebuilding or case folding a string.
+
+_AMBIGUOUS_RUN = re.compile('[^ACGTacgt]+')
+_LOWER_RUN = re.compile('[a-z]+')
+_UPPER_BASES = b'ACGT'
+_CODES_TO_UPPER = bytes.maketrans(b'\x00\x01\x02\x03', _UPPER_BASES)
+
+def _getByteMask(nbytes, value) :
+    """ Returns an int whose nbytes bytes all equal value. """
+    return int.from_bytes(bytes([value]) * nbytes, 'big')
+
+def packCodes(codes) :
+    """ Returns a bytearray with the base codes 0-3 in codes packed 4 per
+    byte, first base in the 2 high bits.  Codes above 3 must be replaced
+    before packing.
+    """
+    nbytes = (len(codes) + 3) // 4
+    codes = bytes(codes) + bytes(4 * nbytes - len(codes))  # Pad with A's
+    # Each base of a group of 4 goes to its own 2 bits of the packed byte.
+    # Big ints let the shifts and ors run over the whole sequence at once;
+    # every byte stays below 256 so nothing carries into the next byte.
+    packed = 0
+    for i, shift in enumerate((6, 4, 2, 0)) :
+        packed |= int.from_bytes(codes[i::4], 'big') << shift
+
+    return bytearray(packed.to_bytes(nbytes, 'big'))
+
+def unpackCodes(packed, length) :
+    """ Returns a bytearray with the first length base codes in packed (see
+    packCodes).
+    """
+    nbytes = len(packed)
+    value = int.from_bytes(packed, 'big')
+    mask = _getByteMask(nbytes, 3)
+    codes = bytearray(4 * nbytes)
+    for i, shift in enumerate((6, 4, 2, 0)) :
+        codes[i::4] = ((value >> shift) & mask).to_bytes(nbytes, 'big')
+    del codes[length:]
+
+    return codes
+
+class PackedSequence(object) :
+    """ A DNA sequence stored at 2 bits per base.  len(), str() and slicing
+    behave as for the string it was built from.
+    """
+    def __init__(self, dna) :
+        self._length = len(dna)
+        # Runs of anything other than ACGT: (start, end, original text).
+        self._ambiguous = [(m.start(), m.end(), m.group()) \
+                           for m in _AMBIGUOUS_RUN.finditer(dna)]
+        # Soft-masked (lower case) intervals: (start, end).
+        self._lower = [m.span() for m in _LOWER_RUN.finditer(dna)]
+        codes = bytearray(kmers.encodeDna(dna))
+        for start, end, text in self._ambiguous :
+            codes[start:end] = bytes(end - start)
+        self._packed = packCodes(codes)
+
+    def __len__(self) :
+        return self._length
+
+    def __str__(self) :
+        return self[:]
+
+    def __repr__(self) :
+        return "PackedSequence({!r})".format(str(self))
+
+    def __eq__(self, other) :
+        return str(self) == str(other)
+
+    def __hash__(self) :
+        return hash(str(self))
+
+    def __getitem__(self, key) :
+        if isinstance(key, int) :
+            i = key + self._length if key < 0 else key
+            if not 0 <= i < self._length :
+                raise IndexError("PackedSequence index out of range")
+            key = slice(i, i + 1)
+        start, end, step = key.indices(self._length)
+        if step != 1 : return str(self)[key]
+        if end <= start : return ''
+        chars = self._getCodes(start, end).translate(_CODES_TO_UPPER)
+        for lstart, lend in self._getRuns(self._lower, start, end) :
+            s, e = max(lstart, start) - start, min(lend, end) - start
+            chars[s:e] = chars[s:e].lower()
+        for astart, aend, text in self._getRuns(self._ambiguous, start, end) :
+            s, e = max(astart, start), min(aend, end)
+            chars[s - start:e - start] = text[s - astart:e - astart].encode()
+
+        return chars.decode()
+
+    def _getRuns(self, runs, start, end) :
+        """ Returns the elements of runs (sorted, non-overlapping, first two
+        elements start and end) that overlap [start, end).
+        """
+        first = max(bisect_right(runs, (start, )) - 1, 0)
+        last = bisect_left(runs, (end, ))
+        return [run for run in runs[first:last] if run[1] > start]
+
+    def _getCodes(self, start, end) :
+        """ Returns a bytearray with the base codes (0-3) of [start, end),
+        ambiguous bases not yet marked.
+        """
+        first_byte = start // 4
+        codes = unpackCodes(self._packed[first_byte:(end + 3) // 4],
+                            end - 4 * first_byte)
+        return codes[start - 4 * first_byte:]
+
+    def toCodes(self, start=0, end=None) :
+        """ Returns a bytes object with the base code of each base of
+        [start, end): A=0, C=1, G=2, T=3 in either case, anything else 4 (see
+        dna_kmers).  This is what dna_kmers.encodeDna returns for the
+        original string.
+        """
+        start, end, step = slice(start, end).indices(self._length)
+        if end <= start : return b''
+        codes = self._getCodes(start, end)
+        for astart, aend, text in self._getRuns(self._ambiguous, start, end) :
+            s, e = max(astart, start), min(aend, end)
+            codes[s - start:e - start] = bytes([kmers.AMBIGUOUS]) * (e - s)
+
+        return bytes(codes)
+
+    def getPackedSize(self) :
+        """ Returns the approximate number of bytes used to store the
+        sequence, not counting Python object overhead.
+        """
+        return len(self._packed) + 16 * (len(self._ambiguous) + \
+               len(self._lower))
+
+def packFasta(dna_seqs) :
+    """ Returns a dictionary where keys = sequence identifiers and values =
+    PackedSequence of the DNA sequence for that record.  The dictionary can
+    be passed to the functions of dna_orfs and dna_nrepeats in place of the
+    one from read_fasta.readFasta.
+
+    dna_seqs - Dictionary where keys = sequence identifiers and values =
+    DNA seqeunce for that record, or an iterable of records as yielded by
+    read_fasta.iterFasta.
+    """
+    return {seq_id : PackedSequence(dna) \
+            for seq_id, dna in read_fasta.getSeqItems(dna_seqs)}
+
+def readPackedFasta(inFilePath) :
+    """ Reads the FASTA file inFilePath one record at a time into a
+    dictionary like read_fasta.readFasta but with PackedSequence values.
+    """
+    return packFasta(read_fasta.iterFasta(inFilePath))
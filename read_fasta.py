@@ -1,31 +1,109 @@
 
 
-def readFasta(inFilePath=".\dna.example.fasta") :
-    """ Reads a FASTA file inFilePath into a dictionary where
-    the sequence identifiers are the keys and the DNA
-    sequence for that record are the values.
-    
+import sys
+import stage_profile as prof
+import compressed_io as cio
+
+class DuplicateSeqIdError(ValueError) :
+    """ Raised when a FASTA file has two records with the same sequence
+    identifier.  Records are looked up and reported by identifier, so such
+    files are rejected rather than silently dropping or counting one.
+    """
+    def __init__(self, seq_id) :
+        super().__init__("Duplicate sequence id in FASTA file: {}".format(\
+                         seq_id))
+        self.seq_id = seq_id
+
+def iterFasta(inFilePath=".\dna.example.fasta", verbose=True) :
+    """ Opens the FASTA file inFilePath and returns an iterator that reads
+    it one record at a time and yields a 3-tuple for each record where:
+    tuple[0] - sequence identifier (everything right of > up to first space)
+    tuple[1] - description (rest of the header line, '' if there is none)
+    tuple[2] - DNA sequence for that record
+
+    Only the record currently being read is held in memory.  Sequence lines
+    are collected in a list and joined once when the record is complete.
+    gzip and BGZF compressed files are inflated as they are read (see
+    compressed_io.openFasta).
+
     Keyword aguments:
     inFilePath -- path to the FASTA file to be read
                   (default dna.example.fasta in current dir)
+    verbose -- if True (default), print a message when the file is opened
     """
     try:
-        f = open(inFilePath)
-        print("FASTA file read successfully.")
+        f = cio.openFasta(inFilePath)
+        if verbose : print("FASTA file read successfully.")
     except IOError:
         print("File doesn't exist!  Exiting.")
         sys.exit(0)
-        
+
+    records = iterFastaRecords(f)
+    return prof.profileRecords(records) if prof.ENABLED else records
+
+def iterFastaRecords(f) :
+    """ Generator that yields the records of the opened FASTA file f as
+    3-tuples (see iterFasta).  f is closed when all records are read.
+    Raises DuplicateSeqIdError when a sequence identifier is seen twice.
+    """
+    name = None     # No record seen yet
+    seen = set()    # Sequence identifiers read so far
+    with f :
+        for line in f :  # iterate thru lines in file
+            line = line.rstrip()       # remove trailing white space (\n)
+            if line.startswith('>') :  # header line: previous record done
+                if name is not None :
+                    yield (name, desc, ''.join(seq_lines))
+                words = line.split()   # Split on space
+                name = words[0][1:]    # Use everything right of > as id
+                if name in seen : raise DuplicateSeqIdError(name)
+                seen.add(name)
+                desc = line[len(words[0]):].strip()
+                seq_lines = []
+            elif name is not None :    # Sequence line: save until the
+                seq_lines.append(line) # end of the record.
+        if name is not None :
+            yield (name, desc, ''.join(seq_lines))
+
+def readFasta(inFilePath=".\dna.example.fasta") :
+    """ Reads a FASTA file inFilePath into a dictionary where
+    the sequence identifiers are the keys and the DNA
+    sequence for that record are the values.
+
+    Keyword aguments:
+    inFilePath -- path to the FASTA file to be read
+                  (default dna.example.fasta in current dir)
+    """
     dnaSeqs = {}    # init empty dict
-    for line in f:  # iterate thru lines in file
-        line = line.rstrip()       # remove trailing (right) white space (\n)
-        if line.startswith('>') :  # header line? Could also use line =='>'
-            words = line.split()   # Split on space
-            name = words[0][1:]    # Use everything right of > as dict key
-            dnaSeqs[name] = ''     # Add new key to dict (assign value later)
-        else :             # Line is not header, so append to the dna
-                           # sequence string until we get to end of sequence.
-            dnaSeqs[name] = dnaSeqs[name] + line
-    f.close()
-    
-    return dnaSeqs
\ No newline at end of file
+    for name, desc, dna in iterFasta(inFilePath) :
+        dnaSeqs[name] = dna
+
+    return dnaSeqs
+
+def getSeqItems(dna_seqs) :
+    """ Returns an iterator of (seq_id, dna) 2-tuples over dna_seqs so that
+    analysis functions can run over either input type in a single pass.
+
+    dna_seqs - Dictionary where keys = sequence identifiers and values =
+    DNA seqeunce for that record (see readFasta), or an iterable of
+    records whose first element is the sequence identifier and last
+    element is the DNA sequence (see iterFasta).
+    """
+    if hasattr(dna_seqs, 'items') :
+        return iter(dna_seqs.items())
+    return ((rec[0], rec[-1]) for rec in dna_seqs)
+
+def getSeq(dna_seqs, seq_id) :
+    """ Returns the DNA sequence for seq_id.  If dna_seqs supports lookup by
+    key it is used directly, otherwise records are read until seq_id is
+    found.  Raises KeyError if seq_id is not in dna_seqs.
+
+    dna_seqs - see getSeqItems
+    seq_id - sequence identifier of the record of interest
+    """
+    if hasattr(dna_seqs, '__getitem__') and hasattr(dna_seqs, 'keys') :
+        return dna_seqs[seq_id]
+    for sid, dna in getSeqItems(dna_seqs) :
+        if sid == seq_id :
+            return dna
+    raise KeyError(seq_id)
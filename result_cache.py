@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+import os, hashlib, pickle, tempfile
+
+# Persistent on-disk cache for intermediate analysis products (sequence
+# lengths, longest ORFs, most frequent repeats, ...).  Each product is
+# pickled to its own file named by a key made from a digest of the FASTA
+# file content, the name of the analysis and its parameters, so a changed
+# file never reuses stale results.  The cache is bounded in size: when it
+# grows past max_bytes, the least recently used entries are deleted.
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'analyze_fasta')
+DEFAULT_MAX_BYTES = 1024 ** 3   # 1 GiB
+
+def getFileDigest(inFilePath, block_size=1 << 20) :
+    """ Returns the hex SHA-256 digest of the content of inFilePath. """
+    sha = hashlib.sha256()
+    with open(inFilePath, 'rb') as f :
+        block = f.read(block_size)
+        while block :
+            sha.update(block)
+            block = f.read(block_size)
+
+    return sha.hexdigest()
+
+class ResultCache(object) :
+    """ Size-bounded LRU cache of pickled results in the directory
+    cache_dir.  Entries are files whose modification time is updated on
+    every hit, so the oldest modification time is the least recently used.
+    """
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR,
+                 max_bytes=DEFAULT_MAX_BYTES) :
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(cache_dir, 'digests'), exist_ok=True)
+
+    def getDigest(self, inFilePath) :
+        """ Returns the content digest of inFilePath (see getFileDigest).
+        Digests are remembered by path, size and mtime so an unchanged file
+        is only hashed once.
+        """
+        st = os.stat(inFilePath)
+        stamp = "{}\t{}\t{}".format(os.path.abspath(inFilePath),
+                                    st.st_size, st.st_mtime_ns)
+        stamp_path = os.path.join(self.cache_dir, 'digests',
+                     hashlib.sha256(stamp.encode()).hexdigest())
+        try :
+            with open(stamp_path) as f :
+                digest = f.read().strip()
+        except IOError :
+            digest = getFileDigest(inFilePath)
+            self._writeFile(stamp_path, digest.encode())
+            return digest
+        try :
+            os.utime(stamp_path)   # Mark as recently used
+        except OSError :
+            pass
+
+        return digest
+
+    def getKey(self, digest, analysis, params=None) :
+        """ Returns the cache key of the results of analysis run with the
+        dictionary params on the file with content digest digest.
+        """
+        params = sorted((params or {}).items())
+        key = repr((digest, analysis, params)).encode()
+        return hashlib.sha256(key).hexdigest()
+
+    def _getPath(self, key) :
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def _writeFile(self, path, data) :
+        """ Writes data to path atomically, so readers never see a partly
+        written entry.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try :
+            with os.fdopen(fd, 'wb') as f :
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException :
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, key) :
+        """ Returns the value stored under key.  Raises KeyError if there
+        is none.
+        """
+        path = self._getPath(key)
+        try :
+            with open(path, 'rb') as f :
+                value = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError) :
+            raise KeyError(key)
+        try :
+            os.utime(path)   # Mark as recently used
+        except OSError :
+            pass
+
+        return value
+
+    def put(self, key, value) :
+        """ Stores value under key, then evicts old entries if the cache is
+        over its size limit.
+        """
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes : return   # Would evict everything
+        self._writeFile(self._getPath(key), data)
+        self.evict()
+
+    def _iterEntries(self) :
+        """ Yields the os.DirEntry of every entry of the cache: the pickled
+        results and the remembered digests (see getDigest).
+        """
+        for entry in os.scandir(self.cache_dir) :
+            if entry.is_file() and entry.name.endswith('.pkl') :
+                yield entry
+        for entry in os.scandir(os.path.join(self.cache_dir, 'digests')) :
+            if entry.is_file() and not entry.name.startswith('tmp') :
+                yield entry
+
+    def evict(self) :
+        """ Deletes the least recently used entries, results and digests,
+        until the total size of the cache is at most max_bytes.
+        """
+        entries = []
+        total = 0
+        for entry in self._iterEntries() :
+            st = entry.stat()
+            entries.append((st.st_mtime_ns, st.st_size, entry.path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries :
+            if total <= self.max_bytes : break
+            try :
+                os.unlink(path)
+            except OSError :
+                pass
+            total -= size
+
+    def clear(self) :
+        """ Deletes every entry of the cache. """
+        for entry in list(self._iterEntries()) :
+            os.unlink(entry.path)
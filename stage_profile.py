@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+import sys, json, heapq, functools
+from time import perf_counter as now
+
+# Instrumentation of the analysis stages.  Each stage (parsing, ORF
+# scanning, sorting, k-mer counting, ...) has a timer and the hot paths add
+# to counters such as records parsed, bases scanned or ORFs emitted.  The
+# slowest records are also kept, with the stage and the time they took.
+#
+# Everything is off unless enable() is called.  Instrumented code checks the
+# module flag ENABLED once per call of a per-sequence function, never per
+# base, so a disabled profile costs one attribute lookup per call.  Worker
+# processes of dna_parallel collect their own profile and send it back with
+# their results, where it is merged into this one (see getSnapshot and
+# merge); their timers then add up the time spent in every worker.
+
+ENABLED = False
+MAX_RECORDS = 10   # Number of slowest records kept
+
+_timers = {}       # stage -> [calls, seconds]
+_counters = {}     # name -> count
+_records = []      # min-heap of (seconds, stage, seq_id, length)
+_started = None    # perf_counter() when enabled
+_active = set()    # Stages being timed by timed(), see below
+
+def enable(on=True) :
+    """ Turns profiling on (default) or off and clears what was collected. """
+    global ENABLED, _started
+    reset()
+    ENABLED = on
+    _started = now() if on else None
+
+def reset() :
+    """ Clears all timers, counters and record timings. """
+    _timers.clear()
+    _counters.clear()
+    del _records[:]
+
+def addTime(stage, start) :
+    """ Adds the time since start (a perf_counter() value) to the timer of
+    stage and counts one call.
+    """
+    timer = _timers.get(stage)
+    if timer is None :
+        timer = _timers[stage] = [0, 0.0]
+    timer[0] += 1
+    timer[1] += now() - start
+
+def addCount(name, n=1) :
+    """ Adds n to the counter name. """
+    _counters[name] = _counters.get(name, 0) + n
+
+def addRecordTime(stage, seq_id, length, seconds) :
+    """ Remembers that stage took seconds on the record seq_id of the given
+    length, if it is one of the MAX_RECORDS slowest seen so far.
+    """
+    item = (seconds, stage, seq_id, length)
+    if len(_records) < MAX_RECORDS :
+        heapq.heappush(_records, item)
+    elif item > _records[0] :
+        heapq.heapreplace(_records, item)
+
+def timed(stage) :
+    """ Decorator that adds the time of every call of the function to the
+    timer of stage while profiling is enabled.  Calls made while stage is
+    already being timed (e.g. a function that processes a long record in
+    windows by calling itself on each one) are part of the outer call and
+    aren't counted again.
+    """
+    def decorator(func) :
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs) :
+            if not ENABLED or stage in _active :
+                return func(*args, **kwargs)
+            _active.add(stage)
+            start = now()
+            try :
+                return func(*args, **kwargs)
+            finally :
+                _active.discard(stage)
+                addTime(stage, start)
+        return wrapper
+    return decorator
+
+def profileRecords(records, stage='parse') :
+    """ Generator that yields the (seq_id, ..., dna) records of the iterable
+    records, timing the work done to produce each of them under stage and
+    counting records and bases parsed.
+    """
+    records = iter(records)
+    while True :
+        start = now()
+        try :
+            record = next(records)
+        except StopIteration :
+            return
+        addTime(stage, start)
+        addCount('records_parsed')
+        addCount('bases_parsed', len(record[-1]))
+        yield record
+
+def getSnapshot() :
+    """ Returns a dictionary with everything collected so far, which can be
+    saved as JSON or merged into another profile (see merge):
+    'timers' - dictionary stage -> {'calls' : n, 'seconds' : s}
+    'counters' - dictionary name -> count
+    'slowest_records' - list of dictionaries with the stage, seq_id, length
+                        and seconds of the slowest records, slowest first
+    'total_seconds' - time since enable() was called
+    """
+    return {'timers' : {stage : {'calls' : calls, 'seconds' : seconds} \
+                        for stage, (calls, seconds) in _timers.items()},
+            'counters' : dict(_counters),
+            'slowest_records' : [{'stage' : stage, 'seq_id' : seq_id,
+                                  'length' : length, 'seconds' : seconds} \
+                                 for seconds, stage, seq_id, length \
+                                 in sorted(_records, reverse=True)],
+            'total_seconds' : now() - _started if _started else 0.0}
+
+def merge(snapshot) :
+    """ Adds the timers, counters and record timings of snapshot (see
+    getSnapshot), usually from a worker process, to this profile.
+    """
+    for stage, timer in snapshot['timers'].items() :
+        total = _timers.setdefault(stage, [0, 0.0])
+        total[0] += timer['calls']
+        total[1] += timer['seconds']
+    for name, count in snapshot['counters'].items() :
+        addCount(name, count)
+    for record in snapshot['slowest_records'] :
+        addRecordTime(record['stage'], record['seq_id'], record['length'],
+                      record['seconds'])
+
+def printReport(out=sys.stderr) :
+    """ Prints a table of the stage timers, the counters and the slowest
+    records to out (stderr by default).
+    """
+    snapshot = getSnapshot()
+    total = snapshot['total_seconds']
+    print("Profile (total {:.3f} s)".format(total), file=out)
+    print("{:<24} {:>10} {:>11} {:>7}".format("stage", "calls", "seconds",
+                                             "%"), file=out)
+    for stage, timer in sorted(snapshot['timers'].items(),
+                               key=lambda item : -item[1]['seconds']) :
+        share = 100.0 * timer['seconds'] / total if total else 0.0
+        print("{:<24} {:>10} {:>11.4f} {:>6.1f}%".format(stage,
+              timer['calls'], timer['seconds'], share), file=out)
+    if snapshot['counters'] :
+        print("{:<24} {:>10}".format("counter", "value"), file=out)
+        for name, count in sorted(snapshot['counters'].items()) :
+            print("{:<24} {:>10}".format(name, count), file=out)
+    if snapshot['slowest_records'] :
+        print("Slowest records:", file=out)
+        for record in snapshot['slowest_records'] :
+            print("{:>11.4f} s  {:<26} {:>10} bases  {}".format(\
+                  record['seconds'], record['stage'], record['length'],
+                  record['seq_id']), file=out)
+
+def writeReport(outFilePath) :
+    """ Writes the profile (see getSnapshot) as JSON to outFilePath. """
+    with open(outFilePath, 'w') as f :
+        json.dump(getSnapshot(), f, indent=2)
@@ -0,0 +1,416 @@
+#!/usr/bin/python3
+import sys, os, json, struct
+import numpy as np
+import fasta_index as fidx, dna_kmers as kmers
+import stage_profile as prof
+
+# Suffix array index of a FASTA file for repeat and motif queries of any
+# length.  The sequences are encoded into base codes (see dna_kmers: A=0,
+# C=1, G=2, T=3, anything else=4) and the suffixes of each sequence are
+# sorted, sequence after sequence, so the suffixes of one sequence that
+# start with a given motif are next to each other.  Next to the suffix array
+# is the LCP array: the length of the prefix each suffix shares with the one
+# before it.  Then:
+# - the number of occurances of a motif in each sequence is the size of the
+#   range of its suffixes starting with the motif, found by binary search
+#   in every sequence at once
+# - the repeats of size n of a sequence are the runs of its suffixes whose
+#   LCP is at least n, so the most frequent ones of every sequence come
+#   from one pass over the LCP array, for any n
+# The results are the same as those of dna_nrepeats and dna_kmers:
+# overlapping occurances, case is ignored and stretches with bases other
+# than A, C, G or T never match.
+#
+# The index is built once (with NumPy, by prefix doubling) and saved next to
+# the FASTA file as <file>.sfx with the size and modification time of the
+# file, so a stale index is never used.  Opening it memory maps its arrays:
+# a motif lookup only reads the pages its binary search touches and the
+# repeats are counted one block of the suffix array at a time, so neither
+# needs memory in proportion to the file.  Requires NumPy.
+#
+# Limits: the build holds the whole file in memory, about 40 bytes per base
+# plus 4 bytes per base for each doubling round (the rank arrays are kept
+# for the LCP array).  A round doubles the length of the prefixes sorted,
+# so there are about log2 of the longest repeated stretch + 2 rounds: 6 or 7
+# for typical sequences, about 80 bytes per base in all, up to about 120
+# for long tandem repeats.  The index file takes about 6 bytes per base: 1
+# for the base codes, 4 for the suffix array (8 past 2**31 bases) and 1 for
+# the LCP array (2 or 4 if repeats are longer than 255 or 65535 bases).
+# Build the index of files larger than memory allows on a bigger machine
+# and copy the .sfx file along with the FASTA file, keeping its mtime.
+
+BASE_CHARS = np.frombuffer(b'acgtn', dtype=np.uint8)   # Decodes base codes
+SFX_MAGIC = b'SFXIDX2\n'
+ARRAYS = ('starts', 'codes', 'sa', 'lcp', 'breaks')   # Saved, in this order
+BLOCK_SIZE = 1 << 20   # Suffixes per block when scanning the LCP array
+
+def getSuffixIndexPath(inFilePath) :
+    """ Returns the path of the suffix index kept next to inFilePath. """
+    return inFilePath + ".sfx"
+
+def _getFileStamp(inFilePath) :
+    st = os.stat(inFilePath)
+    return [st.st_size, st.st_mtime_ns]
+
+def _getIndexType(n) :
+    """ Returns the smallest signed integer dtype that holds 0 .. n. """
+    return np.int32 if n < 1 << 31 else np.int64
+
+def _getNarrowType(top) :
+    """ Returns the smallest unsigned dtype that holds 0 .. top. """
+    for dtype in (np.uint8, np.uint16, np.uint32) :
+        if top <= np.iinfo(dtype).max : return dtype
+    return np.uint64
+
+def buildSuffixArray(codes, ends) :
+    """ Returns a 2-tuple (suffix array, LCP array) of the sequences whose
+    base codes are concatenated in codes, a uint8 array, where ends gives
+    the end offset in codes of the sequence of each position.  Suffixes are
+    sorted by sequence, then by their bases; a suffix that is a prefix of
+    another one comes first.  LCP[i] is the length of the common prefix of
+    the suffixes SA[i - 1] and SA[i] (0 for i = 0 or across sequences).
+    The LCP array has the smallest unsigned dtype that holds its values.
+    """
+    n = len(codes)
+    itype = _getIndexType(n)
+    if n == 0 :
+        return (np.zeros(0, dtype=itype), np.zeros(0, dtype=np.uint8))
+    # Initial ranks: the sequence, then the first base, made dense.
+    first = np.zeros(n, dtype=np.int64)
+    first[1:] = ends[1:] != ends[:-1]
+    np.cumsum(first, out=first)   # Index of the sequence of each base
+    present = np.zeros((int(first[-1]) + 1) * 5, dtype=itype)
+    first = first * 5 + codes
+    present[first] = 1
+    dense = np.cumsum(present, dtype=itype) - 1
+    rank = dense[first]
+    top = int(dense[-1])   # Highest rank
+    del first, present, dense
+    history = [rank]   # Ranks of prefixes of 2**k bases
+    order = None
+    h = 1
+    while top < n - 1 :
+        # Sort by the ranks of the first h bases, then of the next h (0 past
+        # the end of the sequence).  Both fit in one int64 key unless the
+        # file has more than about 3e9 bases.
+        second = np.zeros(n, dtype=np.int64)
+        inside = np.flatnonzero(np.arange(n, dtype=itype) < ends - h)
+        second[inside] = rank[inside + h]
+        second[inside] += 1
+        del inside
+        if (top + 2) ** 2 < 1 << 63 :
+            second += rank.astype(np.int64) * (top + 2)
+            order = np.argsort(second)
+            second = second[order]
+            change = second[1:] != second[:-1]
+        else :
+            order = np.lexsort((second, rank))
+            second = second[order]
+            change = second[1:] != second[:-1]
+            change |= rank[order[1:]] != rank[order[:-1]]
+        del second
+        rank = np.empty(n, dtype=itype)
+        rank[order[0]] = 0
+        rank[order[1:]] = np.cumsum(change, dtype=itype)
+        top = int(rank[order[-1]])
+        del change
+        history.append(rank)
+        h *= 2
+    if order is None : order = np.argsort(rank)   # Ranks already distinct
+    sa = order.astype(itype)
+    del order, rank
+    # LCP of each pair of neighbours by binary lifting over the ranks of
+    # prefixes of 2**k bases, longest first, BLOCK_SIZE pairs at a time.
+    lcp = np.zeros(n, dtype=itype)
+    for block in range(1, n, BLOCK_SIZE) :
+        a = sa[block - 1:block - 1 + BLOCK_SIZE]
+        b = sa[block:block + BLOCK_SIZE]
+        a = a[:len(b)]
+        a_ends, b_ends = ends[a], ends[b]
+        block_lcp = np.zeros(len(b), dtype=itype)
+        for k in range(len(history) - 1, -1, -1) :
+            pa, pb = a + block_lcp, b + block_lcp
+            equal = (pa < a_ends) & (pb < b_ends)
+            ranks = history[k]
+            np.minimum(pa, n - 1, out=pa)
+            np.minimum(pb, n - 1, out=pb)
+            equal &= ranks[pa] == ranks[pb]
+            block_lcp[equal] += 1 << k
+        lcp[block:block + len(b)] = block_lcp
+    del history
+
+    return (sa, lcp.astype(_getNarrowType(int(lcp.max()))))
+
+class SuffixIndex(object) :
+    """ Suffix array index (see top of this module) of sequences.  The
+    arrays can be in memory or memory mapped from an index file.
+
+    seq_ids - list of the sequence identifiers, in record order
+    starts - array with the offset in codes of each sequence and, last, the
+             length of codes
+    codes - uint8 array with the base codes of all the sequences
+    sa, lcp - suffix and LCP arrays (see buildSuffixArray)
+    breaks - sorted array with the offset in codes of every base other than
+             A, C, G or T
+    """
+    def __init__(self, seq_ids, starts, codes, sa, lcp, breaks) :
+        self.seq_ids = list(seq_ids)
+        self.starts = starts
+        self.codes = codes
+        self.sa, self.lcp, self.breaks = sa, lcp, breaks
+
+    def _getRuns(self, positions, stops) :
+        """ Returns an array with the number of A's, C's, G's and T's in a
+        row from each offset in positions, within its sequence.  stops is
+        breaks followed by the length of codes.
+        """
+        seq_ends = np.asarray(self.starts)[np.searchsorted(self.starts,
+                                                           positions,
+                                                           side='right')]
+        return np.minimum(stops[np.searchsorted(stops, positions)],
+                          seq_ends) - positions
+
+    def _getSeqs(self, positions) :
+        """ Returns an array with the index of the sequence of each offset
+        in positions.
+        """
+        return np.searchsorted(self.starts, positions, side='right') - 1
+
+    @prof.timed('suffix_lookup')
+    def countRepeat(self, repeat) :
+        """ Returns an array with the number of (possibly overlapping)
+        occurances of the string repeat in each sequence, ignoring case.
+        """
+        motif = np.frombuffer(kmers.encodeDna(repeat), dtype=np.uint8)
+        counts = np.zeros(len(self.seq_ids), dtype=np.int64)
+        if len(motif) == 0 or (motif == kmers.AMBIGUOUS).any() :
+            return counts
+        lower = self._searchSuffixes(motif, False)
+        upper = self._searchSuffixes(motif, True)
+
+        return upper - lower
+
+    def _searchSuffixes(self, motif, after) :
+        """ Returns an array with, for each sequence, the index in the
+        suffix array of its first suffix whose first len(motif) bases are
+        not less than motif (after = False) or greater than motif (after =
+        True).  All the sequences are searched together.
+        """
+        m = len(motif)
+        starts = np.asarray(self.starts)
+        lo, hi = starts[:-1].copy(), starts[1:].copy()
+        offsets = np.arange(m, dtype=np.int64)
+        motif = motif.astype(np.int16)
+        active = np.flatnonzero(lo < hi)
+        while len(active) :
+            mid = (lo[active] + hi[active]) // 2
+            positions = self.sa[mid].astype(np.int64)[:, None] + offsets
+            # Past the end of its sequence a suffix is smaller than any base.
+            inside = positions < starts[active + 1][:, None]
+            prefixes = np.where(inside, self.codes[np.minimum(positions,
+                                len(self.codes) - 1)].astype(np.int16), -1)
+            differ = prefixes != motif
+            has_diff = differ.any(axis=1)
+            first_diff = differ.argmax(axis=1)
+            less = has_diff & (prefixes[np.arange(len(mid)), first_diff] < \
+                               motif[first_diff])
+            go_right = less | ~has_diff if after else less
+            lo[active] = np.where(go_right, mid + 1, lo[active])
+            hi[active] = np.where(go_right, hi[active], mid)
+            active = active[lo[active] < hi[active]]
+
+        return lo
+
+    @prof.timed('suffix_lookup')
+    def getMostFrequentRepeats(self, n) :
+        """ Returns a list with a 2-tuple (seq_id, 2-tuple as returned by
+        dna_nrepeats.getMostFrequentRepeatsInSeq for repeat size n) for each
+        sequence, in record order.  The suffix array is read in blocks of
+        BLOCK_SIZE suffixes.
+        """
+        best = {}   # Sequence -> [count, offsets of the first occurances]
+        if n >= 1 :
+            carry = None   # (count, first) of the repeat open at block end
+            size = len(self.sa)
+            stops = np.append(self.breaks, len(self.codes))
+            for block in range(0, size, BLOCK_SIZE) :
+                carry = self._addBlockRepeats(n, block,
+                        min(block + BLOCK_SIZE, size), stops, carry, best)
+        result = []
+        for seq, seq_id in enumerate(self.seq_ids) :
+            if seq not in best :
+                result.append((seq_id, (-1, [])))
+                continue
+            count, firsts = best[seq]
+            repeats = [BASE_CHARS[self.codes[first:first + n]].tobytes()\
+                       .decode() for first in sorted(firsts)]
+            result.append((seq_id, (count, repeats)))
+
+        return result
+
+    def _addBlockRepeats(self, n, block, block_end, stops, carry, best) :
+        """ Adds the repeats of size n whose suffixes are in [block,
+        block_end) of the suffix array to best (see getMostFrequentRepeats),
+        continuing carry, the repeat left open by the previous block.
+        Returns the repeat left open by this block, None at the end.  stops
+        is as in _getRuns.
+        """
+        positions = self.sa[block:block_end].astype(np.int64)
+        valid = np.flatnonzero(self._getRuns(positions, stops) >= n)
+        if len(valid) == 0 :
+            counts = np.zeros(0, dtype=np.int64)
+            firsts = np.zeros(0, dtype=np.int64)
+            continues = False
+        else :
+            # Each run of suffixes that share their first n bases is a repeat.
+            new_group = self.lcp[block:block_end][valid] < n
+            continues = carry is not None and valid[0] == 0 and \
+                        not new_group[0]
+            new_group[0] = True
+            group_starts = np.flatnonzero(new_group)
+            counts = np.diff(np.append(group_starts, len(valid)))
+            firsts = np.minimum.reduceat(positions[valid], group_starts)
+        if continues :
+            counts[0] += carry[0]
+            firsts[0] = min(firsts[0], carry[1])
+        elif carry is not None :
+            counts = np.append(carry[0], counts)
+            firsts = np.append(carry[1], firsts)
+        carry = None
+        if block_end < len(self.sa) and len(valid) and \
+           valid[-1] == block_end - block - 1 :
+            carry = (int(counts[-1]), int(firsts[-1]))
+            counts, firsts = counts[:-1], firsts[:-1]
+        if len(counts) == 0 : return carry
+        group_seqs = self._getSeqs(firsts)
+        seq_starts = np.flatnonzero(np.concatenate(([True],
+                                    group_seqs[1:] != group_seqs[:-1])))
+        seq_ends = np.append(seq_starts[1:], len(group_seqs))
+        for start, end in zip(seq_starts, seq_ends) :
+            seq_counts = counts[start:end]
+            count = int(seq_counts.max())
+            seq_firsts = firsts[start:end][seq_counts == count].tolist()
+            seq_best = best.setdefault(int(group_seqs[start]), [count, []])
+            if count > seq_best[0] :
+                best[int(group_seqs[start])] = [count, seq_firsts]
+            elif count == seq_best[0] :
+                seq_best[1].extend(seq_firsts)
+
+        return carry
+
+def buildSuffixIndex(data_fasta) :
+    """ Returns the SuffixIndex of the records of data_fasta, a dictionary
+    like fasta_index.IndexedFasta or read_fasta.readFasta.
+    """
+    seq_ids, lengths, parts = [], [], []
+    for seq_id, dna in data_fasta.items() :
+        seq_ids.append(seq_id)
+        lengths.append(len(dna))
+        parts.append(kmers.encodeDna(dna))
+    codes = np.frombuffer(b''.join(parts), dtype=np.uint8)
+    if prof.ENABLED : start = prof.now()
+    starts = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+    lengths = np.diff(starts)
+    # End of the sequence of each base
+    ends = np.repeat(starts[1:].astype(_getIndexType(len(codes))), lengths)
+    sa, lcp = buildSuffixArray(codes, ends)
+    del ends
+    breaks = np.flatnonzero(codes == kmers.AMBIGUOUS).astype(np.int64)
+    index = SuffixIndex(seq_ids, starts, codes, sa, lcp, breaks)
+    if prof.ENABLED : prof.addTime('suffix_build', start)
+
+    return index
+
+def writeSuffixIndex(index, indexPath, stamp) :
+    """ Saves index to indexPath with stamp, the (size, mtime) of the FASTA
+    file it was built from: SFX_MAGIC, the length of the header (8 bytes),
+    a JSON header with the stamp, the sequence ids and the dtype, length and
+    offset (after the header) of each array in ARRAYS, then the arrays,
+    each aligned on 8 bytes so they can be memory mapped.
+    """
+    arrays = [np.ascontiguousarray(getattr(index, name)) for name in ARRAYS]
+    offsets = np.cumsum([0] + [_align(array.nbytes) for array in arrays])
+    layout = [(array.dtype.str, len(array), int(offset)) \
+              for array, offset in zip(arrays, offsets)]
+    header = json.dumps({'stamp' : [int(x) for x in stamp],
+                         'seq_ids' : index.seq_ids,
+                         'arrays' : layout}).encode()
+    with open(indexPath, 'wb') as f :
+        f.write(SFX_MAGIC + struct.pack('<Q', len(header)) + header)
+        f.write(b'\0' * (_getDataOffset(len(header)) - f.tell()))
+        for array in arrays :
+            f.write(array.tobytes())
+            f.write(b'\0' * (_align(array.nbytes) - array.nbytes))
+
+def _align(size) :
+    return (size + 7) & ~7
+
+def _getDataOffset(header_size) :
+    """ Returns the offset in an index file of its first array. """
+    return _align(len(SFX_MAGIC) + 8 + header_size)
+
+def readSuffixIndex(indexPath) :
+    """ Returns a 2-tuple (stamp, SuffixIndex) saved in indexPath.  The
+    arrays are memory mapped, not read.  Raises ValueError if indexPath is
+    not an index file.
+    """
+    with open(indexPath, 'rb') as f :
+        if f.read(len(SFX_MAGIC)) != SFX_MAGIC :
+            raise ValueError("Not a suffix index: " + indexPath)
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size).decode())
+    base = _getDataOffset(header_size)
+    arrays = [np.memmap(indexPath, dtype=dtype, mode='r', offset=base + offset,
+                        shape=(length, )) if length else \
+              np.zeros(0, dtype=dtype) \
+              for dtype, length, offset in header['arrays']]
+
+    return (header['stamp'], SuffixIndex(header['seq_ids'], *arrays))
+
+def loadSuffixIndex(inFilePath, build=False) :
+    """ Returns the SuffixIndex of inFilePath saved next to it if it is up
+    to date.  Otherwise builds and saves it if build is True, or returns
+    None.
+    """
+    stamp = _getFileStamp(inFilePath)
+    indexPath = getSuffixIndexPath(inFilePath)
+    try :
+        index_stamp, index = readSuffixIndex(indexPath)
+        if index_stamp == stamp :
+            return index
+    except (IOError, ValueError, KeyError, struct.error) :
+        pass   # Missing or unreadable index
+    if not build : return None
+    with fidx.IndexedFasta(inFilePath) as data_fasta :
+        index = buildSuffixIndex(data_fasta)
+    try :
+        writeSuffixIndex(index, indexPath, stamp)
+    except IOError :
+        pass
+
+    return index
+
+class SuffixIndexedFasta(fidx.IndexedFasta) :
+    """ fasta_index.IndexedFasta of inFilePath with its SuffixIndex as
+    suffix_index.  The functions of dna_nrepeats that count repeats use it
+    when given one as dna_seqs.  Raises ValueError if there is no up to
+    date index and build is False.
+    """
+    def __init__(self, inFilePath, build=False) :
+        super().__init__(inFilePath)
+        self.suffix_index = loadSuffixIndex(inFilePath, build)
+        if self.suffix_index is None :
+            self.close()
+            raise ValueError("No up to date suffix index for " + inFilePath)
+
+def main() :
+    if len(sys.argv) != 2 :
+        print("usage: suffix_index.py FASTAFILE\nBuilds the suffix index of "
+              "FASTAFILE (FASTAFILE.sfx) used by analyze_fasta.py")
+        return 2
+    index = loadSuffixIndex(sys.argv[1], build=True)
+    print("Indexed {} sequences, {} bases in {}".format(len(index.seq_ids),
+          len(index.codes), getSuffixIndexPath(sys.argv[1])))
+
+if __name__ == "__main__" :
+    sys.exit(main())
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+import hashlib, json, sqlite3
+import read_fasta as rf, dna_orfs as orf, dna_nrepeats as nreps
+import dna_parallel as parallel, stage_profile as prof
+
+# Persistent per-record summaries of a FASTA file in an SQLite database, so
+# that a file which grows (or has a few records changed) between runs only
+# has its new or changed records analyzed.  Each record is keyed by its
+# sequence identifier and a digest of its sequence and has:
+# - its length
+# - the shortest and longest ORF of each reading frame analyzed so far
+# - the number of occurances and the list of the most frequent repeats of
+#   each repeat size analyzed so far (see getMostFrequentRepeatsInSeq)
+# which is all the file-level answers of analyze_fasta.getShortLongSeqs,
+# getShortLongestORFsInAll, getFirstMostFrequentRepeatN and
+# getAllMostFrequentRepeatN need: they are merged from the summaries in
+# record order, exactly as the functions merge their per-record results.
+# The database is meant for one FASTA file; summaries of records that are
+# no longer in the file are deleted after each pass.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    seq_id TEXT, digest TEXT, length INTEGER,
+    PRIMARY KEY (seq_id, digest));
+CREATE TABLE IF NOT EXISTS orfs (
+    seq_id TEXT, digest TEXT, frame INTEGER,
+    shortest_start INTEGER, shortest_length INTEGER,
+    longest_start INTEGER, longest_length INTEGER,
+    PRIMARY KEY (seq_id, digest, frame));
+CREATE TABLE IF NOT EXISTS repeats (
+    seq_id TEXT, digest TEXT, n INTEGER, count INTEGER, repeats TEXT,
+    PRIMARY KEY (seq_id, digest, n));
+"""
+
+def getSummaryDbPath(inFilePath) :
+    """ Returns the path of the summary database kept next to inFilePath. """
+    return inFilePath + ".sdb"
+
+def getSeqDigest(dna) :
+    """ Returns the hex SHA-256 digest of the sequence dna, a string, a
+    packed_seqs.PackedSequence or a dna_chunks.ChunkedSeq which is read one
+    window at a time.  The digest is the same for the same bases whatever
+    the type of dna.
+    """
+    sha = hashlib.sha256()
+    if hasattr(dna, 'getWindows') :
+        for window in dna.getWindows() :
+            sha.update(window.readSeq()[0].encode())
+    else :
+        sha.update(str(dna).encode())
+
+    return sha.hexdigest()
+
+def summarizeSeq(dna, reading_frames=(), kmer_sizes=(), backend='python') :
+    """ Returns the summary of the sequence dna as a 3-tuple:
+    tuple[0] - length of dna
+    tuple[1] - dictionary where keys are the reading frames in
+               reading_frames and values are 2-tuples (shortest ORF,
+               longest ORF) as picked by
+               dna_orfs.getFramesShortAndLongestORF, each None if the frame
+               has no ORF
+    tuple[2] - dictionary where keys are the repeat sizes in kmer_sizes and
+               values are the 2-tuples of
+               dna_nrepeats.getMostFrequentRepeatsInSeq
+
+    backend - ORF backend, see dna_orfs.getFramesORFs
+    """
+    frames_orf = orf.getFramesShortAndLongestORF(dna, reading_frames,
+                 backend) if reading_frames else {}
+    repeats = {n : nreps.getMostFrequentRepeatsInSeq(dna, n) \
+               for n in kmer_sizes}
+
+    return (len(dna), frames_orf, repeats)
+
+class SummaryDB(object) :
+    """ The summary database dbPath (see top of this module), created if it
+    doesn't exist.
+    """
+    def __init__(self, dbPath) :
+        self.path = dbPath
+        self._db = sqlite3.connect(dbPath)
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self) :
+        return self
+
+    def __exit__(self, *exc) :
+        self.close()
+
+    def close(self) :
+        self._db.close()
+
+    def getSummary(self, seq_id, digest, reading_frames=(), kmer_sizes=()) :
+        """ Returns the stored summary (see summarizeSeq) of the record
+        seq_id with sequence digest digest for reading_frames and
+        kmer_sizes, or None if any part of it isn't stored.
+        """
+        row = self._db.execute("SELECT length FROM records WHERE seq_id = ? \
+                               AND digest = ?", (seq_id, digest)).fetchone()
+        if row is None : return None
+        frames_orf = {}
+        if reading_frames :
+            for frame, s_start, s_len, l_start, l_len in self._db.execute(\
+                "SELECT frame, shortest_start, shortest_length, \
+                longest_start, longest_length FROM orfs WHERE seq_id = ? AND \
+                digest = ?", (seq_id, digest)) :
+                frames_orf[frame] = (None if s_start is None else \
+                                     (s_start, s_len),
+                                     None if l_start is None else \
+                                     (l_start, l_len))
+            if any(rframe not in frames_orf for rframe in reading_frames) :
+                return None
+        repeats = {}
+        if kmer_sizes :
+            for n, count, nrepeats in self._db.execute("SELECT n, count, \
+                repeats FROM repeats WHERE seq_id = ? AND digest = ?",
+                (seq_id, digest)) :
+                repeats[n] = (count, json.loads(nrepeats))
+            if any(n not in repeats for n in kmer_sizes) :
+                return None
+
+        return (row[0],
+                {rframe : frames_orf[rframe] for rframe in reading_frames},
+                {n : repeats[n] for n in kmer_sizes})
+
+    def putSummary(self, seq_id, digest, summary) :
+        """ Stores summary (see summarizeSeq) for the record seq_id with
+        sequence digest digest, replacing what was stored for the same
+        frames and repeat sizes.  Call commit() to save it.
+        """
+        length, frames_orf, repeats = summary
+        self._db.execute("INSERT OR REPLACE INTO records VALUES (?, ?, ?)",
+                         (seq_id, digest, length))
+        self._db.executemany("INSERT OR REPLACE INTO orfs VALUES \
+                             (?, ?, ?, ?, ?, ?, ?)",
+            [(seq_id, digest, rframe) + (shortest or (None, None)) + \
+             (longest or (None, None)) \
+             for rframe, (shortest, longest) in frames_orf.items()])
+        self._db.executemany("INSERT OR REPLACE INTO repeats VALUES \
+                             (?, ?, ?, ?, ?)",
+            [(seq_id, digest, n, count, json.dumps(nrepeats)) \
+             for n, (count, nrepeats) in repeats.items()])
+
+    def commit(self) :
+        self._db.commit()
+
+    def prune(self, keep) :
+        """ Deletes the summaries of the records whose (seq_id, digest) is
+        not in the set keep.
+        """
+        stale = [key for key in self._db.execute("SELECT seq_id, digest FROM \
+                 records") if key not in keep]
+        for table in ('records', 'orfs', 'repeats') :
+            self._db.executemany("DELETE FROM {} WHERE seq_id = ? AND \
+                                 digest = ?".format(table), stale)
+        self.commit()
+
+    def updateSummaries(self, dna_seqs, reading_frames=(), kmer_sizes=(),
+                        backend='python', jobs=1) :
+        """ Returns a list with a 2-tuple (seq_id, summary as returned by
+        summarizeSeq) for each record of dna_seqs, in record order.  Stored
+        summaries are reused, the other records are analyzed (on jobs
+        worker processes, see dna_parallel.mapSeqs) and their summaries
+        stored.  Summaries of records no longer in dna_seqs are deleted.
+
+        dna_seqs - Dictionary where keys = sequence identifiers and values =
+        DNA seqeunce for that record, or an iterable of records as yielded
+        by read_fasta.iterFasta.
+        """
+        reading_frames = list(reading_frames)
+        kmer_sizes = list(kmer_sizes)
+        keys = []        # (seq_id, digest) of each record, in order
+        summaries = {}   # (seq_id, digest) -> summary
+
+        def _iterMissing() :
+            for seq_id, dna in rf.getSeqItems(dna_seqs) :
+                key = (seq_id, getSeqDigest(dna))
+                keys.append(key)
+                if key in summaries : continue   # Duplicate record
+                summary = self.getSummary(seq_id, key[1], reading_frames,
+                                          kmer_sizes)
+                if summary is None :
+                    yield (key, dna)
+                else :
+                    summaries[key] = summary
+
+        computed = 0
+        for key, summary in parallel.mapSeqs(summarizeSeq, _iterMissing(),
+                            (reading_frames, kmer_sizes, backend), jobs) :
+            summaries[key] = summary
+            self.putSummary(key[0], key[1], summary)
+            computed += 1
+        self.commit()
+        self.prune(set(keys))
+        if prof.ENABLED :
+            prof.addCount('records_summarized', computed)
+            prof.addCount('records_reused', len(keys) - computed)
+
+        return [(key[0], summaries[key]) for key in keys]
+
+def getShortLongestORFsInAll(summaries, want_shortest=True, reading_frame=1) :
+    """ Returns the 3-tuple of dna_orfs.getShortLongestORFsInAll (without
+    printing the reading frames) from summaries, as returned by
+    SummaryDB.updateSummaries for the frames of reading_frame.  Returns -1
+    if reading_frame is not valid.
+    """
+    rframes = orf.getReadingFrames(reading_frame)
+    if rframes is None : return -1
+    pick = 0 if want_shortest else 1
+    seqs_frames_orf = ((seq_id, {rframe : frames_orf[rframe][pick] \
+                                 for rframe in rframes}) \
+                       for seq_id, (length, frames_orf, repeats) in summaries)
+
+    return orf.mergeShortLongestORFs(seqs_frames_orf, rframes, want_shortest)
+
+def getFirstMostFrequentRepeatN(summaries, n) :
+    """ Returns the result of dna_nrepeats.getFirstMostFrequentRepeatN from
+    summaries, as returned by SummaryDB.updateSummaries for repeat size n.
+    """
+    return nreps.mergeFirstMostFrequentRepeat(\
+           (seq_id, repeats[n]) for seq_id, (length, frames_orf, repeats) \
+           in summaries)
+
+def getAllMostFrequentRepeatN(summaries, n) :
+    """ Returns the result of dna_nrepeats.getAllMostFrequentRepeatN from
+    summaries, as returned by SummaryDB.updateSummaries for repeat size n.
+    """
+    return nreps.mergeMostFrequentRepeats(\
+           (seq_id, repeats[n]) \
+           for seq_id, (length, frames_orf, repeats) in summaries)